@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the BGP import phase (BGP.compute_imported_routes)
+versus the number of BGP neighbors.
+A router R0 has N eBGP neighbors, each announces the same prefixes
+and R0 applies a symbolic import route map to each of them.
+Prints a CSV row per number of neighbors at the end.
+"""
+
+import argparse
+
+from ipaddress import ip_interface
+from timeit import default_timer as timer
+
+from tekton.bgp import Announcement
+from tekton.bgp import BGP_ATTRS_ORIGIN
+from tekton.bgp import Community
+from tekton.bgp import RouteMap
+from tekton.bgp import RouteMapLine
+from tekton.graph import NetworkGraph
+
+from synet.synthesis.connected import ConnectedSyn
+from synet.synthesis.new_propagation import EBGPPropagation
+from synet.utils.bgp_utils import compute_next_hop_map
+from synet.utils.bgp_utils import extract_all_next_hops
+from synet.utils.common import PathReq
+from synet.utils.common import Protocols
+from synet.utils.fnfree_smt_context import SolverContext
+from synet.utils.smt_context import VALUENOTSET
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def get_star_topo(num_neighbors, num_prefixes, num_communities):
+    """
+    Return the topology and the announcements of R0 connected to
+    N eBGP neighbors R1, ..., RN
+    """
+    topo = NetworkGraph()
+    center = 'R0'
+    topo.add_router(center)
+    topo.set_bgp_asnum(center, 100)
+    communities = [Community("100:%d" % i) for i in range(num_communities)]
+    anns = []
+    for index in range(1, num_neighbors + 1):
+        neighbor = 'R%d' % index
+        topo.add_router(neighbor)
+        topo.set_bgp_asnum(neighbor, 1000 + index)
+        topo.add_router_edge(center, neighbor)
+        topo.add_router_edge(neighbor, center)
+        topo.add_bgp_neighbor(center, neighbor,
+                              router_a_iface=VALUENOTSET,
+                              router_b_iface=VALUENOTSET)
+        topo.set_loopback_addr(
+            neighbor, 'lo0', ip_interface(u'10.%d.%d.1/32' % (index / 256, index % 256)))
+        for prefix in range(num_prefixes):
+            anns.append(Announcement(
+                prefix='Prefix%d' % prefix, peer=neighbor,
+                origin=BGP_ATTRS_ORIGIN.EBGP,
+                as_path=[1000 + index], as_path_len=1,
+                next_hop='%sHop' % neighbor, local_pref=100, med=10,
+                communities=dict((comm, False) for comm in communities),
+                permitted=True))
+        rline = RouteMapLine(None, None, VALUENOTSET, 10)
+        rmap = RouteMap('Imp_%s' % neighbor, [rline])
+        topo.add_route_map(center, rmap)
+        topo.add_bgp_import_route_map(center, neighbor, rmap.name)
+    for ann in anns:
+        topo.add_bgp_advertise(node=ann.peer, announcement=ann, loopback='lo0')
+    reqs = [PathReq(Protocols.BGP, dst_net='Prefix%d' % prefix,
+                    path=[center, 'R1'], strict=False)
+            for prefix in range(num_prefixes)]
+    return topo, reqs, anns
+
+
+def run(num_neighbors, num_prefixes, num_communities):
+    """
+    :return: (import time at R0, registered constraints, created vars)
+    """
+    topo, reqs, anns = get_star_topo(num_neighbors, num_prefixes, num_communities)
+    connected = ConnectedSyn(reqs, topo, full=True)
+    connected.synthesize()
+    next_hops = extract_all_next_hops(compute_next_hop_map(topo))
+    peers = [node for node in topo.routers_iter() if topo.is_bgp_enabled(node)]
+    ctx = SolverContext.create_context(anns, next_hop_list=next_hops,
+                                       peer_list=peers, create_as_paths=False)
+    propagation = EBGPPropagation(reqs, topo, ctx)
+    propagation.compute_dags()
+    propagation.synthesize()
+    box = propagation.ibgp_propagation.node['R0']['box']
+    return box.import_time, len(ctx._tracked), ctx.get_num_vars()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the BGP import phase versus the number of neighbors.')
+    parser.add_argument('--neighbors', type=int, nargs='+',
+                        default=[2, 4, 8, 16, 32, 64],
+                        help='numbers of BGP neighbors')
+    parser.add_argument('--prefixes', type=int, default=4,
+                        help='number of prefixes announced by each neighbor')
+    parser.add_argument('--communities', type=int, default=4,
+                        help='number of communities')
+    args = parser.parse_args()
+
+    rows = ["neighbors,prefixes,import_time,constraints,vars,total_time"]
+    for num_neighbors in args.neighbors:
+        t1 = timer()
+        import_time, num_constraints, num_vars = run(
+            num_neighbors, args.prefixes, args.communities)
+        t2 = timer()
+        rows.append("%d,%d,%f,%d,%d,%f" % (
+            num_neighbors, args.prefixes, import_time, num_constraints,
+            num_vars, t2 - t1))
+    # The synthesizers are verbose, print the table at the end
+    print "\n".join(rows)
+
+
+if __name__ == '__main__':
+    main()
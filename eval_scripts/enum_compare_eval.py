@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Compare the 'pairwise' and the 'rank' encodings of the enum compare
+functions (SolverContext.create_enum_compare).
+The enum sizes are the number of next hops of the given topologies
+(the size of the next hop sort of the eBGP experiments in
+new_ebgp_eval.py) or the given synthetic sizes, but the comparisons are
+synthetic: the synthesizers don't create compare functions, so this is
+not a benchmark of the eBGP workloads.
+Prints a CSV row per (size, encoding) at the end.
+"""
+
+import argparse
+import os
+import random
+
+from timeit import default_timer as timer
+import z3
+
+from synet.synthesis.connected import ConnectedSyn
+from synet.utils.bgp_utils import compute_next_hop_map
+from synet.utils.bgp_utils import extract_all_next_hops
+from synet.utils.fnfree_smt_context import SolverContext
+from synet.utils.fnfree_smt_context import sanitize_smt_name
+from synet.utils.topo_gen import read_topology_zoo_netgraph
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def get_next_hops(topo_file):
+    """The next hops of the eBGP experiments on a topology"""
+    topo = read_topology_zoo_netgraph(topo_file)
+    connected = ConnectedSyn([], topo, full=True)
+    connected.synthesize()
+    next_hops = extract_all_next_hops(compute_next_hop_map(topo))
+    return [sanitize_smt_name(next_hop) for next_hop in set(next_hops)]
+
+
+def run(values, encoding, num_vars, seed):
+    """
+    Compare random pairs of num_vars symbolic values, the expected
+    results follow a hidden assignment and order of the values
+    (so the constraints are satisfiable under both encodings)
+    :return: (result, number of constraints, check time)
+    """
+    rand = random.Random(seed)
+    ctx = SolverContext(z3.Context())
+    vsort = ctx.create_enum_type('NextHopSort', values)
+    func = ctx.create_enum_compare('NextHopSort', encoding=encoding)
+    GREATER, LESS, EQUAL, INCOMPLETE = ctx.compare_vars
+    rank = dict((value, index) for index, value in
+                enumerate(rand.sample(values, len(values))))
+    variables = [(ctx.create_fresh_var(vsort), rand.choice(values))
+                 for _ in range(num_vars)]
+    for _ in range(num_vars):
+        (var1, value1), (var2, value2) = rand.sample(variables, 2)
+        if rank[value1] > rank[value2]:
+            expected = GREATER
+        elif rank[value1] < rank[value2]:
+            expected = LESS
+        else:
+            expected = EQUAL
+        ctx.register_constraint(func(var1.var, var2.var) == expected)
+    # Pin some of the values
+    for var, value in rand.sample(variables, num_vars / 4):
+        ctx.register_constraint(var.var == vsort.get_symbolic_value(value))
+    solver = z3.Solver(ctx=ctx.z3_ctx)
+    t1 = timer()
+    ret = ctx.check(solver, track=False, set_model=False)
+    t2 = timer()
+    return ret, len(solver.assertions()), t2 - t1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the encodings of the enum compare functions.')
+    parser.add_argument('topos', nargs='*',
+                        help='graphml topologies, the enum values are '
+                             'their next hops')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[],
+                        help='synthetic enum sizes')
+    parser.add_argument('--vars', type=int, default=20,
+                        help='number of compared symbolic values')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the random generator')
+    args = parser.parse_args()
+
+    workloads = []
+    for topo_file in args.topos:
+        workloads.append((os.path.basename(topo_file), get_next_hops(topo_file)))
+    for size in args.sizes:
+        workloads.append(('synthetic', ['V%d' % i for i in range(size)]))
+    rows = ["workload,values,encoding,sat,constraints,check_time"]
+    for name, values in workloads:
+        for encoding in ['pairwise', 'rank']:
+            ret, num_constraints, check_time = run(
+                values, encoding, min(args.vars, len(values)), args.seed)
+            rows.append("%s,%d,%s,%s,%d,%f" % (
+                name, len(values), encoding, ret, num_constraints,
+                check_time))
+    # One CSV row per workload and encoding
+    print "\n".join(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -41,6 +41,8 @@ from synet.utils.fnfree_smt_context import SolverContext
 from synet.utils.fnfree_smt_context import VALUENOTSET
 from synet.utils.fnfree_smt_context import is_empty
 from synet.utils.fnfree_smt_context import read_announcements
+from synet.utils.smt_cache import SMTCache
+from synet.utils.smt_portfolio import SolverPortfolio
 from synet.utils.topo_gen import read_topology_zoo_netgraph
 
 from synet.utils.bgp_utils import compute_next_hop_map
@@ -1061,6 +1063,20 @@ def main():
     parser.add_argument(
         '--fixed', type=float, default=1,
         help='The percentage of fixed holes (0 to 1)')
+    parser.add_argument(
+        '--portfolio', type=int, default=0,
+        help='Number of parallel solver configurations (different seeds) '
+             'to run each Z3 check on, 0 to disable')
+    parser.add_argument(
+        '--selection', type=str, default='pairwise',
+        choices=['pairwise', 'rank'],
+        help='The encoding of the BGP route selection')
+    parser.add_argument(
+        '--smt-cache', type=str, default=None,
+        help='Directory to cache the Z3 check results across runs')
+    parser.add_argument(
+        '--no-fold', action='store_true',
+        help='Give the constraints to Z3 without partially evaluating them')
     parser.add_argument('--seed', type=int, default=0,
                         help='The seed of the random generator')
 
@@ -1076,6 +1092,8 @@ def main():
     reqs_file = args.values
     seed = args.seed
     sketch_type = args.sketch
+    portfolio = SolverPortfolio(workers=args.portfolio) if args.portfolio else None
+    smt_cache = SMTCache(args.smt_cache) if args.smt_cache else None
 
     assert 0 <= fixed <= 1.0
 
@@ -1152,21 +1170,25 @@ def main():
     t2 = timer()
     prep = t2 - t1
     t1 = timer()
-    p.synthesize()
+    p.synthesize(encoding=args.selection)
     t2 = timer()
     bgp_syn = t2 -t1
     t1 = timer()
     solver = z3.Solver(ctx=ctx.z3_ctx)
-    ret = ctx.check(solver)
+    ret = ctx.check(solver, portfolio=portfolio, fold=not args.no_fold,
+                    cache=smt_cache)
     t2 = timer()
     z3_syn = t2 - t1
     end = timer()
     assert ret == z3.sat, solver.unsat_core()
 
+    print "Selection encoding:", args.selection
     print "Propagation Synthesis Time:", prep
     print "BGP partial eval Time:", bgp_syn
     print "Z3 Synthesis Time:", z3_syn
     print "TOTAL SYN TIME:", end - begin
+    if smt_cache:
+        print "SMT CACHE:", smt_cache.get_stats()
     p.update_network_graph()
 
 
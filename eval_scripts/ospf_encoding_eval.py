@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Compare the integer and the bit-vector encodings of the OSPF link costs
+on the requirement sets of the topologies in the given directories.
+Prints a CSV row per (topology, requirement set, encoding) at the end.
+"""
+
+import argparse
+import glob
+import os
+import random
+
+from timeit import default_timer as timer
+from synet.utils.topo_gen import read_topology_zoo_netgraph
+from synet.utils.smt_context import VALUENOTSET
+from synet.synthesis.ospf_heuristic import OSPFSyn as OSPFCEGIS
+from synet.synthesis.connected import ConnectedSyn
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def get_reqs(reqs_file, req_type, reqsize, k):
+    """Read the requirements of the given type and size from a reqs file"""
+    values = {}
+    with open(reqs_file, 'r') as file:
+        exec(file.read(), values)
+    if req_type == 'simple':
+        name = 'reqs_simple_%d' % reqsize
+    else:
+        name = 'reqs_%s_%d_%d' % (req_type, reqsize, k)
+    return values.get(name)
+
+
+def run(topo_file, reqs, encoding, path_gen, path_gen_strategy, seed, timeout):
+    """Synthesize the costs of one requirement set with one encoding"""
+    topo = read_topology_zoo_netgraph(topo_file)
+    for node in topo.nodes():
+        topo.enable_ospf(node, 100)
+    for src, dst in topo.edges():
+        topo.set_edge_ospf_cost(src, dst, VALUENOTSET)
+    conn = ConnectedSyn([], topo, full=True)
+    conn.synthesize()
+    ospf = OSPFCEGIS(topo, gen_paths=path_gen, random_obj=random.Random(seed),
+                     path_gen_strategy=path_gen_strategy, encoding=encoding)
+    if timeout:
+        ospf.solver.set('timeout', timeout * 1000)
+    for req in reqs:
+        ospf.add_req(req)
+    t1 = timer()
+    ret = ospf.synthesize()
+    t2 = timer()
+    max_cost = None
+    if ret:
+        max_cost = max([cost for _, _, cost in ospf.get_output_configs()])
+    return ret, len(ospf.solver_times), sum(ospf.solver_times), t2 - t1, max_cost
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the int and bv encodings of OSPF costs.')
+    parser.add_argument('--dirs', nargs='+', default=['topos/small', 'topos/mid'],
+                        help='directories of graphml files and their '
+                             '<name>_ospf_reqs.py requirement sets')
+    parser.add_argument('--type', type=str, default='simple',
+                        choices=['simple', 'ecmp', 'kconnected', 'order'])
+    parser.add_argument('--reqsizes', type=int, nargs='+', default=[1, 4, 16],
+                        help='Number of reqs to be used')
+    parser.add_argument('-k', type=int, default=2,
+                        help='Number of paths used per requirement')
+    parser.add_argument('-p', type=int, default=100,
+                        help='number of generated paths for each round')
+    parser.add_argument('--path-gen', type=str, default='random',
+                        choices=['random', 'kshortest'])
+    parser.add_argument('--seed', type=int, default=0,
+                        help='The seed of the random generator')
+    parser.add_argument('--timeout', type=int, default=600,
+                        help='Z3 timeout in seconds per check, 0 to disable')
+    args = parser.parse_args()
+
+    rows = ["topo,type,reqsize,encoding,sat,iterations,z3_time,total_time,max_cost"]
+    for topo_dir in args.dirs:
+        for topo_file in sorted(glob.glob(os.path.join(topo_dir, '*.graphml'))):
+            basename = os.path.basename(topo_file)[:-len('.graphml')]
+            reqs_file = os.path.join(topo_dir, '%s_ospf_reqs.py' % basename)
+            if not os.path.exists(reqs_file):
+                continue
+            for reqsize in args.reqsizes:
+                reqs = get_reqs(reqs_file, args.type, reqsize, args.k)
+                if reqs is None:
+                    continue
+                for encoding in ['int', 'bv']:
+                    ret, iterations, z3_time, total, max_cost = run(
+                        topo_file, reqs, encoding, args.p, args.path_gen,
+                        args.seed, args.timeout)
+                    rows.append("%s,%s,%d,%s,%s,%d,%f,%f,%s" % (
+                        basename, args.type, reqsize, encoding, ret,
+                        iterations, z3_time, total, max_cost))
+    # The synthesizers are verbose, print the table at the end
+    print "\n".join(rows)
+
+
+if __name__ == '__main__':
+    main()
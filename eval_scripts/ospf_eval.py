@@ -9,8 +9,15 @@ import os
 from timeit import default_timer as timer
 from synet.utils.topo_gen import read_topology_zoo_netgraph
 from synet.utils.smt_context import VALUENOTSET
+from synet.utils.smt_cache import SMTCache
+from synet.utils.smt_portfolio import SolverPortfolio
+from synet.utils.smt_portfolio import default_configs
+from synet.utils.telemetry import JSONLinesSink
+from synet.utils.telemetry import Telemetry
 from synet.synthesis.ospf_heuristic import OSPFSyn as OSPFCEGIS
 from synet.synthesis.ospf import OSPFSyn as OSPFConcrete
+from synet.synthesis.ospf_distance import OSPFSyn as OSPFDistance
+from synet.synthesis.ospf_decompose import OSPFPlanner
 from synet.synthesis.connected import ConnectedSyn
 
 
@@ -46,15 +53,45 @@ def main():
     parser.add_argument('--reqsize', type=int, required=True,
                         help='Number of reqs to be used')
     parser.add_argument('--syn', required=True, type=str,
-                        choices=['cegis', 'concrete'],
+                        choices=['cegis', 'concrete', 'distance', 'decompose'],
                         help='simple, ecmp, kconnected, ordered')
     parser.add_argument('-k', type=int, default=2,
                         help='Number of paths used per requirement (ecmp, ordered, etc..)')
     parser.add_argument(
         '-p', type=int, default=100,
         help='number of generated random paths for each round of synthesis')
+    parser.add_argument(
+        '--path-gen', type=str, default='random',
+        choices=['random', 'kshortest'],
+        help='How CEGIS generates paths: random or the k shortest paths '
+             'under the current model costs (k is set by -p)')
+    parser.add_argument(
+        '--max-history', type=int, default=None,
+        help='Max number of generated paths remembered per requirement '
+             '(cegis, default no limit)')
+    parser.add_argument(
+        '--encoding', type=str, default='int', choices=['int', 'bv'],
+        help='Encode the link costs as integers or 16-bit bit-vectors '
+             '(cegis and concrete)')
+    parser.add_argument(
+        '--failures', type=int, default=1,
+        help='Number of link failures order and kconnected reqs must survive')
+    parser.add_argument(
+        '--portfolio', type=int, default=0,
+        help='Number of parallel solver configurations (different seeds) '
+             'to run each Z3 check on, 0 to disable')
+    parser.add_argument(
+        '--smt-cache', type=str, default=None,
+        help='Directory to cache the Z3 check results across runs')
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help='Number of processes for --syn decompose '
+             '(default the number of CPUs)')
     parser.add_argument('--seed', type=int, default=0,
                         help='The seed of the random generator')
+    parser.add_argument(
+        '--telemetry', type=str, default=None,
+        help='Append a JSON record per synthesis iteration to this file')
     parser.add_argument(
         '--fixed', type=float, default=0,
         help='The percentage of fixed edge costs of the total edges (0 to 1)')
@@ -69,7 +106,19 @@ def main():
     path_gen = args.p
     seed = args.seed
     fixed = args.fixed
+    failures = args.failures
+    path_gen_strategy = args.path_gen
     syn = args.syn
+    # Only cegis and concrete encode the costs as bit-vectors
+    if args.encoding == 'bv' and syn in ['cegis', 'concrete']:
+        logic = 'QF_BV'
+    else:
+        logic = 'QF_LIA'
+    portfolio = SolverPortfolio(
+        default_configs(args.portfolio, logics=[None, logic]),
+        workers=args.portfolio) if args.portfolio else None
+    smt_cache = SMTCache(args.smt_cache) if args.smt_cache else None
+    telemetry = Telemetry()
     print "Syntype", syn
     assert 0 <= fixed <= 1.0
 
@@ -79,6 +128,10 @@ def main():
         print "Generated new seed", seed
     # This random generator MUST be used everywhere!!!!
     ospfRand = random.Random(seed)
+    if args.telemetry:
+        telemetry = Telemetry(
+            [JSONLinesSink(args.telemetry)], topo=os.path.basename(topo_file),
+            syn=syn, req_type=req_type, reqsize=reqsize, fixed=fixed, seed=seed)
 
     topo = read_topology_zoo_netgraph(topo_file)
 
@@ -117,21 +170,53 @@ def main():
     t1 = timer()
     if syn == 'cegis':
         print "Syn CEGIS"
-        ospf = OSPFCEGIS(topo, gen_paths=path_gen, random_obj=ospfRand)
+        ospf = OSPFCEGIS(topo, gen_paths=path_gen, random_obj=ospfRand,
+                         max_failures=failures,
+                         path_gen_strategy=path_gen_strategy,
+                         encoding=args.encoding,
+                         max_history=args.max_history)
+        ospf.portfolio = portfolio
+        ospf.smt_cache = smt_cache
+        ospf.telemetry = telemetry
         for req in reqs:
             ospf.add_req(req)
         assert ospf.synthesize()
         assert not ospf.removed_reqs
+        print "Z3 TIME PER ITERATION:", ospf.solver_times
     elif syn == "concrete":
         print "Syn Concrete"
-        ospf = OSPFConcrete(topo)
+        ospf = OSPFConcrete(topo, encoding=args.encoding)
+        ospf.portfolio = portfolio
+        ospf.smt_cache = smt_cache
+        ospf.telemetry = telemetry
         for req in reqs:
             ospf.add_req(req)
         assert ospf.solve()
+    elif syn == "distance":
+        print "Syn Distance"
+        ospf = OSPFDistance(topo)
+        ospf.portfolio = portfolio
+        ospf.smt_cache = smt_cache
+        ospf.telemetry = telemetry
+        for req in reqs:
+            ospf.add_req(req)
+        assert ospf.synthesize()
+    elif syn == "decompose":
+        print "Syn Decompose"
+        ospf = OSPFPlanner(topo, reqs, workers=args.workers,
+                           gen_paths=path_gen, seed=seed,
+                           smt_cache=smt_cache)
+        ospf.telemetry = telemetry
+        assert ospf.synthesize()
+        print "GROUPS:", len(ospf.groups)
+        print "GROUP SYN TIME PER ROUND:", ospf.group_times
     else:
         raise ValueError("Unknow syn type %s" % syn)
     t2 = timer()
+    telemetry.close()
     print "TOTAL SYN TIME:", t2 - t1
+    if smt_cache:
+        print "SMT CACHE:", smt_cache.get_stats()
     if fixed == 1.0:
         t1 = timer()
         print "Updating network graph, to assert full values"
@@ -0,0 +1,23 @@
+#!/usr/bin/env bash
+
+# Compare the pairwise and the rank encodings of the BGP route selection
+# on the order requirements
+NUM_PROCESSES=1
+NUM_REPEATS=1
+
+
+for file in topos/small/Arnes topos/small/Bics topos/small/Canerie topos/small/Renater2008 topos/small/CrlNetworkServices topos/mid/Columbus topos/mid/Esnet topos/mid/Latnet topos/mid/Sinet topos/mid/Uninett2011;
+do
+topo="${file}.graphml"
+values="${file}_ospf_reqs.py "
+    for reqs in 1 2 4 8 16;
+    do
+        for selection in "pairwise" "rank";
+        do
+            for RUN_ID in $(seq 1 $NUM_REPEATS);
+            do
+                echo $topo $values order $reqs 0 abs $RUN_ID $selection
+            done
+        done
+    done
+done | xargs -n 8 -I{} -P $NUM_PROCESSES sh -c "sh ./eval_scripts/run-ebgp.sh {}"
@@ -10,16 +10,20 @@ REQS=$4
 FIXED=$5
 SKETCH=$6
 RUN_ID=$7
+SELECTION=${8:-pairwise}
 
 BASE=$(basename $TOPO | sed 's/.graphml//')
 
 LOG_FILE="$PATH_TO_LOGS/$BASE-$SKETCH-$REQ_TYPE-$REQS-$FIXED-$RUN_ID.txt"
+if [ "$SELECTION" != "pairwise" ]; then
+    LOG_FILE="$PATH_TO_LOGS/$BASE-$SKETCH-$REQ_TYPE-$REQS-$FIXED-$RUN_ID-$SELECTION.txt"
+fi
 
-echo "Running topology=$BASE reqs_type=$REQ_TYPE num_reqs=$REQS fixed=$FIXED sketch=$SKETCH run-id=$RUN_ID"
-echo "Command $SYNET_SCRIPT $TOPO --values=$VALUES --type=$REQ_TYPE --reqsize=$REQS --fixed=$FIXED --sketch=$SKETCH"
+echo "Running topology=$BASE reqs_type=$REQ_TYPE num_reqs=$REQS fixed=$FIXED sketch=$SKETCH run-id=$RUN_ID selection=$SELECTION"
+echo "Command $SYNET_SCRIPT $TOPO --values=$VALUES --type=$REQ_TYPE --reqsize=$REQS --fixed=$FIXED --sketch=$SKETCH --selection=$SELECTION"
 
 START=$(date +%s)
-stdbuf -oL $SYNET_SCRIPT $TOPO --values=$VALUES --type=$REQ_TYPE --reqsize=$REQS --fixed=$FIXED --sketch=$SKETCH > $LOG_FILE 2>&1
+stdbuf -oL $SYNET_SCRIPT $TOPO --values=$VALUES --type=$REQ_TYPE --reqsize=$REQS --fixed=$FIXED --sketch=$SKETCH --selection=$SELECTION > $LOG_FILE 2>&1
 END=$(date +%s)
 
 TIME=$((END-START))
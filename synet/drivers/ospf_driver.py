@@ -54,6 +54,10 @@ def main():
         '-u', type=int, default=0,
         help='number of unsatisfiable requirements,'
              'it is added to the total number of requirements')
+    parser.add_argument(
+        '--relax', action='store_true', default=False,
+        help='retract the conflicting requirements (MaxSMT) '
+             'instead of failing the synthesis')
     parser.add_argument('--seed', type=int, default=0,
                         help='The seed of the random generator')
     parser.add_argument(
@@ -69,6 +73,7 @@ def main():
     unsatisfiable_reqs = args.u
     topology_file = args.f
     fixed = args.fixed
+    relax = args.relax
 
     # Generate new random number seed if need
     if not seed:
@@ -139,13 +144,17 @@ def main():
     if unsatisfiable_reqs:
         print "Generating counter paths"
     chosen = []
+    # Paths without an alternative path
+    skipped = []
     for i in range(unsatisfiable_reqs):
         candidate = ospfRand.choice(paths)
         counter_path = None
         while counter_path is None:
-            while candidate in chosen:
+            while candidate in chosen or candidate in skipped:
                 candidate = ospfRand.choice(paths)
-            counter_path = generate_second_path(g, candidate)
+            counter_path = generate_second_path(g, candidate, ospfRand)
+            if counter_path is None:
+                skipped.append(candidate)
         chosen.append(candidate)
         print "Generating counter path for path", candidate
         paths.append(counter_path)
@@ -156,7 +165,16 @@ def main():
         req = PathReq(Protocols.OSPF, path[-1], path, False)
         ospf.add_req(req)
 
-    ospf.synthesize(retries_before_rest=10)
+    ret = ospf.synthesize(retries_before_rest=10, relax=relax)
+    print "Z3 time per iteration:", ospf.solver_times
+    if relax:
+        print "Number of removed requirements: %d (expected at least %d)" % (
+            len(ospf.removed_reqs), unsatisfiable_reqs)
+        for req in ospf.removed_reqs:
+            print "\tRemoved", req.path
+    if not ret:
+        print "Requirements are unsatisfiable"
+        return
     ospf.update_network_graph()
     print "OSPF Edge cost"
     for src, dst in g.edges():
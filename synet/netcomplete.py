@@ -14,6 +14,8 @@ import z3
 
 from synet.synthesis.connected import ConnectedSyn
 from synet.synthesis.new_propagation import EBGPPropagation
+from synet.synthesis.ospf_decompose import OSPFPlanner
+from synet.synthesis.ospf_distance import OSPFSyn as OSPFDistance
 from synet.synthesis.ospf_heuristic import OSPFSyn as OSPFCEGIS
 
 from synet.utils.bgp_utils import compute_next_hop_map
@@ -22,6 +24,10 @@ from synet.utils.common import PathReq
 from synet.utils.common import Protocols
 from synet.utils.fnfree_smt_context import SolverContext
 from synet.utils.fnfree_smt_context import desanitize_smt_name
+from synet.utils.ospf_utils import synthesize_ospf_announce
+from synet.utils.smt_cache import SMTCache
+from synet.utils.smt_portfolio import SolverPortfolio
+from synet.utils.smt_portfolio import default_configs
 
 from tekton.gns3 import GNS3Topo
 from tekton.graph import NetworkGraph
@@ -68,6 +74,13 @@ class NetCompleteConfigs(object):
                  default_ospf_process_id=100,
                  auto_enable_ospf_link_costs=True,
                  bgp_smt='smt.smt2',
+                 ospf_synthesizer='cegis',
+                 portfolio_workers=0,
+                 ospf_workers=None,
+                 smt_cache=None,
+                 smt_cache_size=1000,
+                 bgp_selection='pairwise',
+                 fold_constraints=True,
                  ):
         """
 
@@ -78,11 +91,38 @@ class NetCompleteConfigs(object):
                 costs on all links that are part of OSPF requirements, even if
                 not enabled by the sketch
         :param bgp_smt: a filename to dump the SMT formula for BGP. To disable set to None
+        :param ospf_synthesizer: the OSPF synthesis engine, either 'cegis',
+                'distance' (distance labels encoding without path enumeration),
+                or 'decompose' (CEGIS on independent groups of requirements
+                in parallel)
+        :param ospf_workers: number of processes for 'decompose',
+                default the number of CPUs
+        :param portfolio_workers: run each SMT check on this many parallel
+                solver configurations (different random seeds),
+                0 to use a single solver
+        :param smt_cache: a directory to cache the results of the SMT checks,
+                so the formulas seen before are not solved again.
+                To disable set to None
+        :param smt_cache_size: max number of cached results
+        :param bgp_selection: the encoding of the BGP route selection,
+                either 'pairwise' (compare each pair of announcements)
+                or 'rank' (compare the preference keys of the announcements)
+        :param fold_constraints: partially evaluate the BGP constraints
+                before giving them to the SMT solver
         """
+        assert ospf_synthesizer in ['cegis', 'distance', 'decompose']
+        assert bgp_selection in ['pairwise', 'rank']
         self.auto_enable_ospf_process = auto_enable_ospf_process
         self.default_ospf_process_id = default_ospf_process_id
         self.auto_enable_ospf_link_costs = auto_enable_ospf_link_costs
         self.bgp_smt = bgp_smt
+        self.ospf_synthesizer = ospf_synthesizer
+        self.portfolio_workers = portfolio_workers
+        self.ospf_workers = ospf_workers
+        self.smt_cache = smt_cache
+        self.smt_cache_size = smt_cache_size
+        self.bgp_selection = bgp_selection
+        self.fold_constraints = fold_constraints
 
 
 class NetComplete(object):
@@ -103,6 +143,10 @@ class NetComplete(object):
         self._bgp_ctx = None
         self._bgp_synthesizer = None
         self._bgp_solver = None
+        self._smt_cache = None
+        if self.configs.smt_cache:
+            self._smt_cache = SMTCache(self.configs.smt_cache,
+                                       self.configs.smt_cache_size)
 
     @property
     def bgp_ctx(self):
@@ -119,6 +163,11 @@ class NetComplete(object):
         """The SMT Solver used for BGP"""
         return self._bgp_solver
 
+    @property
+    def smt_cache(self):
+        """The SMTCache shared by all the solvers (None if disabled)"""
+        return self._smt_cache
+
     @property
     def bgp_reqs(self):
         """All BGP requirements"""
@@ -156,6 +205,13 @@ class NetComplete(object):
                                            create_as_paths=create_as_paths)
         return ctx
 
+    def _create_portfolio(self, logics=(None,)):
+        """Return a SolverPortfolio or None if it's disabled"""
+        workers = self.configs.portfolio_workers
+        if not workers:
+            return None
+        return SolverPortfolio(default_configs(workers, logics), workers)
+
     def synthesize_connected(self):
         if not self.connected_syn.synthesize():
             msg = "Couldn't establish basic connectivity"
@@ -172,10 +228,16 @@ class NetComplete(object):
                   "the following BGP selection order cannot be met: " \
                   "{}".format(unmatching_order)
             raise UnImplementableRequirements(msg)
-        self.bgp_synthesizer.synthesize()
+        self.bgp_synthesizer.synthesize(encoding=self.configs.bgp_selection)
         #SMT Solving
         self._bgp_solver = z3.Solver(ctx=self._bgp_ctx.z3_ctx)
-        if self.bgp_ctx.check(self.bgp_solver, track=True, out_smt=self.configs.bgp_smt) != z3.sat:
+        portfolio = self._create_portfolio()
+        # The constraints are only tracked to get the unsat core
+        if self.bgp_ctx.check(self.bgp_solver, track=False, track_unsat=True,
+                              out_smt=self.configs.bgp_smt,
+                              portfolio=portfolio,
+                              fold=self.configs.fold_constraints,
+                              cache=self.smt_cache) != z3.sat:
             msg = "Unimplementable BGP requirements;" \
                   "Possibly change the requirements or loosen the sketch." \
                   "The following constraints couldn't be satisfied:" \
@@ -295,7 +357,12 @@ class NetComplete(object):
 
     def _check_next_hops(self):
         not_announced = []
-        for node, attrs in self.bgp_synthesizer.ibgp_propagation.nodes(data=True):
+        nodes = list(self.bgp_synthesizer.ibgp_propagation.nodes(data=True))
+        # Read the values from the model at once
+        self.bgp_ctx.eval_vars(
+            var for _, attrs in nodes for ann in attrs['box'].selected_sham
+            for var in (ann.permitted, ann.next_hop))
+        for node, attrs in nodes:
             for ann in attrs['box'].selected_sham:
                 if not ann.permitted.get_value():
                     # Announcement has been dropped
@@ -345,16 +412,48 @@ class NetComplete(object):
         check, msg = self._check_reqs()
         if not check:
             raise SketchError(msg)
-        seed = 0
-        ospfRand = random.Random(seed)
-        path_gen = 100
-        ospf = OSPFCEGIS(network_graph=self.topo,
-                         gen_paths=path_gen,
-                         random_obj=ospfRand)
-        for req in self.ospf_reqs:
-            ospf.add_req(req)
-        ospf.synthesize()
-        ospf.update_network_graph()
+        reqs = self.ospf_reqs
+        checker = None
+        if self.configs.ospf_synthesizer != 'cegis':
+            # Validate the concrete costs before building any encoding
+            # and only encode the requirements that the symbolic edges
+            # can affect (the CEGIS synthesizer does it on its own)
+            checker = OSPFCEGIS(network_graph=self.topo)
+            checker.add_reqs(self.ospf_reqs)
+            reqs = checker.check_concrete_costs()
+            if not reqs:
+                checker.update_network_graph()
+                return
+        if self.configs.ospf_synthesizer == 'decompose':
+            planner = OSPFPlanner(self.topo, reqs,
+                                  workers=self.configs.ospf_workers,
+                                  smt_cache=self.smt_cache)
+            if not planner.synthesize():
+                msg = "Unimplementable OSPF requirements"
+                raise UnImplementableRequirements(msg)
+            planner.update_network_graph()
+        else:
+            if self.configs.ospf_synthesizer == 'distance':
+                ospf = OSPFDistance(network_graph=self.topo)
+            else:
+                seed = 0
+                ospfRand = random.Random(seed)
+                path_gen = 100
+                ospf = OSPFCEGIS(network_graph=self.topo,
+                                 gen_paths=path_gen,
+                                 random_obj=ospfRand)
+            # OSPF constraints are pure linear integer arithmetic
+            ospf.portfolio = self._create_portfolio(logics=(None, 'QF_LIA'))
+            ospf.smt_cache = self.smt_cache
+            for req in reqs:
+                ospf.add_req(req)
+            ospf.synthesize()
+            ospf.update_network_graph()
+        if checker is not None:
+            # The engine only announced the networks of the encoded
+            # requirements, the ones that already hold need them too
+            synthesize_ospf_announce(
+                self.topo, checker.ospf_graph, self.ospf_reqs)
 
     def synthesize(self):
         self.synthesize_connected()
@@ -8,6 +8,8 @@ import logging
 import networkx as nx
 import z3
 
+from timeit import default_timer as timer
+
 from tekton.bgp import Announcement
 from tekton.bgp import MatchIpPrefixListList
 from tekton.bgp import MatchCommunitiesList
@@ -155,7 +157,15 @@ class BGP(object):
         self.export_ctx = {}
         self.generated_ospf_reqs = []
         self._cache = {}
+        # Variables shared by the announcements of a BGP session,
+        # keyed by (neighbor, attribute)
+        self._session_vars = {}
+        # Time to compute the imported routes in synthesize()
+        self.import_time = 0
         self.selection_constraints = {}  # Cache constraints used for the BGP selection
+        # The preference key of each announcement for the 'rank' encoding,
+        # keyed by (PropagatedInfo, with MED)
+        self._rank_keys = {}
 
     def create_symbolic_announcements(self):
         """
@@ -291,27 +301,37 @@ class BGP(object):
                                self.node, neighbor, neighbor_exported.keys())
                 continue
             imported = {}
+            next_hop_sort = self.ctx.get_enum_type(NEXT_HOP_SORT)
+            next_hop = self.next_hop_map[self.node][neighbor]
+            # The variables of the session are shared by all its announcements
+            session_next_hop = self._get_session_var(
+                neighbor, 'next_hop', next_hop_sort, next_hop)
+            if is_ebgp_neighbor:
+                session_local_pref = self._get_session_var(
+                    neighbor, 'local_pref', z3.IntSort(self.ctx.z3_ctx),
+                    DEFAULT_LOCAL_PREF)
+                self._cache[(self.node, neighbor)] = (
+                    True, session_next_hop, session_next_hop)
             for prop, ann in neighbor_exported[self.node].iteritems():
                 assert prop in self.anns_map
                 ann = copy.copy(ann)  # Shallow copy
-                next_hop_sort = self.ctx.get_enum_type(NEXT_HOP_SORT)
-                next_hop = self.next_hop_map[self.node][neighbor]
                 if is_ebgp_neighbor:
-                    ann.local_pref = self.ctx.create_fresh_var(
-                        z3.IntSort(self.ctx.z3_ctx),
-                        value=DEFAULT_LOCAL_PREF)
-                    next_hop_var = self.ctx.create_fresh_var(next_hop_sort, value=next_hop)
-                    ann.next_hop = next_hop_var
-                    self._cache[(self.node, neighbor)] = (True, ann.next_hop, next_hop_var)
+                    ann.local_pref = session_local_pref
+                    ann.next_hop = session_next_hop
                 else:
-                    next_hop_var = self.ctx.create_fresh_var(next_hop_sort, value=None)
                     prev_next_hop = ann.next_hop
-                    ann.next_hop = next_hop_var
-                    self.ctx.register_constraint(
-                        z3.If(prev_next_hop.var == self.ctx.origin_next_hop_var,
-                              next_hop_var.var == next_hop_sort.get_symbolic_value(next_hop),
-                              next_hop_var.var == prev_next_hop.var,
-                              self.ctx.z3_ctx) == True)
+                    if prev_next_hop.is_concrete:
+                        # Partially evaluate the next hop
+                        if prev_next_hop.get_value() == self.ctx.origin_next_hop:
+                            ann.next_hop = session_next_hop
+                    else:
+                        next_hop_var = self.ctx.create_fresh_var(next_hop_sort, value=None)
+                        ann.next_hop = next_hop_var
+                        self.ctx.register_constraint(
+                            z3.If(prev_next_hop.var == self.ctx.origin_next_hop_var,
+                                  next_hop_var.var == session_next_hop.var,
+                                  next_hop_var.var == prev_next_hop.var,
+                                  self.ctx.z3_ctx) == True)
                 imported[prop] = ann
 
             # Apply import route maps if any
@@ -329,24 +349,36 @@ class BGP(object):
                 smt_map = SMTRouteMap(rmap, tmp, self.ctx)
                 self.rmaps[rmap_name] = smt_map
                 smt_map.execute()
-                cc = self.ctx._tracked.keys()[:]
                 for index, prop in enumerate(props):
                     imported[prop] = smt_map.announcements[index]
                     assert assert_order(tmp[index], imported[prop])
-            # Assign the values
+            # Assign the values, the constraints of each attribute
+            # are registered in bulk
             for prop, ann in imported.iteritems():
                 self.anns_map[prop].prev_announcement = ann
-                for attr in attrs:
-                    curr = getattr(self.anns_map[prop], attr)
-                    imp = getattr(ann, attr)
-                    prefix = 'Imp_%s_from_%s_%s_' % (self.node, neighbor, attr)
-                    self.ctx.register_constraint(z3.And(curr.var == imp.var, self.ctx.z3_ctx),
-                                                 name_prefix=prefix)
-                for community in self.ctx.communities:
-                    curr = self.anns_map[prop].communities[community]
-                    imp = ann.communities[community]
-                    prefix = 'Imp_%s_from_%s_Comm_%s_' % (self.node, neighbor, community.name)
-                    self.ctx.register_constraint(z3.And(curr.var == imp.var, self.ctx.z3_ctx), name_prefix=prefix)
+            for attr in attrs:
+                prefix = 'Imp_%s_from_%s_%s_' % (self.node, neighbor, attr)
+                self.ctx.register_constraints(
+                    [getattr(self.anns_map[prop], attr).check_eq(getattr(ann, attr))
+                     for prop, ann in imported.iteritems()],
+                    name_prefix=prefix)
+            for community in self.ctx.communities:
+                prefix = 'Imp_%s_from_%s_Comm_%s_' % (self.node, neighbor, community.name)
+                self.ctx.register_constraints(
+                    [self.anns_map[prop].communities[community].check_eq(
+                        ann.communities[community])
+                     for prop, ann in imported.iteritems()],
+                    name_prefix=prefix)
+
+    def _get_session_var(self, neighbor, attr, vsort, value):
+        """
+        The concrete variable of an attribute of the announcements imported
+        from the neighbor, created once per session
+        """
+        key = (neighbor, attr)
+        if key not in self._session_vars:
+            self._session_vars[key] = self.ctx.create_fresh_var(vsort, value=value)
+        return self._session_vars[key]
 
     def get_path_cost(self, path):
         """
@@ -562,6 +594,159 @@ class BGP(object):
         const_name = self.ctx.register_constraint(z3.And(*tmp) == True, name_prefix=prefix)
         self.selection_constraints[const_name] = (best_ann_var, other_ann_var, best_propagated, other_propagated, const_selection)
 
+    def get_rank_key(self, propagated, ann_var, use_med):
+        """
+        The lexicographic preference key of an announcement, the BGP
+        selection prefers the announcement with the greater key.
+        The key is computed once and shared by all the comparisons.
+        :param use_med: MED is only compared between the routes learned
+                        from the same neighboring AS
+        :return: tuple of (python int or z3) terms
+        """
+        key_id = (propagated, use_med)
+        if key_id in self._rank_keys:
+            return self._rank_keys[key_id]
+        origin_sort = self.ctx.get_enum_type(BGP_ORIGIN_SORT)
+        # IGP < EGP < Incomplete
+        origin_ranks = {'IGP': 2, 'EBGP': 1, 'INCOMPLETE': 0}
+        if ann_var.origin.is_concrete:
+            origin_rank = origin_ranks[ann_var.origin.get_value()]
+        else:
+            origin = ann_var.origin.var
+            origin_rank = z3.If(
+                origin == origin_sort.get_symbolic_value('IGP'),
+                z3.IntVal(2, self.ctx.z3_ctx),
+                z3.If(origin == origin_sort.get_symbolic_value('EBGP'),
+                      z3.IntVal(1, self.ctx.z3_ctx),
+                      z3.IntVal(0, self.ctx.z3_ctx), self.ctx.z3_ctx),
+                self.ctx.z3_ctx)
+        node_as_num = self.network_graph.get_bgp_asnum(self.node)
+        peer_as_num = self.network_graph.get_bgp_asnum(propagated.peer)
+        key = [ann_var.local_pref.var,
+               -ann_var.as_path_len.var,
+               origin_rank]
+        if use_med:
+            key.append(-ann_var.med.var)
+        # Prefer eBGP over iBGP
+        key.append(1 if node_as_num != peer_as_num else 0)
+        key = tuple(key)
+        self._rank_keys[key_id] = key
+        return key
+
+    def _lex_greater(self, key1, key2, strict=True):
+        """
+        key1 > key2 (or key1 >= key2 if not strict) lexicographically,
+        the concrete terms are compared in python
+        :return: z3 expression or python bool
+        """
+        if not key1:
+            return not strict
+        term1, term2 = key1[0], key2[0]
+        rest = self._lex_greater(key1[1:], key2[1:], strict)
+        if isinstance(term1, (int, long)) and isinstance(term2, (int, long)):
+            if term1 != term2:
+                return term1 > term2
+            return rest
+        if rest is True:
+            return term1 >= term2
+        if rest is False:
+            return term1 > term2
+        return z3.Or(term1 > term2,
+                     z3.And(term1 == term2, rest, self.ctx.z3_ctx),
+                     self.ctx.z3_ctx)
+
+    def _unless_blocked(self, ann_var, const):
+        """The constraint only applies if the announcement is permitted"""
+        return z3.Or(ann_var.permitted.var == False, const, self.ctx.z3_ctx)
+
+    def _uses_med(self, best_propagated, other_propagated):
+        best_as_num = self.network_graph.get_bgp_asnum(best_propagated.peer)
+        other_as_num = self.network_graph.get_bgp_asnum(other_propagated.peer)
+        return best_as_num == other_as_num
+
+    def rank_selector_pair(self, best_propagated, other_propagated):
+        """
+        The rank encoding of selector_func, the key of the best
+        announcement is greater than the key of the other one
+        """
+        best_ann_var = self.anns_map[best_propagated]
+        other_ann_var = self.anns_map[other_propagated]
+        use_med = self._uses_med(best_propagated, other_propagated)
+        best_key = self.get_rank_key(best_propagated, best_ann_var, use_med)
+        other_key = self.get_rank_key(other_propagated, other_ann_var, use_med)
+        const = self._unless_blocked(
+            other_ann_var, self._lex_greater(best_key, other_key))
+        prefix = "SELECT_RANK_at_{}_prefix_{}_path_{}_".format(
+            self.node, best_propagated.ann_name, '_'.join(best_propagated.path))
+        const_name = self.ctx.register_constraint(const, name_prefix=prefix)
+        self.selection_constraints[const_name] = (
+            best_ann_var, other_ann_var, best_propagated, other_propagated, [const])
+
+    def rank_selector_level(self, ann_name, level, best_props, other_props,
+                            use_med):
+        """
+        The rank encoding of all the (best, other) pairs of two consecutive
+        preference levels with one constraint per announcement:
+        the keys of best_props are >= a lower bound, that is greater than
+        an upper bound of the keys of (permitted) other_props
+        """
+        lower = []
+        upper = []
+        for index in range(len(self.get_rank_key(
+                best_props[0], self.anns_map[best_props[0]], use_med))):
+            prefix = "RankBound_at_{}_prefix_{}_level_{}_{}_".format(
+                self.node, ann_name, level, index)
+            lower.append(self.ctx.create_fresh_var(
+                z3.IntSort(self.ctx.z3_ctx), name_prefix=prefix + 'lower_').var)
+            upper.append(self.ctx.create_fresh_var(
+                z3.IntSort(self.ctx.z3_ctx), name_prefix=prefix + 'upper_').var)
+        prefix = "SELECT_RANK_at_{}_prefix_{}_level_{}_".format(
+            self.node, ann_name, level)
+        self.ctx.register_constraint(
+            self._lex_greater(lower, upper), name_prefix=prefix + 'bounds_')
+        for best_prop in best_props:
+            best_ann_var = self.anns_map[best_prop]
+            key = self.get_rank_key(best_prop, best_ann_var, use_med)
+            const = self._lex_greater(key, lower, strict=False)
+            const_name = self.ctx.register_constraint(
+                const, name_prefix=prefix + 'best_%s_' % '_'.join(best_prop.path))
+            self.selection_constraints[const_name] = (
+                best_ann_var, None, best_prop, None, [const])
+        for other_prop in other_props:
+            other_ann_var = self.anns_map[other_prop]
+            key = self.get_rank_key(other_prop, other_ann_var, use_med)
+            const = self._unless_blocked(
+                other_ann_var, self._lex_greater(upper, key, strict=False))
+            const_name = self.ctx.register_constraint(
+                const, name_prefix=prefix + 'other_%s_' % '_'.join(other_prop.path))
+            self.selection_constraints[const_name] = (
+                None, other_ann_var, None, other_prop, [const])
+
+    def rank_selector(self, ann_name, values):
+        """
+        Encode the preference order of one prefix with the lexicographic
+        keys of the announcements (see get_rank_key) instead of
+        selector_func for each (best, other) pair.
+        Two levels with many announcements are encoded through bounds,
+        linear instead of quadratic in the size of the levels.
+        :param values: the order_info of the prefix, list of sets
+        """
+        for level, (best_set, other_set) in enumerate(zip(values[0::1], values[1::1])):
+            # Like selector_func, the routes of the same peer are not compared
+            pairs = [(best_prop, other_prop) for best_prop in best_set
+                     for other_prop in other_set
+                     if best_prop.peer != other_prop.peer]
+            uses_med = set([self._uses_med(best_prop, other_prop)
+                            for best_prop, other_prop in pairs])
+            if len(pairs) == len(best_set) * len(other_set) and \
+                    len(uses_med) == 1 and \
+                    len(pairs) > len(best_set) + len(other_set) + 1:
+                self.rank_selector_level(ann_name, level, list(best_set),
+                                         list(other_set), uses_med.pop())
+            else:
+                for best_prop, other_prop in pairs:
+                    self.rank_selector_pair(best_prop, other_prop)
+
     def mark_selected(self):
         for propagated, ann in self.anns_map.iteritems():
             n = '_{}_from_{}_path_{}_'.format(self.node, propagated.peer, '_'.join(propagated.path))
@@ -570,10 +755,21 @@ class BGP(object):
             else:
                 self.ctx.register_constraint(ann.permitted.var == True, name_prefix='Req_Allow' + n)
 
-    def synthesize(self, use_igp=False):
+    def synthesize(self, use_igp=False, encoding='pairwise'):
+        """
+        :param encoding: the encoding of the route selection, 'pairwise'
+                         a selector_func for each (best, other) pair of
+                         announcements, or 'rank' compare the preference
+                         keys of the announcements (see rank_selector).
+                         The IGP costs are only encoded by 'pairwise'.
+        """
+        assert encoding in ['pairwise', 'rank']
         self.log.info("Synthesizing BGP for router '%s'", self.node)
         self.mark_selected()
+        t1 = timer()
         self.compute_imported_routes()
+        self.import_time = timer() - t1
+        self.log.debug("Import time at router '%s': %s", self.node, self.import_time)
 
         anns_order = {}
         for net, info in self.ibgp_propagation.node[self.node]['nets'].iteritems():
@@ -586,6 +782,9 @@ class BGP(object):
                 # This router only learns one route
                 # No need to use the preference function
                 continue
+            if encoding == 'rank' and not use_igp:
+                self.rank_selector(ann_name, values)
+                continue
             for best_prop_set, other_prop_set in zip(values[0::1], values[1::1]):
                 for best_prop in best_prop_set:
                     for other_prop in other_prop_set:
@@ -603,6 +802,8 @@ class BGP(object):
 
     def update_network_graph(self):
         """Update the network graph with the concrete values"""
+        # Read all the values from the model at once
+        self.ctx.eval_vars()
         for smt_rmap in self.rmaps.values():
             rmap = smt_rmap.get_config()
             self.network_graph.add_route_map(self.node, rmap)
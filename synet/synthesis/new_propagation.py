@@ -409,12 +409,17 @@ class EBGPPropagation(object):
                     attrs['origins'][propagated] = origin
         return set([prop.as_path for prop in cache.values()])
 
-    def synthesize(self, use_igp=False):
+    def synthesize(self, use_igp=False, encoding='pairwise'):
+        """
+        :param encoding: the encoding of the BGP route selection,
+                         'pairwise' or 'rank' (see BGP.synthesize)
+        """
         #self.compute_dags()
         for node in self.ibgp_propagation.nodes():
             self.ibgp_propagation.node[node]['box'] = BGP(node, self)
         for node in self.ibgp_propagation.nodes():
-            self.ibgp_propagation.node[node]['box'].synthesize(use_igp=use_igp)
+            self.ibgp_propagation.node[node]['box'].synthesize(
+                use_igp=use_igp, encoding=encoding)
         print "Y" * 50
         print "PROPAGATION GRAPH SIZE:", self.ibgp_propagation.number_of_nodes()
         print "NETWORK GRAPH SIZE:", self.network_graph.number_of_nodes()
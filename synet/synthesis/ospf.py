@@ -22,6 +22,7 @@ from synet.utils.ospf_utils import extract_ospf_graph
 from synet.utils.ospf_utils import get_output_configs
 from synet.utils.ospf_utils import get_output_network_graph
 from synet.utils.ospf_utils import load_graph_constrains
+from synet.utils.ospf_utils import PathRegistry
 from synet.utils.ospf_utils import synthesize_ospf_announce
 
 
@@ -38,17 +39,22 @@ class OSPFSyn(SynthesisComponent):
     that makes it a slow but complete version.
     """
 
-    def __init__(self, network_graph, solver=None):
+    def __init__(self, network_graph, solver=None, encoding='int'):
         """
         :param initial_configs: List of SetOSPFEdgeCost, ignores anything else
         :param network_graph: an instance of Networkx.DiGraph
         :param solver: optional instance of Z3 solver, otherwise create an new one
+        :param encoding: the sort of the symbolic costs, 'int' for integers
+                         or 'bv' for bounded bit-vectors
         """
         assert isinstance(network_graph, NetworkGraph)
         self.log = logging.getLogger('%s.%s' % (
             self.__module__, self.__class__.__name__))
         super(OSPFSyn, self).__init__([], network_graph, solver)
+        assert encoding in ['int', 'bv']
+        self.encoding = encoding
         self.ospf_graph = None
+        self.path_registry = None
         # Requirements
         self.reqs = []
 
@@ -67,13 +73,8 @@ class OSPFSyn(SynthesisComponent):
         return self.ospf_graph[src][dst]['cost']
 
     def _get_path_cost(self, path):
-        """Return a sum of all the costs along the path"""
-        edge_costs = []
-        for i in range(len(path) - 1):
-            src = path[i]
-            dst = path[i + 1]
-            edge_costs.append(self._get_edge_cost(src, dst))
-        return sum(edge_costs)
+        """Return a sum of all the costs along the path (memoized)"""
+        return self.path_registry.get_cost(path)
 
     def _generate_simple_path(self, req):
         """Generate SMT for PathReq"""
@@ -132,7 +133,9 @@ class OSPFSyn(SynthesisComponent):
     def push_requirements(self):
         """Push the requirements we care about to the solver"""
         # Load Graph
-        self.ospf_graph = extract_ospf_graph(self.network_graph, self.log)
+        self.ospf_graph = extract_ospf_graph(
+            self.network_graph, self.log, self.encoding)
+        self.path_registry = PathRegistry(self.ospf_graph)
         load_graph_constrains(self.solver, self.ospf_graph)
 
         self.solver.push()
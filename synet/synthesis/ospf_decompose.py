@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+
+"""
+Decompose the OSPF requirements into independent groups and synthesize
+each group in its own process.
+
+Each requirement owns the symbolic edges its constraints are likely to
+touch (the edges of its paths and of the shortest competing paths).
+Requirements that share an owned edge are in the same group.
+Each group is synthesized with the CEGIS synthesizer on the sub graph
+around its paths, the owned edges take the costs of their group and the
+edges owned by no group get a cost higher than any owned path.
+The merged costs are verified against all the requirements on the whole
+graph (the cost of the edges owned by no group is capped at the max OSPF
+cost, so it may not be higher than every owned path), the counter
+examples are added to the violated requirements and
+the affected groups are synthesized again until all the requirements are
+satisfied (at worst, all the requirements end up in one group that is
+synthesized on the whole graph).
+"""
+
+import itertools
+import logging
+import multiprocessing
+import random
+from timeit import default_timer as timer
+
+import networkx as nx
+
+from tekton.graph import NetworkGraph
+from synet.synthesis.ospf_heuristic import OSPFSyn as OSPFCEGIS
+from synet.synthesis.ospf_heuristic import get_req_paths
+from synet.utils.common import Protocols
+from synet.utils.common import Req
+from synet.utils.ospf_utils import OSPF_MAX_COST
+from synet.utils.ospf_utils import extract_ospf_graph
+from synet.utils.ospf_utils import get_compact_graph
+from synet.utils.ospf_utils import synthesize_ospf_announce
+from synet.utils.ospf_verify import OSPFVerifier
+from synet.utils.smt_context import is_symbolic
+from synet.utils.telemetry import Telemetry
+from synet.utils.telemetry import get_memory_usage
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+# The planner used by the worker processes (inherited by fork)
+_PLANNER = None
+
+
+def _synthesize_group(args):
+    """Worker process entry point"""
+    key, reqs_indexes, edges, nodes = args
+    return key, _PLANNER.synthesize_group(reqs_indexes, edges, nodes)
+
+
+class UnionFind(object):
+    """Disjoint sets of hashable items"""
+
+    def __init__(self, items):
+        self.parent = dict((item, item) for item in items)
+
+    def find(self, item):
+        root = item
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[item] != root:
+            self.parent[item], item = root, self.parent[item]
+        return root
+
+    def union(self, item1, item2):
+        root1, root2 = self.find(item1), self.find(item2)
+        if root1 != root2:
+            self.parent[root2] = root1
+
+    def groups(self):
+        """Return a list of sorted lists of the items in each set"""
+        groups = {}
+        for item in self.parent:
+            groups.setdefault(self.find(item), []).append(item)
+        return sorted([sorted(group) for group in groups.values()])
+
+
+class OSPFPlanner(object):
+    """
+    Synthesize OSPF costs by splitting the requirements into groups that
+    don't share symbolic edge costs and synthesizing them in parallel.
+    """
+
+    def __init__(self, network_graph, reqs, workers=None, gen_paths=100,
+                 candidate_paths=3, region_radius=1, seed=0, max_rounds=10,
+                 smt_cache=None):
+        """
+        :param network_graph: an instance of NetworkGraph
+        :param reqs: list of OSPF requirements
+        :param workers: number of worker processes, default number of CPUs
+        :param gen_paths: gen_paths of the CEGIS synthesizer of each group
+        :param candidate_paths: number of the shortest (by hop count)
+                                competing paths whose edges are owned by
+                                a requirement
+        :param region_radius: a group is synthesized on the sub graph of
+                              the nodes within this many hops of its paths
+        :param seed: the seed of the random generators
+        :param max_rounds: rounds of refinement before solving all the
+                           requirements in one group
+        :param smt_cache: optional SMTCache used by the synthesizer of each
+                          group, so the groups solved before (in this or in
+                          other runs) are not solved again
+        """
+        assert isinstance(network_graph, NetworkGraph)
+        self.log = logging.getLogger('%s.%s' % (
+            self.__module__, self.__class__.__name__))
+        for req in reqs:
+            assert isinstance(req, Req)
+            assert req.protocol == Protocols.OSPF
+        self.network_graph = network_graph
+        self.reqs = list(reqs)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.gen_paths = gen_paths
+        self.candidate_paths = candidate_paths
+        self.region_radius = region_radius
+        self.seed = seed
+        self.max_rounds = max_rounds
+        self.smt_cache = smt_cache
+        self.ospf_graph = extract_ospf_graph(network_graph, self.log)
+        # The edges owned by each requirement
+        self.req_edges = [set() for _ in self.reqs]
+        # The nodes of the paths known to be relevant to each requirement
+        self.req_nodes = [set() for _ in self.reqs]
+        # (reqs indexes, edges, nodes) -> edge costs of the synthesized groups
+        self._solutions = {}
+        # The final cost of each edge
+        self.costs = None
+        # Requirements indexes of each group in the last round
+        self.groups = []
+        self.group_times = []
+        # Structured records of the rounds, no sinks by default
+        self.telemetry = Telemetry()
+
+    def is_symbolic_edge(self, src, dst):
+        """True if the cost of the edge is to be synthesized"""
+        return is_symbolic(self.ospf_graph[src][dst]['cost'])
+
+    def _add_path(self, index, path):
+        """
+        Add the nodes and the symbolic edges of a path to a requirement
+        :return: True if the requirement got new nodes or edges
+        """
+        num_nodes = len(self.req_nodes[index])
+        num_edges = len(self.req_edges[index])
+        self.req_nodes[index].update(path)
+        for src, dst in zip(path[0::1], path[1::1]):
+            if self.is_symbolic_edge(src, dst):
+                self.req_edges[index].add((src, dst))
+        return (len(self.req_nodes[index]) > num_nodes or
+                len(self.req_edges[index]) > num_edges)
+
+    def compute_req_edges(self):
+        """The initial edges of each requirement"""
+        for index, req in enumerate(self.reqs):
+            paths = get_req_paths(req)
+            for path in paths:
+                self._add_path(index, path)
+            src, dst = paths[0][0], paths[0][-1]
+            competing = nx.shortest_simple_paths(self.ospf_graph, src, dst)
+            for path in itertools.islice(competing, self.candidate_paths):
+                self._add_path(index, path)
+
+    def compute_groups(self):
+        """Group the requirements that share an owned edge"""
+        groups = UnionFind(range(len(self.reqs)))
+        owner = {}
+        for index, edges in enumerate(self.req_edges):
+            for edge in edges:
+                if edge in owner:
+                    groups.union(owner[edge], index)
+                else:
+                    owner[edge] = index
+        return groups.groups()
+
+    def get_region(self, reqs_indexes):
+        """The nodes within region_radius hops of the requirements paths"""
+        region = set().union(*[self.req_nodes[i] for i in reqs_indexes])
+        frontier = region
+        for _ in range(self.region_radius):
+            new_nodes = set()
+            for node in frontier:
+                new_nodes.update(self.ospf_graph.successors(node))
+                new_nodes.update(self.ospf_graph.predecessors(node))
+            frontier = new_nodes - region
+            region.update(frontier)
+        return frozenset(region)
+
+    def synthesize_group(self, reqs_indexes, edges, nodes):
+        """
+        Synthesize the costs of one group of requirements
+        :param edges: the owned edges to return the costs for
+        :param nodes: synthesize on the sub graph of these nodes
+        :return: dict (src, dst) -> cost of the given edges (of all the
+                 edges if edges and nodes are None) or None if the
+                 requirements are unsatisfiable
+        """
+        ospf = OSPFCEGIS(self.network_graph, gen_paths=self.gen_paths,
+                         random_obj=random.Random(self.seed + reqs_indexes[0]))
+        ospf.smt_cache = self.smt_cache
+        if nodes is not None:
+            sub_graph = nx.DiGraph()
+            sub_graph.add_nodes_from(nodes)
+            for src, dst, attrs in self.ospf_graph.edges(data=True):
+                if src in nodes and dst in nodes:
+                    sub_graph.add_edge(src, dst, **attrs)
+            ospf.set_ospf_graph(sub_graph)
+        for index in reqs_indexes:
+            ospf.add_req(self.reqs[index])
+        if not ospf.synthesize():
+            return None
+        return dict(((src, dst), cost)
+                    for src, dst, cost in ospf.get_output_configs()
+                    if edges is None or (src, dst) in edges)
+
+    def _synthesize_groups(self, groups):
+        """
+        Synthesize the groups that are not solved before
+        :return: (False if a group is unsatisfiable, number of synthesized groups)
+        """
+        global _PLANNER
+        tasks = []
+        for reqs_indexes in groups:
+            key = self._group_key(groups, reqs_indexes)
+            if key not in self._solutions:
+                tasks.append((key, reqs_indexes, key[1], key[2]))
+        self.log.info("Synthesizing %d out of %d groups", len(tasks), len(groups))
+        if len(tasks) > 1 and self.workers > 1:
+            _PLANNER = self
+            pool = multiprocessing.Pool(min(self.workers, len(tasks)))
+            try:
+                results = pool.map(_synthesize_group, tasks, chunksize=1)
+            finally:
+                pool.terminate()
+                _PLANNER = None
+        else:
+            results = [(key, self.synthesize_group(reqs_indexes, edges, nodes))
+                       for key, reqs_indexes, edges, nodes in tasks]
+        for key, costs in results:
+            if costs is None:
+                return False, len(tasks)
+            self._solutions[key] = costs
+        return True, len(tasks)
+
+    def _group_key(self, groups, reqs_indexes):
+        """
+        (reqs indexes, owned edges, region nodes) of a group, a single group
+        owns all the edges and is synthesized on the whole graph
+        """
+        if len(groups) == 1:
+            return tuple(reqs_indexes), None, None
+        edges = frozenset().union(*[self.req_edges[i] for i in reqs_indexes])
+        return tuple(reqs_indexes), edges, self.get_region(reqs_indexes)
+
+    def _merge_costs(self, groups):
+        """The costs of all the edges out of the solved groups"""
+        costs = {}
+        for reqs_indexes in groups:
+            costs.update(self._solutions[self._group_key(groups, reqs_indexes)])
+        for src, dst in self.ospf_graph.edges():
+            if not self.is_symbolic_edge(src, dst):
+                costs[(src, dst)] = self.ospf_graph[src][dst]['cost']
+        # Edges not owned by any group are more expensive than any owned
+        # path, unless the cap is hit (then synthesize() finds the violations)
+        unowned = min(max(costs.values() or [1]) *
+                      self.ospf_graph.number_of_nodes(), OSPF_MAX_COST)
+        for src, dst in self.ospf_graph.edges():
+            if (src, dst) not in costs:
+                costs[(src, dst)] = unowned
+        return costs
+
+    def _verify(self, costs):
+        """
+        Check all requirements against the merged costs
+        :return: dict of the violated requirements index -> counter examples
+        """
+        compact = get_compact_graph(self.ospf_graph)
+        verifier = OSPFVerifier(compact, [costs[edge] for edge in compact.edges])
+        checker = OSPFCEGIS(self.network_graph)
+        violated = {}
+        for index, req in enumerate(self.reqs):
+            checker.counter_examples = {}
+            if not checker.check_req_satisfied(verifier, req):
+                violated[index] = [path for paths in checker.counter_examples.values()
+                                   for path in paths]
+        return violated
+
+    def synthesize(self):
+        """
+        Synthesize the costs of all the requirements
+        :return: bool
+        """
+        start = timer()
+        self.compute_req_edges()
+        # The round that solves everything together, can come earlier
+        last_round = self.max_rounds
+        for num_round in range(self.max_rounds + 1):
+            if num_round == last_round:
+                # Give up on decomposing
+                self.groups = [range(len(self.reqs))]
+            else:
+                self.groups = self.compute_groups()
+            group_sizes = [len(group) for group in self.groups]
+            self.log.info("OSPF Planner round %d: %d groups of sizes %s",
+                          num_round, len(self.groups), group_sizes)
+            t1 = timer()
+            sat, synthesized = self._synthesize_groups(self.groups)
+            self.group_times.append(timer() - t1)
+            if not sat:
+                self.log.info("OSPF Planner: requirements are unsatisfiable")
+                self._emit_round(num_round, group_sizes, synthesized, None)
+                return self._done(start, False)
+            costs = self._merge_costs(self.groups)
+            if len(self.groups) == 1 and self.groups[0] == range(len(self.reqs)):
+                # Synthesized and verified on the whole graph
+                self._emit_round(num_round, group_sizes, synthesized, 0)
+                self.costs = costs
+                break
+            violated = self._verify(costs)
+            self._emit_round(num_round, group_sizes, synthesized, len(violated))
+            if not violated:
+                self.costs = costs
+                break
+            changed = False
+            for index, paths in violated.iteritems():
+                for path in paths:
+                    changed = self._add_path(index, path) or changed
+            if not changed:
+                # No new interactions to learn, solve everything together
+                last_round = num_round + 1
+        return self._done(start, True)
+
+    def _emit_round(self, num_round, group_sizes, synthesized, violated):
+        """
+        Emit the record of one round of synthesize()
+        :param violated: number of violated requirements, None if unsat
+        """
+        self.telemetry.emit(
+            'planner_round', synthesizer=self.__class__.__name__,
+            round=num_round, groups=len(group_sizes), group_sizes=group_sizes,
+            synthesized_groups=synthesized, violated=violated,
+            group_time=self.group_times[-1], memory=get_memory_usage())
+
+    def _done(self, start, result):
+        """Emit the summary record of synthesize() and return the result"""
+        total_time = timer() - start
+        self.log.info("OSPF Planner time %s", total_time)
+        self.telemetry.emit(
+            'planner_done', synthesizer=self.__class__.__name__,
+            result=result, rounds=len(self.group_times),
+            groups=len(self.groups), reqs=len(self.reqs),
+            group_time=sum(self.group_times), total_time=total_time,
+            memory=get_memory_usage())
+        return result
+
+    def get_output_configs(self):
+        """Returns list of (src, dst, cost)"""
+        return [(src, dst, self.costs[(src, dst)])
+                for src, dst in self.ospf_graph.edges()]
+
+    def update_network_graph(self):
+        """Set concrete costs on the network graph"""
+        for src, dst, cost in self.get_output_configs():
+            self.network_graph.set_edge_ospf_cost(src, dst, cost)
+        synthesize_ospf_announce(self.network_graph, self.ospf_graph, self.reqs)
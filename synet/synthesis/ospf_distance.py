@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+
+"""
+OSPF synthesizer based on distance labels (node potentials).
+
+Instead of enumerating competing paths, each destination gets one integer
+variable per router holding a lower bound on its distance to the destination:
+    d(dst) == 0 and d(u) <= cost(u, v) + d(v) for every edge (u, v)
+The required next hops are then pinned with equalities and all other next
+hops are excluded with strict inequalities. This gives
+O(|E| * |destinations|) constraints, no path enumeration and no CEGIS loop.
+"""
+
+import logging
+from timeit import default_timer as timer
+
+import networkx as nx
+import z3
+
+from tekton.graph import NetworkGraph
+from synet.utils.common import ECMPPathsReq
+from synet.utils.common import KConnectedPathsReq
+from synet.utils.common import PathOrderReq
+from synet.utils.common import PathReq
+from synet.utils.common import Protocols
+from synet.utils.common import Req
+from synet.utils.common import SynthesisComponent
+from synet.utils.ospf_utils import extract_ospf_graph
+from synet.utils.ospf_utils import get_output_configs
+from synet.utils.ospf_utils import get_output_network_graph
+from synet.utils.ospf_utils import load_graph_constrains
+from synet.utils.ospf_utils import PathRegistry
+from synet.utils.ospf_utils import synthesize_ospf_announce
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+z3.set_option('unsat-core', True)
+
+
+def get_path_edges(paths):
+    """Return the set of (src, dst) edges used by a list of paths"""
+    edges = set()
+    for path in paths:
+        edges.update(zip(path[0::1], path[1::1]))
+    return edges
+
+
+class OSPFSyn(SynthesisComponent):
+    """
+    Synthesizer for OSPF costs that encodes the shortest path requirements
+    with per destination distance variables.
+    """
+
+    def __init__(self, network_graph, solver=None):
+        """
+        :param network_graph: an instance of NetworkGraph
+        :param solver: optional instance of Z3 solver, otherwise create an new one
+        """
+        assert isinstance(network_graph, NetworkGraph)
+        self.log = logging.getLogger('%s.%s' % (
+            self.__module__, self.__class__.__name__))
+        super(OSPFSyn, self).__init__([], network_graph, solver)
+        self.ospf_graph = None
+        self.path_registry = None
+        # Distance variables, dst -> {node -> z3 var}
+        self.dists = {}
+        # Requirements
+        self.reqs = []
+
+    def add_req(self, req):
+        """
+        Add new path requirement
+        :param req: instance of PathReq, ECMPPathsReq,
+                    KConnectedPathsReq or PathOrderReq
+        :return: None
+        """
+        assert isinstance(req, Req)
+        assert req.protocol == Protocols.OSPF
+        self.reqs.append(req)
+
+    def _get_edge_cost(self, src, dst):
+        """Shortcut function to get the cost function of an edge"""
+        return self.ospf_graph[src][dst]['cost']
+
+    def _get_path_cost(self, path):
+        """Return a sum of all the costs along the path (memoized)"""
+        return self.path_registry.get_cost(path)
+
+    def _get_dist(self, dst, node):
+        """
+        Return the distance variable of a node toward dst, the distance
+        labels are shared among all the requirements of the same destination.
+        """
+        if dst not in self.dists:
+            dists = {}
+            for n in self.ospf_graph.nodes():
+                dists[n] = z3.Const('dist_%s_%s' % (dst, n), z3.IntSort())
+            self.dists[dst] = dists
+            # Labels can never exceed the distance of any path
+            self.solver.add(dists[dst] == 0)
+            for src, nxt in self.ospf_graph.edges():
+                cost = self._get_edge_cost(src, nxt)
+                self.solver.add(dists[src] <= cost + dists[nxt])
+        return self.dists[dst][node]
+
+    def _next_hop_constraints(self, paths):
+        """
+        Constraints that makes the union of the given paths exactly
+        the shortest path DAG seen from the nodes along these paths
+        """
+        dst = paths[0][-1]
+        used = get_path_edges(paths)
+        constraints = []
+        for src, nxt in used:
+            cost = self._get_edge_cost(src, nxt)
+            constraints.append(
+                self._get_dist(dst, src) == cost + self._get_dist(dst, nxt))
+        on_path = set([src for src, _ in used])
+        for src in on_path:
+            for nxt in self.ospf_graph.successors(src):
+                if (src, nxt) in used:
+                    continue
+                cost = self._get_edge_cost(src, nxt)
+                constraints.append(
+                    self._get_dist(dst, src) < cost + self._get_dist(dst, nxt))
+        return constraints
+
+    def _extra_union_paths(self, paths):
+        """
+        Paths that can be constructed from the edges of the
+        requirements paths but are not part of the requirements
+        """
+        union = nx.DiGraph()
+        union.add_edges_from(get_path_edges(paths))
+        src, dst = paths[0][0], paths[0][-1]
+        req_paths = [list(path) for path in paths]
+        return [path for path in nx.all_simple_paths(union, src, dst)
+                if path not in req_paths]
+
+    def _generate_simple_path(self, req):
+        """Generate SMT for PathReq"""
+        return self._next_hop_constraints([req.path])
+
+    def _generate_ecmp_path(self, req):
+        """Generate SMT for ECMPPathsReq"""
+        paths = [p.path for p in req.paths]
+        if self._extra_union_paths(paths):
+            # The union of the paths create extra equal cost paths
+            # that is not part of the requirements
+            return [z3.BoolVal(False)]
+        return self._next_hop_constraints(paths)
+
+    def _generate_connected_path(self, req, name):
+        """
+        Generate SMT for KConnectedPathsReq,
+        every path in the requirements costs less than any other path.
+        A competing path leaves the union of the requirements paths at
+        node u by taking edge (u, v), so it's lower bounded by
+        fdist(u) + cost(u, v) + d(v), where fdist is a lower bound
+        on the distance from the source within the union of the paths.
+        """
+        paths = [p.path for p in req.paths]
+        src, dst = paths[0][0], paths[0][-1]
+        used = get_path_edges(paths)
+        constraints = []
+        max_cost = z3.Const('%s_max_cost' % name, z3.IntSort())
+        for path in paths:
+            constraints.append(max_cost >= self._get_path_cost(path))
+        fdist = {}
+        for node in set([n for edge in used for n in edge]):
+            fdist[node] = z3.Const('%s_fdist_%s' % (name, node), z3.IntSort())
+        constraints.append(fdist[src] == 0)
+        for u, v in used:
+            cost = self._get_edge_cost(u, v)
+            constraints.append(fdist[v] <= fdist[u] + cost)
+        for u in set([u for u, _ in used]):
+            for v in self.ospf_graph.successors(u):
+                if (u, v) in used:
+                    continue
+                cost = self._get_edge_cost(u, v)
+                constraints.append(
+                    max_cost < fdist[u] + cost + self._get_dist(dst, v))
+        # Competing paths that only use edges of the requirements
+        for path in self._extra_union_paths(paths):
+            constraints.append(max_cost < self._get_path_cost(path))
+        return constraints
+
+    def _generate_ordered_path(self, req, name):
+        """Generate SMT for PathOrderReq"""
+        paths = [p.path for p in req.paths]
+        constraints = self._generate_connected_path(req, name)
+        for path0, path1 in zip(paths[0::1], paths[1::1]):
+            constraints.append(
+                self._get_path_cost(path0) < self._get_path_cost(path1))
+        return constraints
+
+    def push_requirements(self):
+        """Push the requirements we care about to the solver"""
+        # Load Graph
+        self.ospf_graph = extract_ospf_graph(self.network_graph, self.log)
+        self.path_registry = PathRegistry(self.ospf_graph)
+        load_graph_constrains(self.solver, self.ospf_graph)
+        self.dists = {}
+
+        self.solver.push()
+        start = timer()
+        for index, req in enumerate(self.reqs):
+            name = 'req_%d' % index
+            if isinstance(req, PathReq):
+                constraints = self._generate_simple_path(req)
+            elif isinstance(req, ECMPPathsReq):
+                constraints = self._generate_ecmp_path(req)
+            elif isinstance(req, PathOrderReq):
+                constraints = self._generate_ordered_path(req, name)
+            elif isinstance(req, KConnectedPathsReq):
+                constraints = self._generate_connected_path(req, name)
+            else:
+                raise ValueError("Unrecognized path requirement %s" % req)
+            self.solver.assert_and_track(z3.And(constraints), name)
+        end = timer()
+        self.log.info("End pushing OSPF requirements: %s seconds", (end - start))
+        return end - start
+
+    def get_tracked_lits(self):
+        """The literals used to track the requirements"""
+        return [z3.Bool('req_%d' % index, self.solver.ctx)
+                for index in range(len(self.reqs))]
+
+    def synthesize(self):
+        """
+        The main synthesis method, a single SMT call.
+        :return: bool
+        """
+        if not self.solve():
+            self.log.error("Reqs directly are unsatisfiable, unsat core: %s",
+                           self.solver.unsat_core())
+            return False
+        return True
+
+    def get_output_configs(self):
+        """Returns list of (src, dst, cost)"""
+        return get_output_configs(self.solver.model(), self.ospf_graph)
+
+    def get_output_network_graph(self):
+        """Return OSPF graph annotated with synthesized costs"""
+        return get_output_network_graph(self.solver.model(), self.ospf_graph)
+
+    def get_output_routing_graphs(self):
+        """
+        Returns one graph per each destination network.
+        """
+        return self.get_output_network_graph()
+
+    def update_network_graph(self):
+        """Set concrete costs on the network graph"""
+        configs = self.get_output_configs()
+        for src, dst, cost in configs:
+            self.network_graph.set_edge_ospf_cost(src, dst, cost)
+        synthesize_ospf_announce(self.network_graph, self.ospf_graph, self.reqs)
+
+    def print_costs(self):
+        """Print the synthesized edge costs"""
+        print "Synthesized OSPF Link Costs"
+        for t in self.get_output_configs():
+            print "\t", t
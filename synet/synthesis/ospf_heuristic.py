@@ -5,11 +5,13 @@ CEGIS style synthesis for OSPF
 with heuristic path generator
 """
 
+import itertools
 import logging
 import random
 from timeit import default_timer as timer
 
 import networkx as nx
+import numpy as np
 import z3
 
 from tekton.graph import NetworkGraph
@@ -20,13 +22,22 @@ from synet.utils.common import PathReq
 from synet.utils.common import Protocols
 from synet.utils.common import Req
 from synet.utils.common import SynthesisComponent
-from synet.utils.common import path_exists
 from synet.utils.ospf_utils import extract_ospf_graph
+from synet.utils.ospf_utils import get_compact_graph
+from synet.utils.ospf_utils import get_cost_sort
+from synet.utils.ospf_utils import get_ospf_edge_cost
 from synet.utils.ospf_utils import get_output_configs
+from synet.utils.ospf_utils import get_output_costs
 from synet.utils.ospf_utils import get_output_network_graph
+from synet.utils.ospf_utils import invalidate_compact_graph
 from synet.utils.ospf_utils import load_graph_constrains
+from synet.utils.ospf_utils import OSPF_MAX_COST
+from synet.utils.ospf_utils import PathHistory
+from synet.utils.ospf_utils import PathRegistry
 from synet.utils.ospf_utils import synthesize_ospf_announce
+from synet.utils.ospf_verify import OSPFVerifier
 from synet.utils.smt_context import is_symbolic
+from synet.utils.telemetry import get_memory_usage
 
 
 __author__ = "Ahmed El-Hassany"
@@ -36,24 +47,21 @@ __email__ = "a.hassany@gmail.com"
 z3.set_option('unsat-core', True)
 
 
-def get_path_key(src, dst):
-    """
-    For a given path return a tuple of source and dst
-    Useful for storing paths in dicts
-    """
-    return src, dst
-
-
-def get_path_name(path):
-    """Return a string name for the path (to used used in unsat core"""
-    return '_'.join(path)
+def get_req_paths(req):
+    """Return the list of paths used by a requirement"""
+    if isinstance(req, PathReq):
+        return [req.path]
+    return [r.path for r in req.paths]
 
 
 class OSPFSyn(SynthesisComponent):
 
     def __init__(self, network_graph,
-                 solver=None, gen_paths=1000, random_obj=None):
+                 solver=None, gen_paths=1000, random_obj=None, max_failures=1,
+                 path_gen_strategy='random', encoding='int', max_history=None):
         assert isinstance(network_graph, NetworkGraph)
+        assert path_gen_strategy in ['random', 'kshortest']
+        assert encoding in ['int', 'bv']
         self.log = logging.getLogger('%s.%s' % (
             self.__module__, self.__class__.__name__))
         super(OSPFSyn, self).__init__([], network_graph, solver)
@@ -62,21 +70,83 @@ class OSPFSyn(SynthesisComponent):
         self.ospf_graph = None
         # Number of paths to generate at each iterations
         self.gen_paths = gen_paths
+        # How new paths are generated, 'random' walks and dijkstra on random
+        # weights or the 'kshortest' paths under the current model costs
+        self.path_gen_strategy = path_gen_strategy
+        # The sort of the symbolic costs, 'int' or bounded bit-vectors 'bv'
+        self.encoding = encoding
+        # Costs of the latest model (NumPy vector indexed by edge id)
+        self.model_costs = None
+        self._model_graph = None
+        # Number of simultaneous link failures that PathOrderReq
+        # and KConnectedPathsReq must survive
+        self.max_failures = max_failures
         # Keep track of the generators for new random paths for a given req
         self.saved_path_gen = {}
-        # Counter examples of wrong paths
+        # The PathHistory of each generator, at most max_history paths
+        # are remembered per requirement (None for no limit)
+        self.max_history = max_history
+        self.path_histories = {}
+        # Counter examples of wrong paths, keyed by the (primary) path of the req
         self.counter_examples = {}
         # Requirements that couldn't be satisfied by ospf
         self.removed_reqs = []
         self.all_req_paths = None  # Keep track of all paths in the reqs
-        self._names_cache = []
+        # Interned paths and their cost expressions
+        self.path_registry = None
+        # Keys of the constraints already added to the solver,
+        # (kind, req literal id, path id, path id) for comparisons
+        # and ('cost', path id) for path cost variables
+        self._tracked = set()
+        # The ids of the paths generated for each primary path, and how
+        # many of them are encoded for each (req literal id, primary path)
+        self._key_paths = {}
+        self._key_reads = {}
+        # Assumption literal for each requirement (keyed by id(req)),
+        # and back from the z3 id of the literal to the req,
+        # the constraints of a req are only active when it's literal is
+        # passed to check() so reqs can be retracted without a new solver
+        self._req_lits = {}
+        self._lits_req = {}
+        # Extra random paths to generate per round for the violated reqs
+        self.extra_paths = 0
+        # Max number of counter examples taken out of the shortest paths
+        # of a violated req (there can be exponentially many equal paths)
+        self.max_counter_examples = 10
+        # Z3 check() time for each CEGIS iteration
+        self.solver_times = []
+        # Time to push the new constraints for each CEGIS iteration
+        self.push_times = []
+        # Edge costs of the last synthesized solution, (src, dst) -> cost,
+        # the next synthesize() starts from them after a delta
+        self.costs = None
+        # The costs before the last topology delta, only used to warm
+        # start the next synthesize() (self.costs is None until then)
+        self._warm_costs = None
+        # Assumption literals that keep the symbolic edges away from the
+        # violations at their previous costs (keyed by the z3 id of the
+        # literal), the literals in an unsat core are released
+        self._pins = {}
+        # Requirements (by id) that hold for any synthesized costs,
+        # so they're not encoded (see check_concrete_costs)
+        self._unaffected = set()
 
     def reset_solver(self):
         """Reset and clear all caches and create new solver"""
         self.solver = z3.Solver()
-        self.ospf_graph = extract_ospf_graph(self.network_graph, self.log)
+        self.ospf_graph = extract_ospf_graph(
+            self.network_graph, self.log, self.encoding)
         load_graph_constrains(self.solver, self.ospf_graph)
+        self.path_registry = PathRegistry(self.ospf_graph)
         self.saved_path_gen = {}
+        self.path_histories = {}
+        self._key_paths = {}
+        self._key_reads = {}
+        self._tracked = set()
+        self._req_lits = {}
+        self._lits_req = {}
+        self._pins = {}
+        self._unaffected = set()
 
     def random_walk_path(self, source, target):
         """
@@ -109,25 +179,29 @@ class OSPFSyn(SynthesisComponent):
         First generates random weights for each edge in the graph
         then we select the shortest paths based on dijkstra algorithm
         """
-        G = nx.DiGraph()
-        for src, dst in self.ospf_graph.edges():
-            G.add_edge(src, dst)
-        for src, dst in G.edges():
-            w = self.random_gen.randint(1, max_weight)
-            G[src][dst]['test-weight'] = w
-        return nx.shortest_path(G, source, target, 'test-weight')
+        compact = get_compact_graph(self.ospf_graph)
+        # Same draws, in the same order, as on a nx.DiGraph of the edges
+        order, out_list = compact.get_nx_order()
+        randint = self.random_gen.randint
+        weights = [0] * compact.num_edges
+        for edge in order:
+            weights[edge] = randint(1, max_weight)
+        return compact.shortest_path(source, target, weights, out_list)
 
-    def generate_random_paths(self, source, target, dijsktra_prob, random_obj):
+    def generate_random_paths(self, source, target, dijsktra_prob, random_obj,
+                              key=None, history=None):
         """
         A generator for random paths
         This generator keeps history of the generated paths such that we
         don't generate the same path twice.
+        :param key: the key of the requirement in self.counter_examples
+        :param history: PathHistory of the generated paths
         """
-        generated_paths = []
+        if history is None:
+            history = PathHistory(self.path_registry, self.max_history)
         counter = 0
         while True:
             # First give a priority to the counter examples (if any)
-            key = get_path_key(source, target)
             if self.counter_examples.get(key, None):
                 p = self.counter_examples[key].pop()
             else:
@@ -135,7 +209,7 @@ class OSPFSyn(SynthesisComponent):
                     p = self.random_dijkstra_path(source, target)
                 else:
                     p = self.random_walk_path(source, target)
-            if not p or p in generated_paths:
+            if not p or history.seen(p):
                 # Path already generated or random walk hit a dead end
                 # Try again
                 counter += 1
@@ -145,219 +219,282 @@ class OSPFSyn(SynthesisComponent):
                 continue
             else:
                 counter = 0
-                generated_paths.append(p)
+                history.add(p)
+                yield p
+
+    @property
+    def model_graph(self):
+        """OSPF graph annotated with the costs of the latest model"""
+        if self._model_graph is None and self.model_costs is not None:
+            compact = get_compact_graph(self.ospf_graph)
+            self._model_graph = compact.to_nx(self.model_costs)
+        return self._model_graph
+
+    def generate_model_paths(self, source, target, key=None, history=None):
+        """
+        A generator for the cheapest paths under the costs of the current
+        model (Yen's k shortest paths), i.e., the paths most likely to
+        violate the requirement. Before the first model, the hop count is used.
+        This generator keeps history of the generated paths such that we
+        don't generate the same path twice.
+        :param key: the key of the requirement in self.counter_examples
+        :param history: PathHistory of the generated paths
+        """
+        if history is None:
+            history = PathHistory(self.path_registry, self.max_history)
+        model_graph = None
+        paths = None
+        counter = 0
+        while True:
+            # First give a priority to the counter examples (if any)
+            if self.counter_examples.get(key, None):
+                p = self.counter_examples[key].pop()
+            else:
+                if paths is None or model_graph is not self.model_graph:
+                    # Restart the enumeration when the model changes
+                    model_graph = self.model_graph
+                    if model_graph is None:
+                        paths = nx.shortest_simple_paths(
+                            self.ospf_graph, source, target)
+                    else:
+                        paths = nx.shortest_simple_paths(
+                            model_graph, source, target, 'cost')
+                p = next(paths, None)
+            if not p or history.seen(p):
+                # Path already generated or all paths are enumerated
+                # Try again
+                counter += 1
+                if counter > 10:
+                    counter = 0
+                    yield None
+                continue
+            else:
+                counter = 0
+                history.add(p)
                 yield p
 
-    def generate_path_smt(self, path):
+    def iter_new_paths(self, path_key_req, src, dst, req_lit):
+        """
+        Iterate over the paths that are not yet encoded for a requirement.
+        The first time gen_paths random paths are generated, afterwards
+        only the pending counter examples (plus extra_paths new paths,
+        and with 'kshortest' also gen_paths cheapest paths under the model)
+        so each CEGIS iteration adds only the newly discovered constraints.
+        The requirements with the same primary path share the generator,
+        each of them gets all the paths generated for the path.
+        """
+        generated = self._key_paths.setdefault(path_key_req, [])
+        for rand_path in self._generate_new_paths(path_key_req, src, dst):
+            if rand_path:
+                generated.append(self.path_registry.get_id(rand_path))
+        read_key = (req_lit.get_id(), path_key_req)
+        start = self._key_reads.get(read_key, 0)
+        self._key_reads[read_key] = len(generated)
+        for path_id in generated[start:]:
+            yield list(self.path_registry.get_path(path_id))
+
+    def _generate_new_paths(self, path_key_req, src, dst):
+        """Generate the next batch of paths of the primary path"""
+        if path_key_req not in self.saved_path_gen:
+            history = PathHistory(self.path_registry, self.max_history)
+            if self.path_gen_strategy == 'kshortest':
+                path_gen = self.generate_model_paths(
+                    src, dst, path_key_req, history)
+            else:
+                path_gen = self.generate_random_paths(
+                    src, dst, 0.6, self.random_gen, path_key_req, history)
+            self.saved_path_gen[path_key_req] = path_gen
+            self.path_histories[path_key_req] = history
+            cuttoff = self.gen_paths
+        else:
+            pending = self.counter_examples.get(path_key_req, [])
+            if not pending:
+                return
+            cuttoff = len(pending) + self.extra_paths
+            if self.path_gen_strategy == 'kshortest':
+                cuttoff += self.gen_paths
+        count = 0
+        for rand_path in self.saved_path_gen[path_key_req]:
+            yield rand_path
+            count += 1
+            if count > cuttoff:
+                break
+
+    def _drop_path_gen(self, req):
+        """Drop the path generator of a removed requirement"""
+        key = tuple(get_req_paths(req)[0])
+        if id(req) in self._req_lits:
+            self._key_reads.pop((self._req_lits[id(req)].get_id(), key), None)
+        for other in self.reqs:
+            if tuple(get_req_paths(other)[0]) == key:
+                # Shared with another requirement
+                return
+        self.saved_path_gen.pop(key, None)
+        self.path_histories.pop(key, None)
+        self._key_paths.pop(key, None)
+
+    def get_history_stats(self):
+        """
+        Return (paths, evicted paths, approx. bytes) of the path histories
+        and the approx. bytes of the path registry they refer to
+        """
+        histories = self.path_histories.values()
+        return (sum([len(history) for history in histories]),
+                sum([history.evicted for history in histories]),
+                sum([history.memory_usage() for history in histories]),
+                self.path_registry.memory_usage())
+
+    def _assert_req(self, req_lit, const, track_key):
+        """Add a constraint that is only active under req_lit"""
+        self._tracked.add(track_key)
+        self.solver.add(z3.Implies(req_lit, const))
+
+    def _get_cost_var(self, path_id, cost, kind='cost'):
+        """Return a variable equal to a concrete path cost"""
+        var = z3.Const('path_%d_%s' % (path_id, kind),
+                       get_cost_sort(self.ospf_graph))
+        if (kind, path_id) not in self._tracked:
+            self._tracked.add((kind, path_id))
+            self.solver.add(var == cost)
+        return var
+
+    def _assert_less(self, req_lit, path_id, path_cost, path_cost_var,
+                     rand_path_id, rand_path_cost):
+        """Assert that the req path is cheaper than the random path"""
+        track_key = ('ISLESS', req_lit.get_id(), path_id, rand_path_id)
+        if track_key in self._tracked:
+            return
+        if is_symbolic(path_cost) or is_symbolic(rand_path_cost):
+            self._assert_req(req_lit, path_cost < rand_path_cost, track_key)
+        elif not (path_cost < rand_path_cost):
+            self._assert_req(
+                req_lit, path_cost_var < rand_path_cost, track_key)
+
+    def generate_path_smt(self, path, req_lit):
         src, dst = path[0], path[-1]
         path_cost = self._get_path_cost(path)
-        cuttoff = self.gen_paths
-        count = 0
         path_key_req = tuple(path)
-        if path_key_req not in self.saved_path_gen:
-            self.saved_path_gen[path_key_req] = self.generate_random_paths(
-                src, dst, 0.6, self.random_gen)
-        elif path_key_req not in self.counter_examples:
-            return
-        path_name = get_path_name(path)
+        path_id = self.path_registry.get_id(path)
 
+        path_cost_var = path_cost
         if not is_symbolic(path_cost):
-            var = z3.Const("%s_cost" % path_name, z3.IntSort())
-            self.solver.add(var == path_cost)
-            path_cost_var = var
+            path_cost_var = self._get_cost_var(path_id, path_cost)
 
-        for rand_path in self.saved_path_gen[path_key_req]:
+        for rand_path in self.iter_new_paths(path_key_req, src, dst, req_lit):
             # Skip if we generated the same path as the requirement
-            if path == rand_path:
+            if not rand_path or path == rand_path:
                 continue
-            if rand_path:
-                rand_path_name = get_path_name(rand_path)
-                rand_path_cost = self._get_path_cost(rand_path)
-                track_name = '%s_ISLESS_%s' % (path_name, rand_path_name)
-                if track_name in self._names_cache:
-                    continue
-                else:
-                    self._names_cache.append(track_name)
-                if is_symbolic(rand_path_cost) or is_symbolic(path_cost):
-                    self.solver.assert_and_track(
-                        path_cost < rand_path_cost, track_name)
-                else:
-                    if not (path_cost < rand_path_cost):
-                        self.solver.assert_and_track(
-                            path_cost_var < rand_path_cost, track_name)
-            count += 1
-            if count > cuttoff:
-                break
+            self._assert_less(
+                req_lit, path_id, path_cost, path_cost_var,
+                self.path_registry.get_id(rand_path),
+                self._get_path_cost(rand_path))
 
-    def generate_ecmp_smt(self, paths):
-        src, dst = paths[0][0], paths[0][-1]
+    def _get_paths_costs(self, paths):
+        """Return the ids, costs, and cost variables of the req paths"""
+        path_ids = [self.path_registry.get_id(path) for path in paths]
         path_costs = [self._get_path_cost(path) for path in paths]
-        path_names = [get_path_name(path) for path in paths]
-        cuttoff = self.gen_paths
-        count = 0
+        path_costs_var = []
+        for path_id, cost in zip(path_ids, path_costs):
+            if is_symbolic(cost):
+                path_costs_var.append(cost)
+            else:
+                path_costs_var.append(self._get_cost_var(path_id, cost))
+        return path_ids, path_costs, path_costs_var
+
+    def generate_ecmp_smt(self, paths, req_lit):
+        src, dst = paths[0][0], paths[0][-1]
+        path_ids, path_costs, path_costs_var = self._get_paths_costs(paths)
         path_key_req = tuple(paths[0])
-        if path_key_req not in self.saved_path_gen:
-            self.saved_path_gen[path_key_req] = self.generate_random_paths(
-                src, dst, 0.6, self.random_gen)
-        elif path_key_req not in self.counter_examples:
-            return
-        primary_name = path_names[0]
+        req_paths = set([tuple(path) for path in paths])
+        primary_id = path_ids[0]
         primary_cost = path_costs[0]
-        if not is_symbolic(primary_cost):
-            var = z3.Const("%s_cost" % path_names[0], z3.IntSort())
-            self.solver.add(var == primary_cost)
-            primary_cost_var = var
+        primary_cost_var = path_costs_var[0]
 
         # Assert ECMP
         for p_index in range(1, len(paths)):
-            path_name = path_names[p_index]
-            track_name = '%s_ISEQUAL_%s' % (primary_name, path_name)
-            if track_name in self._names_cache:
+            track_key = ('ISEQUAL', req_lit.get_id(), primary_id,
+                         path_ids[p_index])
+            if track_key in self._tracked:
                 continue
-            else:
-                self._names_cache.append(track_name)
             cost = path_costs[p_index]
             if is_symbolic(cost) or is_symbolic(primary_cost):
-                self.solver.assert_and_track(primary_cost == cost, track_name)
+                self._assert_req(req_lit, primary_cost == cost, track_key)
             else:
                 if cost != primary_cost:
-                    self.solver.assert_and_track(primary_cost_var == cost, track_name)
+                    self._assert_req(
+                        req_lit, primary_cost_var == cost, track_key)
 
-        for rand_path in self.saved_path_gen[path_key_req]:
+        for rand_path in self.iter_new_paths(path_key_req, src, dst, req_lit):
             # Skip if we generated the same path as the requirement
-            if rand_path in paths:
+            if not rand_path or tuple(rand_path) in req_paths:
                 continue
-            if rand_path:
-                rand_path_name = get_path_name(rand_path)
-                rand_path_cost = self._get_path_cost(rand_path)
-                track_name = '%s_ISLESS_%s' % (primary_name, rand_path_name)
-                if track_name in self._names_cache:
-                    continue
-                else:
-                    self._names_cache.append(track_name)
-                if is_symbolic(rand_path_cost) or is_symbolic(primary_cost):
-                    self.solver.assert_and_track(primary_cost < rand_path_cost, track_name)
-                else:
-                    if not (primary_cost < rand_path_cost):
-                        self.solver.assert_and_track(primary_cost_var < rand_path_cost, track_name)
-            count += 1
-            if count > cuttoff:
-                break
+            self._assert_less(
+                req_lit, primary_id, primary_cost, primary_cost_var,
+                self.path_registry.get_id(rand_path),
+                self._get_path_cost(rand_path))
 
-    def generate_path_order_smt(self, paths):
+    def generate_path_order_smt(self, paths, req_lit):
         src, dst = paths[0][0], paths[0][-1]
-        path_costs = [self._get_path_cost(path) for path in paths]
-        path_names = [get_path_name(path) for path in paths]
-        cuttoff = self.gen_paths
-        count = 0
+        path_ids, path_costs, path_costs_var = self._get_paths_costs(paths)
         path_key_req = tuple(paths[0])
-        if path_key_req not in self.saved_path_gen:
-            self.saved_path_gen[path_key_req] = self.generate_random_paths(
-                src, dst, 0.6, self.random_gen)
-        elif path_key_req not in self.counter_examples:
-            return
-
-        path_costs_var = []
-        for index, cost in enumerate(path_costs):
-            if is_symbolic(cost):
-                path_costs_var.append(cost)
-                continue
-            var = z3.Const("%s_cost" % path_names[index], z3.IntSort())
-            self.solver.add(var == cost)
-            path_costs_var.append(var)
+        req_paths = set([tuple(path) for path in paths])
 
         # Assert Ordering
-        for p0, p1 in zip(range(len(paths))[0::1],range(len(paths))[1::1]):
-            p0_name = get_path_name(paths[p0])
-            p1_name = get_path_name(paths[p1])
-            track_name = '%s_ORDER_%s' % (p0_name, p1_name)
+        for p0, p1 in zip(range(len(paths))[0::1], range(len(paths))[1::1]):
+            track_key = ('ORDER', req_lit.get_id(), path_ids[p0],
+                         path_ids[p1])
+            if track_key in self._tracked:
+                continue
             p0_cost = path_costs[p0]
             p1_cost = path_costs[p1]
             if is_symbolic(p0_cost) or is_symbolic(p1_cost):
-                self.solver.assert_and_track(p0_cost < p1_cost, track_name)
+                self._assert_req(req_lit, p0_cost < p1_cost, track_key)
             else:
                 if not (p0_cost < p1_cost):
-                    p0_var = z3.Const("%s_cost2" % p0_name, z3.IntSort())
-                    self.solver.add(p0_var == p0_cost)
-                    self.solver.assert_and_track(p0_var < p1_cost, track_name)
+                    p0_var = self._get_cost_var(path_ids[p0], p0_cost, 'cost2')
+                    self._assert_req(req_lit, p0_var < p1_cost, track_key)
 
-        for rand_path in self.saved_path_gen[path_key_req]:
+        for rand_path in self.iter_new_paths(path_key_req, src, dst, req_lit):
             # Skip if we generated the same path as the requirement
-            if rand_path in paths:
+            if not rand_path or tuple(rand_path) in req_paths:
                 continue
-            if rand_path:
-                for index in range(len(paths)):
-                    rand_path_name = get_path_name(rand_path)
-                    rand_path_cost = self._get_path_cost(rand_path)
-                    path_cost = path_costs[index]
-                    path_name = path_names[index]
-                    track_name = '%s_ISLESS_%s' % (path_name, rand_path_name)
-                    if track_name in self._names_cache:
-                        continue
-                    else:
-                        self._names_cache.append(track_name)
-                    if is_symbolic(path_cost) or is_symbolic(rand_path_cost):
-                        self.solver.assert_and_track(
-                            path_cost < rand_path_cost, track_name)
-                    else:
-                        path_cost_var = path_costs_var[index]
-                        if not (path_cost < rand_path_cost):
-                            self.solver.assert_and_track(
-                                path_cost_var < rand_path_cost, track_name)
-            count += 1
-            if count > cuttoff:
-                break
+            rand_path_id = self.path_registry.get_id(rand_path)
+            rand_path_cost = self._get_path_cost(rand_path)
+            for index in range(len(paths)):
+                self._assert_less(
+                    req_lit, path_ids[index], path_costs[index],
+                    path_costs_var[index], rand_path_id, rand_path_cost)
 
-    def generate_kconnected_smt(self, paths):
+    def generate_kconnected_smt(self, paths, req_lit):
         src, dst = paths[0][0], paths[0][-1]
-        path_costs = [self._get_path_cost(path) for path in paths]
-        path_names = [get_path_name(path) for path in paths]
-        cuttoff = self.gen_paths
-        count = 0
+        path_ids, path_costs, path_costs_var = self._get_paths_costs(paths)
         path_key_req = tuple(paths[0])
-        if path_key_req not in self.saved_path_gen:
-            self.saved_path_gen[path_key_req] = self.generate_random_paths(
-                src, dst, 0.6, self.random_gen)
-        elif path_key_req not in self.counter_examples:
-            return
-        path_costs_var = []
-        for index, cost in enumerate(path_costs):
-            if is_symbolic(cost):
-                path_costs_var.append(cost)
-                continue
-            var = z3.Const("%s_cost" % path_names[index], z3.IntSort())
-            self.solver.add(var == cost)
-            path_costs_var.append(var)
+        req_paths = set([tuple(path) for path in paths])
 
-        for rand_path in self.saved_path_gen[path_key_req]:
+        for rand_path in self.iter_new_paths(path_key_req, src, dst, req_lit):
             # Skip if we generated the same path as the requirement
-            if rand_path in paths:
+            if not rand_path or tuple(rand_path) in req_paths:
                 continue
-            if rand_path:
-                for index, path in enumerate(paths):
-                    path_name = path_names[index]
-                    path_cost = path_costs[index]
-                    rand_path_name = get_path_name(rand_path)
-                    rand_path_cost = self._get_path_cost(rand_path)
-                    track_name = '%s_ISLESS_%s' % (path_name, rand_path_name)
-                    if track_name in self._names_cache:
-                        continue
-                    else:
-                        self._names_cache.append(track_name)
-                    if is_symbolic(path_cost) or is_symbolic(rand_path_cost):
-                        self.solver.assert_and_track(
-                            path_cost < rand_path_cost, track_name)
-                    else:
-                        if not (path_cost < rand_path_cost):
-                            path_cost_var = path_costs_var[index]
-                            self.solver.assert_and_track(
-                                path_cost_var < rand_path_cost, track_name)
-            count += 1
-            if count > cuttoff:
-                break
+            rand_path_id = self.path_registry.get_id(rand_path)
+            rand_path_cost = self._get_path_cost(rand_path)
+            for index in range(len(paths)):
+                self._assert_less(
+                    req_lit, path_ids[index], path_costs[index],
+                    path_costs_var[index], rand_path_id, rand_path_cost)
+
+    def get_req_lit(self, req):
+        """Return the assumption literal that guards the req constraints"""
+        if id(req) not in self._req_lits:
+            lit = z3.Bool('req_%d' % len(self._lits_req))
+            self._req_lits[id(req)] = lit
+            self._lits_req[lit.get_id()] = req
+        return self._req_lits[id(req)]
 
     def push_requirements(self):
-        self.solver.push()
+        """
+        Add the constraints for the paths not encoded yet,
+        the solver is never popped so previous constraints are kept.
+        """
         self.log.info("Start pushing OSPF requirements")
         start = timer()
         self.all_req_paths = []
@@ -365,35 +502,80 @@ class OSPFSyn(SynthesisComponent):
         ordered_reqs = []
         ecmp_reqs = []
         kconnected_reqs = []
-        for req in self.reqs:
+        for req in self.get_encoded_reqs():
+            lit = self.get_req_lit(req)
             if isinstance(req, PathReq):
-                simple_reqs.append(req.path)
+                simple_reqs.append((req.path, lit))
                 self.all_req_paths.append(req.path)
             elif isinstance(req, PathOrderReq):
                 paths = [r.path for r in req.paths]
-                ordered_reqs.append(paths)
+                ordered_reqs.append((paths, lit))
                 self.all_req_paths.extend(paths)
             elif isinstance(req, ECMPPathsReq):
                 paths = [r.path for r in req.paths]
-                ecmp_reqs.append(paths)
+                ecmp_reqs.append((paths, lit))
                 self.all_req_paths.extend(paths)
             elif isinstance(req, KConnectedPathsReq):
                 paths = [r.path for r in req.paths]
-                kconnected_reqs.append(paths)
+                kconnected_reqs.append((paths, lit))
                 self.all_req_paths.extend(paths)
             else:
                 raise ValueError("Not supported req: %s", req)
-        for path in simple_reqs:
-            self.generate_path_smt(path)
-        for paths in ordered_reqs:
-            self.generate_path_order_smt(paths)
-        for paths in ecmp_reqs:
-            self.generate_ecmp_smt(paths)
-        for paths in kconnected_reqs:
-            self.generate_kconnected_smt(paths)
+        for path, lit in simple_reqs:
+            self.generate_path_smt(path, lit)
+        for paths, lit in ordered_reqs:
+            self.generate_path_order_smt(paths, lit)
+        for paths, lit in ecmp_reqs:
+            self.generate_ecmp_smt(paths, lit)
+        for paths, lit in kconnected_reqs:
+            self.generate_kconnected_smt(paths, lit)
+        # Counter examples are encoded now
+        self.counter_examples = {}
         end = timer()
         self.log.info("End pushing OSPF requirements: %s seconds", (end - start))
 
+    def solve(self):
+        """
+        Push the new constraints and call one incremental check()
+        under the assumption literals of the current requirements.
+        """
+        t1 = timer()
+        self.push_requirements()
+        t2 = timer()
+        assumptions = [self.get_req_lit(req) for req in self.get_encoded_reqs()]
+        while True:
+            result = self.check_solver(*(assumptions + self._pins.values()))
+            if result != z3.unsat or not self._release_pins():
+                break
+        t3 = timer()
+        self.solver_times.append(t3 - t2)
+        self.push_times.append(t2 - t1)
+        name = self.__class__.__name__
+        self.log.info("%s: Pushing requirements time: %s", name, t2 - t1)
+        self.log.info("%s: Z3 time (iteration %d): %s",
+                      name, len(self.solver_times), t3 - t2)
+        self.log.info("%s: sat result: %s", name, result)
+        return result == z3.sat
+
+    def _release_pins(self):
+        """
+        Release the pinned costs in the unsat core of the last check
+        :return: True if any pin is released
+        """
+        released = [lit for lit in self.solver.unsat_core()
+                    if lit.get_id() in self._pins]
+        for lit in released:
+            del self._pins[lit.get_id()]
+        if released:
+            self.log.info("%s: Released %d pinned costs",
+                          self.__class__.__name__, len(released))
+        return len(released) > 0
+
+    def get_unsat_reqs(self):
+        """Return the requirements in the unsat core of the last check"""
+        return [self._lits_req[lit.get_id()] for lit in self.solver.unsat_core()
+                if lit.get_id() in self._lits_req]
+
     def get_output_routing_graphs(self):
         """
         Returns one graph per each destination network.
@@ -408,11 +590,17 @@ class OSPFSyn(SynthesisComponent):
 
     def get_output_configs(self):
         """Returns list of (src, dst, cost)"""
-        return get_output_configs(self.solver.model(), self.ospf_graph)
+        if self.costs is None:
+            return get_output_configs(self.solver.model(), self.ospf_graph)
+        compact = get_compact_graph(self.ospf_graph)
+        return [(src, dst, self.costs[(src, dst)]) for src, dst in compact.edges]
 
     def get_output_network_graph(self):
         """Return OSPF graph annotated with synthesized costs"""
-        return get_output_network_graph(self.solver.model(), self.ospf_graph)
+        if self.costs is None:
+            return get_output_network_graph(self.solver.model(), self.ospf_graph)
+        compact = get_compact_graph(self.ospf_graph)
+        return compact.to_nx(np.array([self.costs[edge] for edge in compact.edges]))
 
     def update_network_graph(self):
         """Set concrete costs on the network graph"""
@@ -427,270 +615,591 @@ class OSPFSyn(SynthesisComponent):
         return cost
 
     def _get_path_cost(self, path):
-        """Shortcut function to get the cost function of aa given path"""
-        edge_costs = []
-        for i in range(len(path) - 1):
-            src = path[i]
-            dst = path[i + 1]
-            edge_costs.append(self._get_edge_cost(src, dst))
-        return sum(edge_costs)
+        """Shortcut function to get the (memoized) cost of a given path"""
+        return self.path_registry.get_cost(path)
 
     def add_req(self, req):
         assert isinstance(req, Req)
         assert req.protocol == Protocols.OSPF
         self.reqs.append(req)
 
-    def remove_unsat_paths(self):
+    def get_encoded_reqs(self):
+        """The requirements that are encoded in the solver"""
+        return [req for req in self.reqs if id(req) not in self._unaffected]
+
+    def add_reqs(self, reqs):
+        """Add requirements, the next synthesize() starts from the last costs"""
+        for req in reqs:
+            self.add_req(req)
+
+    def remove_reqs(self, reqs):
+        """
+        Retract requirements, their constraints are kept in the solver
+        but are inactive since their literals are not assumed anymore.
+        """
+        for req in reqs:
+            self.reqs.remove(req)
+            self._drop_path_gen(req)
+
+    def apply_topology_delta(self, added_edges=(), removed_edges=()):
+        """
+        Update the OSPF graph after links are added to or removed from the
+        network graph (by the caller). The new edges get a new symbolic
+        cost unless a concrete cost is set in the network graph.
+        The paths over a changed edge get new ids, and the requirements
+        with constraints over these paths get new literals, so their
+        constraints are encoded again with the new costs.
+        The costs of the last synthesis are cleared, the next
+        synthesize() starts from them.
+        :param added_edges: list of (src, dst)
+        :param removed_edges: list of (src, dst)
+        """
+        if self.ospf_graph is None:
+            # The graph is extracted by the first synthesize()
+            return
+        removed = set(removed_edges)
+        for req in self.reqs:
+            for path in get_req_paths(req):
+                if removed.intersection(zip(path[0::1], path[1::1])):
+                    raise ValueError(
+                        "Requirement path uses a removed edge: %s" % req)
+        if self.costs is not None:
+            self._warm_costs = self.costs
+            self.costs = None
+        for src, dst in removed:
+            self.ospf_graph.remove_edge(src, dst)
+            if self._warm_costs is not None:
+                self._warm_costs.pop((src, dst), None)
+        for src, dst in added_edges:
+            cost = get_ospf_edge_cost(
+                self.network_graph, self.ospf_graph, src, dst, self.log)
+            self.ospf_graph.add_edge(src, dst, cost=cost)
+            if is_symbolic(cost):
+                self.solver.add(cost > 0)
+        # Edge ids are changed, the compact graph is built again on demand
+        invalidate_compact_graph(self.ospf_graph)
+        # An edge can be added again with another cost
+        changed = list(removed) + list(added_edges)
+        self.path_registry.drop_costs(changed)
+        self._drop_stale_paths(self.path_registry.drop_paths(changed), removed)
+        if added_edges and self._unaffected:
+            # A new edge (concrete or symbolic) can be on a cheaper
+            # competing path, only keep skipping the requirements that
+            # still hold for any costs
+            compact = get_compact_graph(self.ospf_graph)
+            costs = compact.costs.copy()
+            costs[compact.symbolic_ids] = 1
+            verifier = OSPFVerifier(compact, costs)
+            self._unaffected = set(
+                id(req) for req in self.reqs if id(req) in self._unaffected
+                and self._holds_for_any_costs(compact, verifier, req))
+        # Edge ids are changed, the last model is dropped too
+        self.model_costs = None
+        self._model_graph = None
+
+    def _drop_stale_paths(self, stale_ids, removed):
         """
-        Remove one path from to the requirements if it's part of the unsat core.
-        :return: PathReq
+        Retract the constraints over the paths of the stale ids
+        (see apply_topology_delta)
+        :param stale_ids: the old ids of the paths over changed edges
+        :param removed: set of the removed edges
         """
-        unsat_paths = self.solver.unsat_core()
-        assert unsat_paths
-        for t in unsat_paths:
-            t = str(t)
-            if 'ISLESS' not in str(t):
+        if not stale_ids:
+            return
+        stale_lits = set()
+        for key in list(self._tracked):
+            if key[0] in ['ISLESS', 'ISEQUAL', 'ORDER']:
+                if stale_ids.intersection(key[2:]):
+                    stale_lits.add(key[1])
+                    self._tracked.discard(key)
+            elif key[0] in ['cost', 'cost2'] and key[1] in stale_ids:
+                self._tracked.discard(key)
+        for req in self.reqs:
+            lit = self._req_lits.get(id(req))
+            if lit is not None and lit.get_id() in stale_lits:
+                # The old literal is never assumed again
+                del self._req_lits[id(req)]
+        # Keep the generated paths that still exist, under their new ids
+        for key, path_ids in self._key_paths.items():
+            if not stale_ids.intersection(path_ids):
                 continue
-            path = t.split('_ISLESS_')[0].split('_')
-            path_req = None
-            for req in self.reqs[:]:
-                if isinstance(req, PathReq):
-                    if req.path == path:
-                        self.reqs.remove(req)
-                        path_req = req
-                        break
-                elif isinstance(req, (ECMPPathsReq, PathOrderReq, KConnectedPathsReq)):
-                    found = False  # To break outer loop
-                    for p in req.paths:
-                        if path == p.path:
-                            self.reqs.remove(req)
-                            path_req = req
-                            found = True
-                    if found:
-                        break
-                else:
-                    raise ValueError("Cannot remove req %s" % req)
-            assert path_req, "Couldn't find path in requirements %s" % path
-            self.removed_reqs.append(path_req)
-            break
-        self.reset_solver()
-        return self.removed_reqs[-1]
+            new_ids = []
+            for path_id in path_ids:
+                if path_id in stale_ids:
+                    path = self.path_registry.get_path(path_id)
+                    if removed.intersection(zip(path[0::1], path[1::1])):
+                        continue
+                    path_id = self.path_registry.get_id(path)
+                new_ids.append(path_id)
+            self._key_paths[key] = new_ids
+            # Encode them again for every requirement of the path
+            for read_key in [read_key for read_key in self._key_reads
+                             if read_key[1] == key]:
+                del self._key_reads[read_key]
+        for history in self.path_histories.values():
+            history.drop_ids(stale_ids)
+        self.log.info("%s: %d paths over changed edges, %d requirements "
+                      "are encoded again", self.__class__.__name__,
+                      len(stale_ids), len(stale_lits))
+
+    def check_concrete_costs(self, allow_ecmp=False):
+        """
+        Zero-solve pre-pass over the concrete part of the sketch.
+        A requirement with only concrete costs on its paths that holds when
+        every symbolic edge costs 1 (the lowest cost) holds for any
+        synthesized costs, since only the competing paths can get more
+        expensive, so it's not encoded in the solver. The rest are checked
+        with every symbolic edge costing more than any concrete path.
+        The costs are set (self.costs) if the solver is not needed.
+        :return: the list of the requirements that need the solver
+        """
+        if self.ospf_graph is None:
+            self.set_ospf_graph(
+                extract_ospf_graph(self.network_graph, self.log, self.encoding))
+        compact = get_compact_graph(self.ospf_graph)
+        has_symbolic = len(compact.symbolic_ids) > 0
+        costs = compact.costs.copy()
+        costs[compact.symbolic_ids] = 1
+        verifier = OSPFVerifier(compact, costs)
+        pending = []
+        self._unaffected = set()
+        for req in self.reqs:
+            if self._holds_for_any_costs(compact, verifier, req, allow_ecmp):
+                self._unaffected.add(id(req))
+            else:
+                pending.append(req)
+        if pending and has_symbolic:
+            costs[compact.symbolic_ids] = min(max(
+                compact.costs.max(), 1) * compact.num_nodes, OSPF_MAX_COST)
+            verifier = OSPFVerifier(compact, costs)
+            if all([self.check_req_satisfied(verifier, req, allow_ecmp)
+                    for req in pending]):
+                pending = []
+        if not pending or not has_symbolic:
+            self.costs = dict(zip(compact.edges, costs.tolist()))
+            self.model_costs = costs
+            self._model_graph = None
+        self.log.info(
+            "%s: %d out of %d requirements need the solver (%d symbolic edges)",
+            self.__class__.__name__, len(pending), len(self.reqs),
+            len(compact.symbolic_ids))
+        return pending
 
-    def _check_simple_path_req(self, out_graph, req, allow_ecmp=False):
+    def _holds_for_any_costs(self, compact, verifier, req, allow_ecmp=False):
+        """
+        True if the paths of the requirement have only concrete costs and
+        it holds when every symbolic edge costs 1 (the given verifier)
+        """
+        edges = [compact.edge_ids[edge] for path in get_req_paths(req)
+                 for edge in zip(path[0::1], path[1::1])]
+        return (not compact.symbolic[edges].any() and
+                self.check_req_satisfied(verifier, req, allow_ecmp))
+
+    def _check_previous_costs(self, previous, allow_ecmp=False):
+        """
+        Check the requirements against the costs of the last synthesis
+        with Dijkstra only, the new edges get a cost higher than any path.
+        If any is violated, the symbolic edges that are not on the
+        violated or the counter example paths are pinned to their
+        previous costs for the next solve().
+        :param previous: dict (src, dst) -> cost of the last synthesis
+        :return: True if the previous costs satisfy all the requirements
+        """
+        compact = get_compact_graph(self.ospf_graph)
+        new_cost = min(max(previous.values() or [1]) * compact.num_nodes,
+                       OSPF_MAX_COST)
+        costs = []
+        for src, dst in compact.edges:
+            cost = self.ospf_graph[src][dst]['cost']
+            if is_symbolic(cost):
+                cost = previous.get((src, dst), new_cost)
+            costs.append(cost)
+        verifier = OSPFVerifier(compact, costs)
+        violated = [req for req in self.reqs
+                    if not self.check_req_satisfied(verifier, req, allow_ecmp)]
+        if not violated:
+            self.costs = dict(zip(compact.edges, costs))
+            self.model_costs = np.array(costs)
+            self._model_graph = None
+            return True
+        affected = set()
+        paths = [path for req in violated for path in get_req_paths(req)]
+        paths.extend([path for c_paths in self.counter_examples.values()
+                      for path in c_paths])
+        for path in paths:
+            affected.update(zip(path[0::1], path[1::1]))
+        for src, dst in compact.edges:
+            cost = self.ospf_graph[src][dst]['cost']
+            if (src, dst) in affected or (src, dst) not in previous:
+                continue
+            if is_symbolic(cost):
+                self._pin_cost(src, dst, previous[(src, dst)])
+        self.log.info("%s: %d violated requirements, pinned %d out of %d edges",
+                      self.__class__.__name__, len(violated), len(self._pins),
+                      compact.num_edges)
+        return False
+
+    def _pin_cost(self, src, dst, value):
+        """Keep a symbolic edge cost at the given value unless released"""
+        cost = self.ospf_graph[src][dst]['cost']
+        lit = z3.Bool('pin_%s_%s_%d' % (src, dst, value))
+        if ('PIN', lit.get_id()) not in self._tracked:
+            self._tracked.add(('PIN', lit.get_id()))
+            self.solver.add(z3.Implies(lit, cost == value))
+        self._pins[lit.get_id()] = lit
+
+    def remove_unsat_paths(self):
+        """
+        Remove one requirement that is part of the unsat core.
+        The requirement is retracted by dropping its assumption literal,
+        so the solver and the other constraints are kept.
+        :return: the removed Req
+        """
+        unsat_reqs = self.get_unsat_reqs()
+        assert unsat_reqs
+        path_req = unsat_reqs[0]
+        self.reqs.remove(path_req)
+        self.removed_reqs.append(path_req)
+        self._drop_path_gen(path_req)
+        return path_req
+
+    def relax_reqs(self):
+        """
+        Retract the minimum number of requirements that makes the rest
+        satisfiable with one MaxSMT call: each requirement literal is a
+        soft constraint over the constraints encoded so far.
+        Since the encoded paths are only a subset of all paths, more
+        requirements might be retracted in the following CEGIS iterations.
+        :return: list of the removed Reqs or None if the constraints are
+                 unsatisfiable even without any requirement
+        """
+        opt = z3.Optimize()
+        opt.add(self.solver.assertions())
+        lits = [(self.get_req_lit(req), req) for req in self.get_encoded_reqs()]
+        for lit, _ in lits:
+            opt.add_soft(lit)
+        start = timer()
+        result = opt.check()
+        self.solver_times.append(timer() - start)
+        if result != z3.sat:
+            return None
+        model = opt.model()
+        dropped = [req for lit, req in lits
+                   if not z3.is_true(model.eval(lit, model_completion=True))]
+        for req in dropped:
+            self.reqs.remove(req)
+            self.removed_reqs.append(req)
+            self._drop_path_gen(req)
+        self.log.info("%s: Relaxed %d requirements",
+                      self.__class__.__name__, len(dropped))
+        # The kept requirements only hold for the encoded paths,
+        # their violations are encoded by the next solve()
+        compact, costs = get_output_costs(model, self.ospf_graph)
+        verifier = OSPFVerifier(compact, costs)
+        violated = [req for req in self.get_encoded_reqs()
+                    if not self.check_req_satisfied(verifier, req)]
+        self.log.info("%s: %d kept requirements are violated by the relaxed "
+                      "model", self.__class__.__name__, len(violated))
+        return dropped
+
+    def _violating_paths(self, dag, src, req_paths):
+        """
+        Return at most max_counter_examples shortest paths from src
+        that are not in req_paths
+        :param dag: ShortestPathDAG toward the destination
+        :param req_paths: set of path tuples
+        """
+        paths = (path for path in dag.all_shortest_paths(src)
+                 if tuple(path) not in req_paths)
+        return list(itertools.islice(paths, self.max_counter_examples))
+
+    def _add_counter_examples(self, key, paths):
+        if key not in self.counter_examples:
+            self.counter_examples[key] = []
+        self.counter_examples[key].extend(paths)
+
+    def _check_simple_path_req(self, verifier, req, allow_ecmp=False):
         """
         Check if a PathReq is satisfied
-        :param out_graph: the current ospf graph
+        :param verifier: OSPFVerifier of the current ospf graph
         :param req: PathReq
         :return: True if satisfied
         """
-        sat = True
         path = req.path
-        try:
-            spath = nx.all_shortest_paths(out_graph, path[0], path[-1], 'cost')
-            computed = list(spath)
-        except nx.NetworkXNoPath:
-            sat = False
-            return sat
-
-        if len(computed) > 1 or computed[0] != path:
-            if allow_ecmp and path in computed:
-                return sat
-            print "#" * 20
-            print "Required Simple shortest path", path
-            print "Computed Simple shortest path", computed
-            print "#" * 20
-            sat = False
-            key = get_path_key(path[0], path[-1])
-            if key not in self.counter_examples:
-                self.counter_examples[key] = []
-            for c_path in computed:
-                self.log.debug("ADDING COUNTER Simple example: %s", c_path)
-                self.counter_examples[key].append(c_path)
-        return sat
+        dag = verifier.get_dag(path[-1])
+        num_paths = dag.count_shortest_paths(path[0])
+        if num_paths == 0:
+            return False
+        if dag.is_shortest_path(path) and (num_paths == 1 or allow_ecmp):
+            return True
+        computed = self._violating_paths(dag, path[0], set([tuple(path)]))
+        self.log.debug("Required Simple shortest path %s, computed %d "
+                       "shortest paths, counter examples %s",
+                       path, num_paths, computed)
+        self._add_counter_examples(tuple(path), computed)
+        return False
 
-    def _check_ecmp_path_req(self, out_graph, req):
+    def _check_ecmp_path_req(self, verifier, req):
         """
         Check if a ECMPPathsReq is satisfied
-        :param out_graph: the current ospf graph
+        :param verifier: OSPFVerifier of the current ospf graph
         :param req: ECMPPathsReq
         :return: True if satisfied
         """
-        sat = True
-        req_paths = [tuple(r.path) for r in req.paths]
-        primary = req_paths[0]
-        try:
-            shortest = nx.all_shortest_paths(
-                out_graph, primary[0], primary[-1], 'cost')
-            computed = set([tuple(p) for p in shortest])
-        except nx.NetworkXNoPath:
-            sat = False
-            return sat
-        if computed != set(req_paths):
-            print "#" * 20
-            print "Required ECMP paths", req_paths
-            print "Computed ECMP paths", computed
-            print "#" * 20
-            sat = False
-            key = get_path_key(primary[0], primary[-1])
-            if key not in self.counter_examples:
-                self.counter_examples[key] = []
-            for c_path in computed:
-                self.log.debug("ADDING COUNTER ECMP example: %s", c_path)
-                self.counter_examples[key].append(c_path)
-        return sat
+        req_paths = set([tuple(r.path) for r in req.paths])
+        primary = req.paths[0].path
+        dag = verifier.get_dag(primary[-1])
+        num_paths = dag.count_shortest_paths(primary[0])
+        if num_paths == 0:
+            return False
+        if num_paths == len(req_paths) and \
+                all(dag.is_shortest_path(path) for path in req_paths):
+            return True
+        computed = self._violating_paths(dag, primary[0], req_paths)
+        self.log.debug("Required ECMP paths %s, computed %d shortest paths, "
+                       "counter examples %s", req_paths, num_paths, computed)
+        self._add_counter_examples(tuple(primary), computed)
+        return False
 
-    def _check_order_path_req(self, out_graph, req):
+    def _check_order_path_req(self, verifier, req):
         """
-        Check if a PathOrder is satisfied
-        :param out_graph: the current ospf graph
+        Check if a PathOrder is satisfied under max_failures link failures
+        :param verifier: OSPFVerifier of the current ospf graph
         :param req: PathOrder
         :return: True if satisfied
         """
-        sat = True
         req_paths = [r.path for r in req.paths]
-        all_edges = [(None, None)] + list(out_graph.edges())
         primary = req_paths[0]
-        for src, dst in all_edges:
-            out_copy = out_graph.copy()
-            if src is not None and dst is not None:
-                out_copy.remove_edge(src, dst)
+        computed = []
+
+        def is_valid(dag):
             curr_path = None
             for path in req_paths:
-                if path_exists(path, out_copy):
+                if dag.path_exists(path):
                     curr_path = path
                     break
             if not curr_path:
                 # None of the requirements paths exists anymore
-                continue
-            shortest = nx.all_shortest_paths(
-                out_copy, curr_path[0], curr_path[-1], 'cost')
-            computed = list(shortest)
-            if len(computed) > 1 or computed[0] != curr_path:
-                print "#" * 20
-                print "Required Order shortest path", curr_path
-                print "Computed Order shortest path", computed
-                print "#" * 20
-                sat = False
-                key = get_path_key(primary[0], primary[-1])
-                if key not in self.counter_examples:
-                    self.counter_examples[key] = []
-                for c_path in computed:
-                    self.log.debug("ADDING COUNTER PathOrder example: %s", c_path)
-                    self.counter_examples[key].append(c_path)
-                break
-        return sat
+                return True
+            if dag.count_shortest_paths(curr_path[0]) == 1 and \
+                    dag.is_shortest_path(curr_path):
+                return True
+            computed[:] = self._violating_paths(
+                dag, curr_path[0], set([tuple(curr_path)]))
+            return False
+
+        failure = verifier.find_failure(
+            primary[0], primary[-1], is_valid, self.max_failures)
+        if failure is None:
+            return True
+        self.log.debug("Failed links %s, computed Order shortest paths %s",
+                       failure.failed_edges(), computed)
+        self._add_counter_examples(tuple(primary), computed)
+        return False
 
-    def _check_kconnected_req(self, out_graph, req):
+    def _check_kconnected_req(self, verifier, req):
         """
-        Check if a KConnected is satisfied
-        :param out_graph: the current ospf graph
+        Check if a KConnected is satisfied under max_failures link failures
+        :param verifier: OSPFVerifier of the current ospf graph
         :param req: KConnected
         :return: True if satisfied
         """
-        sat = True
         req_paths = [r.path for r in req.paths]
-        all_edges = [(None, None)] + list(out_graph.edges())
         primary = req_paths[0]
-        for src, dst in all_edges:
-            out_copy = out_graph.copy()
-            if src is not None and dst is not None:
-                out_copy.remove_edge(src, dst)
-            try:
-                shortest = nx.all_shortest_paths(
-                    out_copy, primary[0], primary[-1], 'cost')
-                computed = list(shortest)
-            except nx.NetworkXNoPath:
-                continue
-            curr_reqs = []
-            for path in req_paths:
-                if path_exists(path, out_copy):
-                    curr_reqs.append(path)
+        not_valid = []
+
+        def is_valid(dag):
+            curr_reqs = set([tuple(path) for path in req_paths
+                             if dag.path_exists(path)])
             if not curr_reqs:
-                continue
-            not_valid_path = None
-            for p in computed:
-                if p not in curr_reqs:
-                    not_valid_path = p
-                    break
-            if not_valid_path:
-                print "#" * 20
-                print "Required KConnected shortest path", curr_reqs
-                print "Computed KConnected shortest path", not_valid_path
-                print "#" * 20
-                sat = False
-                key = get_path_key(primary[0], primary[-1])
-                if key not in self.counter_examples:
-                    self.counter_examples[key] = []
-                self.log.debug("ADDING COUNTER KConnected example: %s", not_valid_path)
-                self.counter_examples[key].append(not_valid_path)
-                break
-        return sat
+                return True
+            # Valid if all the shortest paths are required paths
+            num_shortest = len([path for path in curr_reqs
+                                if dag.is_shortest_path(path)])
+            if dag.count_shortest_paths(primary[0]) == num_shortest:
+                return True
+            not_valid[:] = [self._violating_paths(dag, primary[0], curr_reqs)[0],
+                            sorted(curr_reqs)]
+            return False
+
+        failure = verifier.find_failure(
+            primary[0], primary[-1], is_valid, self.max_failures)
+        if failure is None:
+            return True
+        not_valid_path, curr_reqs = not_valid
+        self.log.debug("Failed links %s, required KConnected shortest path %s, "
+                       "computed %s", failure.failed_edges(), curr_reqs,
+                       not_valid_path)
+        self._add_counter_examples(tuple(primary), [not_valid_path])
+        return False
 
     def check_req_satisfied(self, out_graph, req, allow_ecmp=False):
+        """
+        Check if a requirement is satisfied by the concrete costs
+        :param out_graph: the current ospf graph or an OSPFVerifier of it,
+                          requirements checked with the same verifier
+                          share the shortest path DAG of their destination
+        :param req: Req
+        :return: True if satisfied
+        """
         sat = True
+        if isinstance(out_graph, OSPFVerifier):
+            verifier = out_graph
+        else:
+            verifier = OSPFVerifier(out_graph)
         if isinstance(req, PathReq):
-            sat = self._check_simple_path_req(out_graph, req, allow_ecmp=allow_ecmp)
+            sat = self._check_simple_path_req(verifier, req, allow_ecmp=allow_ecmp)
         elif isinstance(req, ECMPPathsReq):
-            sat = self._check_ecmp_path_req(out_graph, req)
+            sat = self._check_ecmp_path_req(verifier, req)
         elif isinstance(req, PathOrderReq):
-            sat = self._check_order_path_req(out_graph, req)
+            sat = self._check_order_path_req(verifier, req)
         elif isinstance(req, KConnectedPathsReq):
-            sat = self._check_kconnected_req(out_graph, req)
+            sat = self._check_kconnected_req(verifier, req)
         else:
             raise ValueError("Cannot check req for %s", req)
         return sat
 
-    def synthesize(self, retries_before_rest=5, gen_path_increment=500, allow_ecmp=False):
+    def _relax(self):
+        """Relax the requirements and check the remaining ones"""
+        if self.relax_reqs() is None:
+            return False
+        self.log.info("Removed requirements %s", self.removed_reqs)
+        return self.solve()
+
+    def set_ospf_graph(self, ospf_graph):
         """
-        The main synthesis method
-        :param retries_before_rest: how many time to try before resetting
-                                    for new instance of the SMT solver
-        :param gen_path_increment: how many paths to generate per iterations
-        :return: bool
+        Set the OSPF graph to synthesize the costs for, it can be
+        a sub graph of the network to only consider the paths within it.
+        Must be called before synthesize().
         """
-        # Load Graph
-        self.ospf_graph = extract_ospf_graph(self.network_graph, self.log)
+        assert self.ospf_graph is None
+        self.ospf_graph = ospf_graph
+        self.path_registry = PathRegistry(self.ospf_graph)
         load_graph_constrains(self.solver, self.ospf_graph)
 
-        origianl_gen_paths = self.gen_paths
+    def synthesize(self, retries_before_rest=5, gen_path_increment=500,
+                   allow_ecmp=False, relax=False):
+        """
+        The main synthesis method, an incremental CEGIS loop over
+        one live solver.
+        The first call skips the solver if the concrete costs of the
+        sketch already satisfy the requirements (see check_concrete_costs).
+        After a delta (add_reqs, remove_reqs, apply_topology_delta) the
+        costs of the last synthesis are checked first and only re-solved
+        if they violate the new requirements.
+        :param retries_before_rest: how many iterations before generating
+                                    extra random paths for the violated reqs
+        :param gen_path_increment: how many extra paths to generate per
+                                   iteration after retries_before_rest
+        :param relax: if True, conflicting requirements are retracted
+                      (see relax_reqs) and moved to self.removed_reqs
+                      instead of failing the synthesis
+        :return: bool
+        """
+        start = timer()
+        # Load Graph, only once since the solver is kept across calls
+        if self.ospf_graph is None:
+            self.set_ospf_graph(
+                extract_ospf_graph(self.network_graph, self.log, self.encoding))
+
+        previous = self.costs if self.costs is not None else self._warm_costs
+        self._warm_costs = None
+        if previous is not None:
+            # Warm start from the costs of the last synthesis
+            if self._check_previous_costs(previous, allow_ecmp):
+                self.log.info("Previous OSPF costs satisfy the requirements")
+                return self._done(start, True, 'warm_start')
+            # Not valid anymore, even if the solver fails
+            self.costs = None
+        else:
+            pending = self.check_concrete_costs(allow_ecmp)
+            if not pending:
+                return self._done(start, True, 'concrete')
+            if self.costs is not None:
+                # Nothing to synthesize, the costs are all concrete
+                self.log.info("Reqs are violated by the concrete costs %s",
+                              pending)
+                if not relax:
+                    self.costs = None
+                    return self._done(start, False, 'concrete')
+                for req in pending:
+                    self.reqs.remove(req)
+                    self.removed_reqs.append(req)
+                return self._done(start, True, 'concrete')
 
         # First try to synthesize with all requirements
-        while not self.solve():
+        num_constraints = len(self._tracked)
+        if not self.solve():
             # At this point any unsat is directly caused by the requirements
-            # So remove one of them
-            print "Reqs directly are unsatisfiable"
-            print self.solver.unsat_core()
-            #self.remove_unsat_paths()
-            return False
+            self.log.info("Reqs directly are unsatisfiable %s",
+                          self.get_unsat_reqs())
+            if not relax or not self._relax():
+                return self._done(start, False, 'cegis')
 
         # Now the actual synthesis
         retries = 0
         while True:
-            recompute = False
             # Check if all requirements are already satisfied
-            # Using dijkstra algorithm
-            for req in self.reqs:
-                g_ospf = self.get_output_network_graph()
-                if not self.check_req_satisfied(g_ospf, req, allow_ecmp=allow_ecmp):
-                    recompute = True
-            if not recompute:
+            # Using dijkstra algorithm, once per destination
+            t1 = timer()
+            compact, self.model_costs = get_output_costs(
+                self.solver.model(), self.ospf_graph)
+            self._model_graph = None
+            t2 = timer()
+            verifier = OSPFVerifier(compact, self.model_costs)
+            reqs = self.get_encoded_reqs()
+            violated = [req for req in reqs if not self.check_req_satisfied(
+                verifier, req, allow_ecmp=allow_ecmp)]
+            t3 = timer()
+            if self.telemetry.enabled:
+                history_paths, history_evicted, history_bytes, \
+                    registry_bytes = self.get_history_stats()
+                self.telemetry.emit(
+                    'cegis_iteration', synthesizer=self.__class__.__name__,
+                    iteration=len(self.solver_times), reqs_checked=len(reqs),
+                    violated=len(violated),
+                    counter_examples=sum([len(paths) for paths in
+                                          self.counter_examples.values()]),
+                    constraints_added=len(self._tracked) - num_constraints,
+                    push_time=self.push_times[-1],
+                    solver_time=self.solver_times[-1],
+                    graph_time=t2 - t1, verify_time=t3 - t2,
+                    history_paths=history_paths,
+                    history_evicted=history_evicted,
+                    history_bytes=history_bytes,
+                    registry_bytes=registry_bytes,
+                    memory=get_memory_usage())
+            if not violated:
+                self.costs = dict(zip(compact.edges, self.model_costs.tolist()))
+                self._pins = {}
                 break
-            print "Recomputing ospf costs"
+            self.log.info("Recomputing ospf costs, %d violated requirements",
+                          len(violated))
             retries += 1
             if retries > retries_before_rest:
-                self.gen_paths += gen_path_increment
-                print "RESET SOLVER and increase the number of paths to", self.gen_paths, "#" * 10
-                self.reset_solver()
-            while not self.solve():
-                print "UNSAT"
-                print self.solver.unsat_core()
-                #removed_path = self.remove_unsat_paths()
-                print "#" * 40
-                #print "Removed path from req", removed_path
-                #assert not removed_path
-                self.gen_paths = origianl_gen_paths
-                print "#" * 40
-        return True
+                self.extra_paths += gen_path_increment
+                self.log.info("Increase the number of extra paths to %d",
+                              self.extra_paths)
+            num_constraints = len(self._tracked)
+            if not self.solve():
+                # Counter examples are necessary conditions,
+                # so the requirements cannot be satisfied together
+                self.log.info("UNSAT %s", self.get_unsat_reqs())
+                if not relax or not self._relax():
+                    return self._done(start, False, 'cegis')
+        self.log.info("CEGIS Z3 times per iteration: %s", self.solver_times)
+        return self._done(start, True, 'cegis')
+
+    def _done(self, start, result, mode):
+        """Emit the summary record of synthesize() and return the result"""
+        self.telemetry.emit(
+            'cegis_done', synthesizer=self.__class__.__name__, mode=mode,
+            result=result, iterations=len(self.solver_times),
+            reqs=len(self.reqs), removed_reqs=len(self.removed_reqs),
+            constraints=len(self._tracked),
+            solver_time=sum(self.solver_times), total_time=timer() - start,
+            memory=get_memory_usage())
+        return result
 
     def print_costs(self):
         """Print the synthesized edge costs"""
@@ -2,6 +2,7 @@
 Common functions for synthesis
 """
 
+import logging
 from abc import ABCMeta
 from abc import abstractmethod
 from collections import Iterable
@@ -14,6 +15,8 @@ import z3
 from networkx.drawing import nx_pydot
 
 from tekton.graph import NetworkGraph
+from synet.utils.telemetry import Telemetry
+from synet.utils.telemetry import get_memory_usage
 
 
 __author__ = "Ahmed El-Hassany"
@@ -265,7 +268,7 @@ def generate_second_path(G, path, random_obj):
         edges = zip(path[0::1], path[1::1])
         candidate = random_obj.choice(edges)
         new_g.remove_edge(*candidate)
-        if new_g.has_edge(src, dst):
+        if nx.has_path(new_g, src, dst):
             break
         else:
             counter += 1
@@ -408,6 +411,15 @@ class SynthesisComponent(object):
         self.solver = solver
         # Requirements for the synthesis
         self.reqs = []
+        # Optional SolverPortfolio to run the solver checks on
+        self.portfolio = None
+        # Optional SMTCache to answer the solver checks seen before
+        self.smt_cache = None
+        # Structured records of the synthesis progress, no sinks by default
+        self.telemetry = Telemetry()
+        if not hasattr(self, 'log'):
+            self.log = logging.getLogger('%s.%s' % (
+                self.__module__, self.__class__.__name__))
 
     def _get_names(self, configs, graph):
         node_names, interface_names, network_names, announced_networks = get_vertices(graph)
@@ -455,22 +467,51 @@ class SynthesisComponent(object):
         t1 = timer()
         self.push_requirements()
         t2 = timer()
-        result = self.solver.check()
+        result = self.check_solver()
         t3 = timer()
         treqs = t2 - t1
         tz3 = t3 - t2
-        ttotal = t2 - t1
+        ttotal = t3 - t1
         name = self.__class__.__name__
-        print "%s: Pushing requirements time: %s" % (name, treqs)
-        print "%s: Z3 time: %s" % (name, tz3)
-        print "%s: Total synthesizes time: %s" % (name, ttotal)
-        print "%s: sat result: %s" % (name, result)
+        self.log.info("%s: Pushing requirements time: %s", name, treqs)
+        self.log.info("%s: Z3 time: %s", name, tz3)
+        self.log.info("%s: Total synthesizes time: %s", name, ttotal)
+        self.log.info("%s: sat result: %s", name, result)
+        self.telemetry.emit(
+            'solve', synthesizer=name, reqs=len(self.reqs),
+            push_time=treqs, solver_time=tz3, result=str(result),
+            memory=get_memory_usage())
         if result == z3.sat:
             return True
         else:
             self.solver.pop()
             return False
 
+    def get_tracked_lits(self):
+        """
+        The literals used with self.solver.assert_and_track,
+        required to check the solver on a portfolio
+        """
+        return []
+
+    def check_solver(self, *assumptions):
+        """
+        Check self.solver, on the portfolio if one is set,
+        and through the SMT cache if one is set
+        """
+        if self.smt_cache is not None:
+            return self.smt_cache.check(
+                self.solver, assumptions, self.get_tracked_lits(),
+                check=lambda: self._check_solver(*assumptions))
+        return self._check_solver(*assumptions)
+
+    def _check_solver(self, *assumptions):
+        """Check self.solver, on the portfolio if one is set"""
+        if self.portfolio is None:
+            return self.solver.check(*assumptions)
+        return self.portfolio.check(
+            self.solver, assumptions, self.get_tracked_lits())
+
     @abstractmethod
     def get_output_network_graph(self):
         """
@@ -5,6 +5,10 @@ Helper class to keep track of SMT vars and constraints
 """
 
 import itertools
+import logging
+import re
+import sys
+from array import array
 from timeit import default_timer as timer
 
 import z3
@@ -38,26 +42,42 @@ SMT_NAME_MAP = {
 
 ALPHA = 'APLPHA_'
 
+# Memoized results of sanitize_smt_name and desanitize_smt_name,
+# cleared when they grow beyond MAX_NAMES_CACHE names
+MAX_NAMES_CACHE = 100000
+_SANITIZED_NAMES = {}
+_DESANITIZED_NAMES = {}
+
 
 def sanitize_smt_name(name):
     """Replace special chars from a name to make more friendly to SMT solver"""
+    if name in _SANITIZED_NAMES:
+        return _SANITIZED_NAMES[name]
     if not name[0].isalpha():
         tmp = "{}{}".format(ALPHA, name)
     else:
         tmp = name
     for k, v in SMT_NAME_MAP.iteritems():
         tmp = tmp.replace(k, v)
+    if len(_SANITIZED_NAMES) >= MAX_NAMES_CACHE:
+        _SANITIZED_NAMES.clear()
+    _SANITIZED_NAMES[name] = tmp
     return tmp
 
 
 def desanitize_smt_name(name):
     """Return the special chars to the SMT name"""
+    if name in _DESANITIZED_NAMES:
+        return _DESANITIZED_NAMES[name]
     if name.startswith(ALPHA):
         tmp = name[len(ALPHA):]
     else:
         tmp = name
     for k, v in SMT_NAME_MAP.iteritems():
         tmp = tmp.replace(v, k)
+    if len(_DESANITIZED_NAMES) >= MAX_NAMES_CACHE:
+        _DESANITIZED_NAMES.clear()
+    _DESANITIZED_NAMES[name] = tmp
     return tmp
 
 
@@ -146,7 +166,11 @@ class EnumType(object):
         self.z3_ctx = z3_ctx
         self._sort, self._symbolic_values = z3.EnumSort(name, values,
                                                         ctx=self.z3_ctx)
-
+        # Sanitized string value -> z3 value and z3 AST id -> string value
+        self._symbolic_by_name = dict(zip(values, self._symbolic_values))
+        self._concrete_by_id = dict(
+            (var.get_id(), value)
+            for value, var in zip(values, self._symbolic_values))
 
     @property
     def name(self):
@@ -168,26 +192,32 @@ class EnumType(object):
         """All string values"""
         return self._concrete_values
 
+    def has_value(self, value):
+        """Return True if the (sanitized) string value is defined"""
+        return value in self._symbolic_by_name
+
     def get_symbolic_value(self, value):
         """Given a string value return the Z3 value"""
+        if value in self._symbolic_by_name:
+            # Already sanitized
+            return self._symbolic_by_name[value]
         value = sanitize_smt_name(value)
-        if value not in self._concrete_values:
+        if value not in self._symbolic_by_name:
             err = "Value '%s' is not defined in %s" % (
                 value, self.concrete_values)
             raise ValueError(err)
-        indexof = self._concrete_values.index(value)
-        return self.symbolic_values[indexof]
+        return self._symbolic_by_name[value]
 
     def get_concrete_value(self, var):
         """Given a z3 variable, return the actual string value"""
         assert is_symbolic(var)
-        if var not in self._symbolic_values:
+        value = self._concrete_by_id.get(var.get_id())
+        if value is None or var.ctx != self.z3_ctx:
             err = "Symbolic value '{}' of type '{}' is not defined. " \
                   "Current defined values are: {}".format(
                 var, self.name, self.symbolic_values)
             raise ValueError(err)
-        indexof = self.symbolic_values.index(var)
-        return self.concrete_values[indexof]
+        return value
 
     def __str__(self):
         return "EnumType(%s, %s)" % (self.name, len(self.concrete_values))
@@ -196,19 +226,73 @@ class EnumType(object):
         return "EnumType(%s)" % self.name
 
 
+class RankCompare(object):
+    """
+    Compare the values of an EnumType by an integer rank of each value,
+    GREATER, LESS, and EQ follow from comparing the ranks.
+    Requires one constraint per value instead of the axioms for each
+    pair of values, but the comparison is a total order.
+    The ranks are free (synthesized), the BGP selection doesn't use it
+    since its orders (e.g., of the origins) are fixed by the protocol.
+    """
+
+    def __init__(self, name, vsort, comparator):
+        """
+        :param name: the name of the compare function
+        :param vsort: the EnumType of the compared values
+        :param comparator: the Comparator EnumType
+        """
+        self.name = name
+        self.vsort = vsort
+        self.z3_ctx = vsort.z3_ctx
+        self.rank = z3.Function('rank_%s' % name, vsort.sort,
+                                z3.IntSort(ctx=self.z3_ctx))
+        self.greater = comparator.get_symbolic_value('GREATER')
+        self.less = comparator.get_symbolic_value('LESS')
+        self.equal = comparator.get_symbolic_value('EQ')
+
+    def __call__(self, var1, var2):
+        """Return the comparator value of comparing var1 to var2"""
+        rank1 = self.rank(var1)
+        rank2 = self.rank(var2)
+        return z3.If(rank1 > rank2, self.greater,
+                     z3.If(rank1 < rank2, self.less, self.equal, self.z3_ctx),
+                     self.z3_ctx)
+
+    def constraints(self):
+        """Yield (name, constraint) bounding the rank of each value"""
+        num_values = len(self.vsort.concrete_values)
+        for value in self.vsort.concrete_values:
+            rank = self.rank(self.vsort.get_symbolic_value(value))
+            yield ("compare_rank_{}_{}".format(self.name, value),
+                   z3.And(rank >= 0, rank < num_values, self.z3_ctx))
+
+
 class SMTVar(object):
     """Hold Symbolic variables in SyNET"""
 
-    def __init__(self, name, vsort, value=None):
+    # No per instance __dict__, sketches create hundreds of thousands of vars
+    __slots__ = ('_name', '_vsort', '_var', '_is_concrete', '_value',
+                 '_model_ref', '_from_model')
+
+    def __init__(self, name, vsort, value=None, model_ref=None):
         """
-        :param name: The name of z3 variable
+        :param name: The name of z3 variable, or the number of a name
+                     generated by the SolverContext (the name is only
+                     built when it's needed, see SolverContext.get_var_name)
         :param vsort: The type of the variable, support z3.IntSort & EnumType
         :param value: optional conrete value for the var
+        :param model_ref: a list [model, SolverContext] shared with the
+                          SolverContext, once it holds a z3 model, the var
+                          is concrete and it's evaluated against the model
+                          on demand
         """
-        assert isinstance(name, basestring)
+        if isinstance(name, basestring):
+            assert name[0].isalpha(), "Name is not valid {}".format(name)
+        else:
+            assert model_ref is not None, "Generated names need the context"
         self._name = name
-        assert self._name[0].isalpha(), "Name is not valid {}".format(self.name)
-        self._is_enum = isinstance(vsort, EnumType)
+        self._vsort = vsort
         if value is None or is_empty(value):
             is_concrete = False
             value = VALUENOTSET
@@ -216,13 +300,16 @@ class SMTVar(object):
             is_concrete = True
             if self._is_enum and not is_symbolic(value):
                 value = vsort.get_symbolic_value(value)
-        if self._is_enum:
-            self._var = z3.Const(self.name, vsort.sort)
-        else:
-            self._var = z3.Const(self.name, vsort)
-        self._vsort = vsort
+        # The z3 variable of a concrete var is only created if needed
+        self._var = None
         self._is_concrete = is_concrete
         self._value = value
+        self._model_ref = model_ref
+        # True once the value is read from a model, the z3 variable
+        # of such var is still free in the constraints
+        self._from_model = False
+        if not is_concrete:
+            self.get_var()
 
     def __str__(self):
         return "SMTVar({}, {}, {})".format(
@@ -230,35 +317,90 @@ class SMTVar(object):
             self.get_value() if self.is_concrete else '?')
 
     def __hash__(self):
-        return hash((self.name, self.get_var().get_id()))
+        return hash(self.name)
 
     def __eq__(self, other):
         if self.name != getattr(other, 'name', None):
             return False
-        other_var = getattr(other, 'get_var', None)
-        if not other_var or other_var().get_id() != self.get_var().get_id():
+        if not isinstance(other, SMTVar):
+            other_var = getattr(other, 'get_var', None)
+            return bool(other_var) and \
+                other_var().get_id() == self.get_var().get_id()
+        if self._var is not None and other._var is not None:
+            return self._var.get_id() == other._var.get_id()
+        # Compare the concrete vars without creating their z3 variables
+        if not (self._is_concrete and other._is_concrete) or \
+                self._vsort != other._vsort:
             return False
-        return True
+        if self._is_enum:
+            return self._value.eq(other._value)
+        return self._value == other._value
 
     @property
     def name(self):
         """The name of variable, should be unique"""
-        return self._name
+        if isinstance(self._name, basestring):
+            return self._name
+        return self._model_ref[1].get_var_name(self._name)
 
     @property
     def vsort(self):
         """The type of the variable"""
         return self._vsort
 
+    @property
+    def _is_enum(self):
+        return isinstance(self._vsort, EnumType)
+
     @property
     def is_concrete(self):
         """Returns True if a concrete value is already defined"""
-        return self._is_concrete
+        if self._is_concrete:
+            return True
+        return self._model_ref is not None and self._model_ref[0] is not None
+
+    @property
+    def has_fixed_value(self):
+        """Returns True if the var was created with a concrete value"""
+        return self._is_concrete and not self._from_model
+
+    def _read_model(self):
+        """Evaluate the var against the model set by SolverContext (if any)"""
+        if not self._is_concrete and self._model_ref is not None \
+                and self._model_ref[0] is not None:
+            self.eval(self._model_ref[0])
 
     def get_var(self):
         """Return the Z3 variable"""
+        if self._var is None:
+            if self._is_enum:
+                self._var = z3.Const(self.name, self._vsort.sort)
+            else:
+                self._var = z3.Const(self.name, self._vsort)
+            if self._is_concrete and self._model_ref is not None:
+                # Constraints can refer to the z3 variable of a concrete var
+                self._model_ref[1]._add_concrete_z3_var(self)
         return self._var
 
+    def memory_usage(self):
+        """Approximate number of bytes used by the var"""
+        size = sys.getsizeof(self)
+        if isinstance(self._name, basestring):
+            size += sys.getsizeof(self._name)
+        if type(self._value) in (int, long) and not -5 <= self._value <= 256:
+            # Python doesn't share the objects of these ints
+            size += sys.getsizeof(self._value)
+        if self._var is not None:
+            size += self.z3_var_memory_usage()
+        return size
+
+    def z3_var_memory_usage(self):
+        """Approximate number of bytes used by the z3 variable wrapper"""
+        if self._var is None:
+            return 0
+        return (sys.getsizeof(self._var) + sys.getsizeof(self._var.__dict__) +
+                sys.getsizeof(self._var.ast))
+
     @property
     def var(self):
         """
@@ -266,12 +408,14 @@ class SMTVar(object):
         This should be used when building constrains
         """
         if self.is_concrete:
+            self._read_model()
             return self._value
         return self.get_var()
 
     def get_value(self):
         """Return the concrete value"""
         if self.is_concrete:
+            self._read_model()
             if self._is_enum:
                 return self.vsort.get_concrete_value(self._value)
             return self._value
@@ -286,8 +430,13 @@ class SMTVar(object):
 
     def eval(self, model):
         """Concertize the variable value based on the z3 model"""
-        if not self.is_concrete:
-            value = model.eval(self.get_var())
+        if not self._is_concrete:
+            self._set_model_value(model.eval(self.get_var()))
+        return self.get_value()
+
+    def _set_model_value(self, value):
+        """Set the value of the var as read from a z3 model"""
+        if not self._is_concrete:
             if self._is_enum:
                 self._value = value
             elif isinstance(value, z3.BoolRef):
@@ -306,7 +455,7 @@ class SMTVar(object):
                 err = "Currently only support enums and ints"
                 raise NotImplementedError(err)
             self._is_concrete = True
-        return self.get_value()
+            self._from_model = True
 
 
 class SolverContext(object):
@@ -314,15 +463,44 @@ class SolverContext(object):
     Keep track of all variables and constraints to make sure they're unique
     """
 
-    def __init__(self, z3_ctx):
-        self._vars = {}  # Map a name to a var id
+    def __init__(self, z3_ctx, keep_concrete_vars=False):
+        """
+        :param z3_ctx: the z3.Context of the vars and the constraints
+        :param keep_concrete_vars: keep the vars created with a concrete
+                                   value (and a generated name) in self._vars,
+                                   otherwise they're not registered, their
+                                   names are only built on demand, and
+                                   they're freed with the objects using them
+        """
+        self._vars = {}  # Map a name to a var (see keep_concrete_vars)
         self._tracked = {}  # Map a name to constraints, additional info
-        self._next_varnum = itertools.count(0)
+        self.keep_concrete_vars = keep_concrete_vars
+        # The generated var names are the prefix followed by the number,
+        # the prefix id of each number is kept in a compact array
+        self._prefixes = []
+        self._prefix_ids = {}
+        self._var_prefix_ids = array('i')
+        # Number of the names given by the callers of create_fresh_var
+        self._num_named_vars = 0
+        # Per prefix id: number of vars and the approximate bytes
+        self._prefix_vars = []
+        self._prefix_bytes = []
+        # The concrete vars that are not registered in self._vars but
+        # their z3 variables are created (see _get_concrete_substitutions)
+        self._concrete_z3_vars = []
+        # Number of the vars that are not registered in self._vars
+        self._num_unregistered = 0
         self._next_constnum = itertools.count(0)
         self._enum_types = {}
         self._enum_compare = {}
         self._enum_compare_sort = {}
         self.z3_ctx = z3_ctx
+        self.log = logging.getLogger('%s.%s' % (
+            self.__module__, self.__class__.__name__))
+        # Shared with the vars created since the last set_model
+        self._model_ref = [None, self]
+        # True once eval_vars() read all the vars of the last model
+        self._all_vars_read = False
         self.compare_vals = ['GREATER', 'LESS', 'EQ', 'UNKNOWN']
         self.comparator = self.create_enum_type('Comparator', self.compare_vals)
         self.compare_vars = [self.comparator.get_symbolic_value(x) for x in self.compare_vals]
@@ -337,7 +515,7 @@ class SolverContext(object):
                 raise ValueError("Enum Value {} contains special chars".format(value))
             assert value[0].isalpha(), "Name is not valid {}".format(value)
             for ename, etype in self._enum_types.iteritems():
-                if value in etype.concrete_values:
+                if etype.has_value(value):
                     err = "Duplicate value '%s' already defined in %s" % (
                         value, ename)
                     raise ValueError(err)
@@ -349,19 +527,59 @@ class SolverContext(object):
         """Get the EnumType object of the given type name"""
         return self._enum_types[name]
 
-    def fresh_var_name(self, prefix=None):
+    def _get_prefix_id(self, prefix):
+        """Return the id of the name prefix"""
+        prefix_id = self._prefix_ids.get(prefix)
+        if prefix_id is None:
+            prefix_id = len(self._prefixes)
+            self._prefixes.append(prefix)
+            self._prefix_ids[prefix] = prefix_id
+            self._prefix_vars.append(0)
+            self._prefix_bytes.append(0)
+        return prefix_id
+
+    def _fresh_var_num(self, prefix=None):
         """
-        Creates a fresh name for the next variable
-        :return: basestring new variable name
+        Allocate the number of a new generated var name.
+        The numbers are unique across the prefixes and the prefixes don't
+        end with a digit, so the generated names are unique, only the
+        names given by the callers need to be checked.
+        :return: int
         """
         if not prefix:
             prefix = 'Var_'
         else:
             prefix = sanitize_smt_name(prefix)
-        name = "%s%d" % (prefix, self._next_varnum.next())
-        while name in self._vars:
-            name = "%s%d" % (prefix, self._next_varnum.next())
-        return name
+            if prefix[-1].isdigit():
+                prefix += '_'
+        prefix_id = self._get_prefix_id(prefix)
+        num = len(self._var_prefix_ids)
+        self._var_prefix_ids.append(prefix_id)
+        if self._num_named_vars:
+            while self.get_var_name(num) in self._vars:
+                num = len(self._var_prefix_ids)
+                self._var_prefix_ids.append(prefix_id)
+        return num
+
+    def get_var_name(self, num):
+        """Return the generated var name of the given number"""
+        return "%s%d" % (self._prefixes[self._var_prefix_ids[num]], num)
+
+    def _is_generated_name(self, name):
+        """True if the name is already generated for a var"""
+        match = re.match(r'^(.*\D)(\d+)$', name)
+        if not match or match.group(2) != str(int(match.group(2))):
+            return False
+        num = int(match.group(2))
+        return (num < len(self._var_prefix_ids) and
+                self._prefixes[self._var_prefix_ids[num]] == match.group(1))
+
+    def fresh_var_name(self, prefix=None):
+        """
+        Creates a fresh name for the next variable
+        :return: basestring new variable name
+        """
+        return self.get_var_name(self._fresh_var_num(prefix))
 
     def _register_var(self, var):
         """
@@ -386,17 +604,61 @@ class SolverContext(object):
         :param name: if name is not provided, a new name will be generated
         :return: z3 Variable
         """
+        # Bytes of the var in the registry
+        size = 0
         if not name:
-            name = self.fresh_var_name(name_prefix)
+            num = self._fresh_var_num(name_prefix)
+            prefix_id = self._var_prefix_ids[num]
+            size += self._var_prefix_ids.itemsize
+            if value is None or is_empty(value) or self.keep_concrete_vars:
+                name = self.get_var_name(num)
+            else:
+                # Not registered, the name is built on demand
+                name = num
         else:
             name = sanitize_smt_name(name)
-        if name in self._vars:
-            err = "Variable name '%s' is already registered" % name
-            raise ValueError(err)
-        var = SMTVar(name, vsort, value)
-        self._register_var(var)
+            if name in self._vars or self._is_generated_name(name):
+                err = "Variable name '%s' is already registered" % name
+                raise ValueError(err)
+            prefix_id = self._get_prefix_id(re.sub(r'\d+$', '', name))
+            self._num_named_vars += 1
+        var = SMTVar(name, vsort, value, model_ref=self._model_ref)
+        if isinstance(name, basestring):
+            self._register_var(var)
+        else:
+            self._num_unregistered += 1
+        self._prefix_vars[prefix_id] += 1
+        self._prefix_bytes[prefix_id] += size + var.memory_usage()
         return var
 
+    def _add_concrete_z3_var(self, var):
+        """Called by a concrete var of the context once its z3 var is created"""
+        if not isinstance(var._name, basestring):
+            self._concrete_z3_vars.append(var)
+            prefix_id = self._var_prefix_ids[var._name]
+        else:
+            prefix_id = self._get_prefix_id(re.sub(r'\d+$', '', var._name))
+        self._prefix_bytes[prefix_id] += var.z3_var_memory_usage()
+
+    def get_num_vars(self):
+        """Number of the vars created by the context"""
+        return len(self._vars) + self._num_unregistered
+
+    def get_vars_memory(self):
+        """
+        Report the vars created by the context by their name prefix (the
+        name without the trailing counter), including the unregistered
+        concrete vars. The bytes are counted when a var and its z3 variable
+        are created (the unregistered vars may be freed since).
+        :return: dict prefix -> (number of vars, approximate bytes)
+        """
+        report = {}
+        for prefix_id, prefix in enumerate(self._prefixes):
+            if self._prefix_vars[prefix_id]:
+                report[prefix] = (self._prefix_vars[prefix_id],
+                                  self._prefix_bytes[prefix_id])
+        return report
+
     def fresh_constraint_name(self, prefix=None):
         """
        Creates a fresh name for tracking the next constraint
@@ -431,6 +693,25 @@ class SolverContext(object):
         self._tracked[name] = dict(constraints=constraints, info=info)
         return name
 
+    def register_constraints(self, constraints, name_prefix=None, **info):
+        """
+        Register many constraints at once, each under a fresh name
+        with the same prefix
+        :param constraints: iterable of constraints
+        :param name_prefix: a prefix to make generate names easier to read
+        :param info: shared by all the constraints
+        :return: list of names
+        """
+        prefix = sanitize_smt_name(name_prefix) if name_prefix else 'Constrain_'
+        names = []
+        for constraint in constraints:
+            name = "%s%d" % (prefix, self._next_constnum.next())
+            while name in self._tracked:
+                name = "%s%d" % (prefix, self._next_constnum.next())
+            self._tracked[name] = dict(constraints=constraint, info=info)
+            names.append(name)
+        return names
+
     def get_constraint(self, name):
         """Get the constraints tracked by the given name"""
         if name not in self._tracked:
@@ -451,113 +732,366 @@ class SolverContext(object):
             raise ValueError("Constraint: %s was not registered before" % name)
         return self._tracked[name]['info']
 
-    def create_enum_compare(self, enum_name):
+    def create_enum_compare(self, enum_name, encoding='pairwise'):
+        """
+        Create a function that compares two values of an EnumType
+        func(var1, var2) is one of self.compare_vars
+        :param encoding: 'pairwise' an uninterpreted function with
+                         axioms for each pair of values (O(n^2)
+                         constraints) or 'rank' integer ranks of the
+                         values (O(n) constraints, see RankCompare)
+        """
+        assert encoding in ['pairwise', 'rank']
         vsort = self.get_enum_type(enum_name)
         z3sort = vsort.sort
         name = 'compare_%s' % enum_name
         err = "Compare function '{}' already created".format(name)
         assert name not in self._enum_compare, err
-        func = z3.Function(name, z3sort, z3sort, self.comparator.sort)
+        if encoding == 'rank':
+            func = RankCompare(name, vsort, self.comparator)
+        else:
+            func = z3.Function(name, z3sort, z3sort, self.comparator.sort)
         self._enum_compare[name] = func
         self._enum_compare_sort[name] = vsort
         return func
 
+    def _compare_constraints(self, name):
+        """Yield the (name, constraint) of an enum compare function"""
+        func = self._enum_compare[name]
+        if isinstance(func, RankCompare):
+            for const in func.constraints():
+                yield const
+            return
+        GREATER, LESS, EQUAL, INCOMPLETE = self.compare_vars
+        vsort = self._enum_compare_sort[name]
+        tracked_eq = set()
+        for value1 in vsort.concrete_values:
+            var1 = vsort.get_symbolic_value(value1)
+            for value2 in vsort.concrete_values:
+                var2 = vsort.get_symbolic_value(value2)
+                suffix = "{}_{}_{}".format(name, value1, value2)
+                pair = frozenset([value1, value2])
+                # Same var is equal
+                if pair not in tracked_eq:
+                    tracked_eq.add(pair)
+                    yield ("compare_equal_const_{}".format(suffix),
+                           z3.Implies(var1 == var2,
+                                      func(var1, var2) == EQUAL,
+                                      self.z3_ctx))
+                # Equal is reflexive
+                yield ("compare_equal_reflexive_{}".format(suffix),
+                       z3.Implies(func(var1, var2) == EQUAL,
+                                  func(var2, var1) == EQUAL,
+                                  self.z3_ctx))
+                # Less is opposite of greater
+                yield ("greater_implies_less_{}".format(suffix),
+                       z3.Implies(func(var1, var2) == GREATER,
+                                  func(var2, var1) == LESS,
+                                  self.z3_ctx))
+                # Greater is opposite of less
+                yield ("less_implies_greater_{}".format(suffix),
+                       z3.Implies(func(var1, var2) == LESS,
+                                  func(var2, var1) == GREATER,
+                                  self.z3_ctx))
+
     def set_model(self, model):
-        """Set the Z3 model, after solving it"""
-        t1 = timer()
-        print "Setting the Var values start at", t1
-        for var in self._vars.values():
-            var.eval(model)
-        t2 = timer()
-        print "Reading model time: %f" % (t2 - t1)
+        """
+        Set the Z3 model, after solving it.
+        All the vars become concrete, but each var is only evaluated
+        against the model when its value is read.
+        The vars created afterwards are not affected by this model.
+        """
+        self._model_ref[0] = model
+        self._model_ref = [None, self]
+        self._all_vars_read = False
 
-    def check(self, solver, track=True, set_model=True, out_smt=None):
-        err1 = "Z3 Solver is not attached to the same Z3 context"
-        assert solver.ctx == self.z3_ctx, err1
+    def eval_vars(self, variables=None):
+        """
+        Read the values of the vars back from their models in bulk,
+        with one pass over the assignments of each model instead of
+        a model.eval() per var. The values are set in place, so
+        get_value() doesn't evaluate them again.
+        :param variables: the vars to read, None for all the registered
+                          vars (done once per model)
+        """
+        if variables is None:
+            if self._all_vars_read:
+                return
+            self._all_vars_read = True
+            variables = self._vars.itervalues()
+        # id(model) -> (model, vars to read)
+        pending = {}
+        for var in variables:
+            if var._is_concrete or var._model_ref is None:
+                continue
+            model = var._model_ref[0]
+            if model is None:
+                continue
+            if id(model) not in pending:
+                pending[id(model)] = (model, [])
+            pending[id(model)][1].append(var)
+        for model, model_vars in pending.itervalues():
+            values = dict((decl.name(), model[decl])
+                          for decl in model.decls() if decl.arity() == 0)
+            for var in model_vars:
+                value = values.get(var.name)
+                if value is None:
+                    # Not assigned by the model
+                    var.eval(model)
+                else:
+                    var._set_model_value(value)
 
-        t1 = timer()
-        partially_eval_vars = len([var for var in self._vars.values() if var.is_concrete])
-        partially_eval_const = 0
+    def _get_concrete_substitutions(self):
+        """
+        Return a list of (z3 var, z3 value) pairs of the vars created with
+        a concrete value, constraints built with get_var() still refer to
+        the z3 variable. The vars evaluated against a model are not
+        substituted, they're free when checking again.
+        """
+        pairs = []
+        for var in itertools.chain(self._vars.itervalues(),
+                                   self._concrete_z3_vars):
+            if var._var is None or not var.has_fixed_value:
+                # Symbolic, read from a model,
+                # or no constraint refers to the z3 variable
+                continue
+            z3_var = var.get_var()
+            value = var.var
+            if not isinstance(value, z3.ExprRef):
+                if z3_var.sort() == z3.IntSort(ctx=self.z3_ctx):
+                    value = z3.IntVal(value, ctx=self.z3_ctx)
+                elif z3_var.sort() == z3.BoolSort(ctx=self.z3_ctx):
+                    value = z3.BoolVal(value, ctx=self.z3_ctx)
+                else:
+                    continue
+            pairs.append((z3_var, value))
+        return pairs
+
+    def fold_constraints(self, chunk_size=1000):
+        """
+        Partially evaluate the registered constraints: substitute the
+        values of the concrete vars and simplify the constraints with Z3,
+        the constraints that become True are dropped.
+        The constraints are simplified in bulk as the arguments of a
+        dummy function (one Z3 call per chunk_size constraints).
+        :return: (list of (name, constraint) to be asserted,
+                  names of the constraints that are False)
+        """
+        folded = []
+        false_names = []
+        names = []
+        consts = []
         for name, const in self.constraints_itr():
-            err2 = "Constraint is not attached to the same Z3 context: %s" % const
-            assert isinstance(const, bool) or const.ctx == self.z3_ctx, err2
+            if isinstance(const, bool):
+                if not const:
+                    false_names.append(name)
+                continue
+            names.append(name)
+            consts.append(const)
+        pairs = self._get_concrete_substitutions()
+        bool_sort = z3.BoolSort(ctx=self.z3_ctx)
+        # Z3 terms are hash consed, compare ids instead of z3.is_true()
+        true_id = z3.BoolVal(True, ctx=self.z3_ctx).get_id()
+        false_id = z3.BoolVal(False, ctx=self.z3_ctx).get_id()
+        for start in range(0, len(consts), chunk_size):
+            chunk = consts[start:start + chunk_size]
+            holder = z3.Function('fold_holder', *([bool_sort] * (len(chunk) + 1)))
+            app = holder(*chunk)
+            if pairs:
+                app = z3.substitute(app, *pairs)
+            app = z3.simplify(app)
+            for index, const in enumerate(app.children()):
+                const_id = const.get_id()
+                if const_id == true_id:
+                    continue
+                elif const_id == false_id:
+                    false_names.append(names[start + index])
+                else:
+                    folded.append((names[start + index], const))
+        return folded, false_names
+
+    @staticmethod
+    def _get_free_consts(constraints):
+        """
+        Get the distinct free constants (the symbolic vars) that are
+        used in the given constraints
+        :param constraints: list of (name, constraint)
+        :return: dict of z3 id -> constant
+        """
+        free = {}
+        seen = set()
+        stack = [const for _, const in constraints
+                 if not isinstance(const, bool)]
+        while stack:
+            expr = stack.pop()
+            expr_id = expr.get_id()
+            if expr_id in seen:
+                continue
+            seen.add(expr_id)
+            if z3.is_const(expr) and \
+                    expr.decl().kind() == z3.Z3_OP_UNINTERPRETED:
+                free[expr_id] = expr
+            elif z3.is_app(expr):
+                stack.extend(expr.children())
+        return free
+
+    def _add_constraints(self, solver, track, constraints=None):
+        """
+        Add all the registered and the comparator constraints to the solver
+        :param track: assert each constraint with its name as the tracking
+                      literal (to get the unsat core) or just add them
+        :param constraints: list of (name, constraint) to be added instead
+                            of the registered ones (e.g., folded constraints)
+        :return: (names of the tracked constraints, number of the
+                  partially evaluated (python bool) constraints)
+        """
+        # Names of the tracked constraints (needed by the portfolio)
+        tracked_names = []
+
+        def assert_and_track(const, name):
+            solver.assert_and_track(const, name)
+            tracked_names.append(name)
+
+        partially_eval_const = 0
+        if constraints is None:
+            constraints = self.constraints_itr()
+        for name, const in constraints:
+            if not isinstance(const, bool) and const.ctx != self.z3_ctx:
+                err2 = "Constraint is not attached to the same Z3 context: %s" % const
+                raise AssertionError(err2)
+            if isinstance(const, bool):
+                partially_eval_const += 1
             if track:
                 if isinstance(const, bool):
                     var = self.create_fresh_var(z3.BoolSort(ctx=self.z3_ctx), value=None, name_prefix='BoolHack_')
-                    solver.assert_and_track(var.var == const, name)
-                    solver.assert_and_track(var.var == True, "%s_hack" % name)
-                    partially_eval_const += 1
+                    assert_and_track(var.var == const, name)
+                    assert_and_track(var.var == True, "%s_hack" % name)
                 else:
-                    solver.assert_and_track(const, name)
+                    assert_and_track(const, name)
+            elif isinstance(const, bool):
+                if not const:
+                    solver.add(z3.BoolVal(False, self.z3_ctx))
             else:
                 solver.add(const)
 
         # Add comparator constraints:
-        GREATER, LESS, EQUAL, INCOMPLETE = self.compare_vars
-        tracked_eq = []
-        for name, func in self._enum_compare.iteritems():
-            vsort = self._enum_compare_sort[name]
-            for value1 in vsort.concrete_values:
-                var1 = vsort.get_symbolic_value(value1)
-                for value2 in vsort.concrete_values:
-                    var2 = vsort.get_symbolic_value(value2)
-                    pair = set([value1, value2])
-                    # Same var is equal
-                    if pair not in tracked_eq:
-                        equal_const1 = z3.Implies(var1 == var2,
-                                                  func(var1, var2) == EQUAL,
-                                                  self.z3_ctx)
-                        tracked_eq.append(pair)
-                    else:
-                        equal_const1 = None
-                    # Equal is reflexive
-                    equal_const2 = z3.Implies(func(var1, var2) == EQUAL,
-                                              func(var2, var1) == EQUAL,
-                                              self.z3_ctx)
-                    # Less is opposite of greater
-                    greater_less = z3.Implies(func(var1, var2) == GREATER,
-                                              func(var2, var1) == LESS,
-                                              self.z3_ctx)
-                    # Greater is opposite of less
-                    less_greater = z3.Implies(func(var1, var2) == LESS,
-                                              func(var2, var1) == GREATER,
-                                              self.z3_ctx)
-                    if track:
-                        suffix = "{}_{}_{}".format(name, value1, value2)
-                        if equal_const1 is not None:
-                            solver.assert_and_track(equal_const1, "compare_equal_const_{}".format(suffix))
-                        solver.assert_and_track(equal_const2, "compare_equal_reflexive_{}".format(suffix))
-                        solver.assert_and_track(greater_less, "greater_implies_less_{}".format(suffix))
-                        solver.assert_and_track(less_greater, "less_implies_greater_{}".format(suffix))
-                    else:
-                        solver.add(equal_const1)
-                        solver.add(equal_const2)
-                        solver.add(greater_less)
-                        solver.add(less_greater)
+        for name in self._enum_compare:
+            for const_name, const in self._compare_constraints(name):
+                if track:
+                    assert_and_track(const, const_name)
+                else:
+                    solver.add(const)
+        return tracked_names, partially_eval_const
+
+    def _check_solver(self, solver, tracked_names, portfolio, cache=None,
+                      smt2=None):
+        """
+        Check the solver, on the portfolio if given
+        and through the SMTCache if given
+        """
+        t1 = timer()
+        tracked = [z3.Bool(name, self.z3_ctx) for name in tracked_names]
+
+        def check():
+            if portfolio is not None:
+                ret = portfolio.check(solver, tracked=tracked)
+                self.log.info("Portfolio winner: %s", portfolio.winner)
+                return ret
+            return solver.check()
+
+        if cache is not None:
+            hits = cache.hits
+            ret = cache.check(solver, tracked=tracked, check=check, smt2=smt2)
+            self.log.info("SMT cache hit: %s", cache.hits > hits)
+        else:
+            ret = check()
         t2 = timer()
-        print "X" * 50
-        print "Total Number of variables:", len(self._vars)
-        print "Total Number of Constraints:", len(self._tracked)
-        print "Total Number of Partially evaluated variables:", partially_eval_vars
-        if len(self._vars):
-            print "Percentage Partially evaluated variables:", partially_eval_vars / (len(self._vars) * 1.0)
-        print "Total Number of Partially evaluated constraints:", partially_eval_const
+        self.log.info("Z3 check time: %f", t2 - t1)
+        return ret
+
+    def check(self, solver, track=True, set_model=True, out_smt=None,
+              portfolio=None, track_unsat=False, fold=True, cache=None):
+        """
+        Add all the registered constraints to the solver and check it
+        :param track: track each constraint (one literal per constraint)
+                      so solver.unsat_core() names the conflicting ones
+        :param portfolio: optional SolverPortfolio to run the check on
+        :param track_unsat: solve without tracking first, and only if the
+                            result is unsat, solve again with the tracked
+                            constraints to get the unsat core
+        :param fold: partially evaluate the constraints first (see
+                     fold_constraints), if any is False the check is
+                     unsat and the unsat core names the False constraints
+                     (only the False constraints are asserted)
+        :param cache: optional SMTCache, a formula checked before is not
+                      solved again
+        """
+        err1 = "Z3 Solver is not attached to the same Z3 context"
+        assert solver.ctx == self.z3_ctx, err1
+        lazy_track = track_unsat and not track
+        # The assertions added by the caller, kept when checking again
+        existing = solver.assertions() if lazy_track else None
+
+        t1 = timer()
+        num_vars = self.get_num_vars()
+        partially_eval_vars = self._num_unregistered + len(
+            [var for var in self._vars.itervalues() if var.is_concrete])
+        partially_eval_const = len([const for _, const in self.constraints_itr()
+                                    if isinstance(const, bool)])
+        constraints = None
+        if fold:
+            constraints, false_names = self.fold_constraints()
+            self.log.info("Constraints folding time: %f", timer() - t1)
+            if false_names:
+                self.log.info("Unsat, constraints are False after partial "
+                              "evaluation: %s", false_names)
+                # The check is unsat, the False constraints are enough
+                # to get the unsat core
+                constraints = [(name, z3.BoolVal(False, ctx=self.z3_ctx))
+                               for name in false_names]
+                track = True
+                lazy_track = False
+        tracked_names, _ = self._add_constraints(solver, track, constraints)
+        t2 = timer()
+        self.log.info("Total Number of variables: %d", num_vars)
+        self.log.info("Total Number of Constraints: %d", len(self._tracked))
+        self.log.info("Total Number of Partially evaluated variables: %d",
+                      partially_eval_vars)
+        if num_vars:
+            self.log.info("Percentage Partially evaluated variables: %f",
+                          partially_eval_vars / (num_vars * 1.0))
+        self.log.info("Total Number of Partially evaluated constraints: %d",
+                      partially_eval_const)
         if len(self._tracked) > 0:
-            print "Percentage Partially evaluated constraints:", partially_eval_const / (len(self._tracked) * 1.0)
+            self.log.info("Percentage Partially evaluated constraints: %f",
+                          partially_eval_const / (len(self._tracked) * 1.0))
         else:
-            print "No constraints"
-        if (len(self._tracked) +len(self._vars)) > 0:
-            print "Total Percentage Partially evaluated:", (partially_eval_vars + partially_eval_const) / ((len(self._tracked) +len(self._vars)) * 1.0)
-        print "X" * 50
-
-        print "Constraints adding time: %f" % (t2 - t1)
-        print "Start Z3 check", t2
+            self.log.info("No constraints")
+        if (len(self._tracked) + num_vars) > 0:
+            self.log.info(
+                "Total Percentage Partially evaluated: %f",
+                (partially_eval_vars + partially_eval_const) /
+                ((len(self._tracked) + num_vars) * 1.0))
+        if fold:
+            self.log.info("Total Number of Constraints after folding: %d",
+                          len(constraints))
+            self.log.info("Total Number of free variables after folding: %d",
+                          len(self._get_free_consts(constraints)))
+        self.log.info("Constraints adding time: %f", t2 - t1)
+        # Serialized once for both the dump and the cache key
+        smt2 = solver.to_smt2() if out_smt or cache is not None else None
         if out_smt:
             with open(out_smt, 'w') as outf:
-                outf.write(solver.to_smt2())
-        ret = solver.check()
-        t3 = timer()
-        print "Z3 check time: %f" % (t3 - t2)
+                outf.write(smt2)
+        ret = self._check_solver(solver, tracked_names, portfolio, cache, smt2)
+        if lazy_track and ret == z3.unsat:
+            # Solve again with tracking only to compute the unsat core
+            self.log.info("Unsat, checking again with tracked constraints")
+            solver.reset()
+            solver.add(existing)
+            tracked_names, _ = self._add_constraints(
+                solver, track=True, constraints=constraints)
+            ret = self._check_solver(solver, tracked_names, portfolio, cache)
         if set_model and ret == z3.sat:
             self.set_model(solver.model())
         return ret
@@ -2,8 +2,14 @@
 Common utilities used in the OSPF boxes
 """
 
+import heapq
+import itertools
+import sys
+from collections import OrderedDict
+
 from ipaddress import ip_network
 import networkx as nx
+import numpy as np
 import z3
 
 from synet.utils.common import Protocols
@@ -19,20 +25,32 @@ __email__ = "a.hassany@gmail.com"
 # Special network that will announce all directly connected works
 ALL_V4_NET = ip_network(u"0.0.0.0/0")
 
+# Valid range of OSPF link costs
+OSPF_MIN_COST = 1
+OSPF_MAX_COST = 65535
+# Width of a link cost in the bit-vector encoding
+OSPF_COST_BITS = 16
+
 
-def extract_ospf_graph(network_graph, log):
+def extract_ospf_graph(network_graph, log, encoding='int'):
     """
     Extract a sub graph from the network graph that is relevant to the
     OSPF Computations
     :param network_graph: NetworkGraph
     :param log: logger
+    :param encoding: the sort of the symbolic costs, 'int' for integers
+                     or 'bv' for bit-vectors (see create_cost_var)
     :return: nx.DiGraph() of the OSPF enabled subgraph
     """
+    assert encoding in ['int', 'bv']
     ospf_graph = nx.DiGraph()
     # Only local routers
     for node in network_graph.nodes():
         if network_graph.is_local_router(node) and network_graph.is_ospf_enabled(node):
             ospf_graph.add_node(node)
+    ospf_graph.graph['encoding'] = encoding
+    ospf_graph.graph['path_bits'] = get_path_cost_bits(
+        ospf_graph.number_of_nodes())
     for src, dst in network_graph.edges():
         # First skip an edge that is not connecting
         # two OSPF enabled routers
@@ -40,17 +58,384 @@ def extract_ospf_graph(network_graph, log):
             continue
         if not network_graph.is_ospf_enabled(dst):
             continue
-        cost = network_graph.get_edge_ospf_cost(src, dst)
-        if not cost:
-            log.warn("Edge OSPF cost (%s, %s) is None", src, dst)
-        if is_empty(cost):
-            cost = None
-        if not cost:
-            cost = z3.Const("cost_%s_%s" % (src, dst), z3.IntSort())
+        cost = get_ospf_edge_cost(network_graph, ospf_graph, src, dst, log)
         ospf_graph.add_edge(src, dst, cost=cost)
     return ospf_graph
 
 
+def get_path_cost_bits(num_nodes):
+    """
+    Width of the bit-vector path costs, wide enough for the sum of the
+    costs of a simple path plus a sign bit, so the (signed) comparisons
+    of the path costs never overflow.
+    """
+    return OSPF_COST_BITS + max(num_nodes - 1, 1).bit_length() + 1
+
+
+def create_cost_var(name, ospf_graph):
+    """
+    Create a symbolic link cost in the encoding of the OSPF graph.
+    A bit-vector cost is a 16-bit variable zero extended to the width of
+    the path costs, so it's in the range of OSPF costs by construction.
+    """
+    if ospf_graph.graph.get('encoding', 'int') == 'bv':
+        bits = ospf_graph.graph['path_bits']
+        var = z3.BitVec(name, OSPF_COST_BITS)
+        return z3.ZeroExt(bits - OSPF_COST_BITS, var)
+    return z3.Const(name, z3.IntSort())
+
+
+def get_cost_sort(ospf_graph):
+    """Return the z3 sort of the path costs of the OSPF graph"""
+    if ospf_graph.graph.get('encoding', 'int') == 'bv':
+        return z3.BitVecSort(ospf_graph.graph['path_bits'])
+    return z3.IntSort()
+
+
+def get_ospf_edge_cost(network_graph, ospf_graph, src, dst, log):
+    """
+    Return the concrete OSPF cost of an edge in the network graph
+    or a symbolic cost to be synthesized if it's not set.
+    """
+    cost = network_graph.get_edge_ospf_cost(src, dst)
+    if not cost:
+        log.warn("Edge OSPF cost (%s, %s) is None", src, dst)
+    if is_empty(cost):
+        cost = None
+    if not cost:
+        cost = create_cost_var("cost_%s_%s" % (src, dst), ospf_graph)
+    return cost
+
+
+class OSPFGraph(object):
+    """
+    Compact integer indexed view of an OSPF graph.
+    Nodes and edges are numbered, the adjacency is kept in CSR form
+    and the edge costs in a NumPy vector with a mask of symbolic edges,
+    so reading the costs of a model is a single pass over
+    the symbolic edges.
+    """
+
+    def __init__(self, graph, weight='cost'):
+        """
+        :param graph: nx.DiGraph, edge costs are ints or z3 expressions
+        :param weight: the name of the edge cost attribute
+        """
+        self.weight = weight
+        self.nodes = list(graph.nodes())
+        self.node_ids = dict((node, index) for index, node in enumerate(self.nodes))
+        self.edges = list(graph.edges())
+        self.edge_ids = dict((edge, index) for index, edge in enumerate(self.edges))
+        num_nodes = len(self.nodes)
+        num_edges = len(self.edges)
+        self.src = np.array(
+            [self.node_ids[src] for src, _ in self.edges], dtype=np.int64)
+        self.dst = np.array(
+            [self.node_ids[dst] for _, dst in self.edges], dtype=np.int64)
+        # CSR adjacency, out_ptr[n]:out_ptr[n + 1] are the indices
+        # in out_edges of the edges leaving n (same for in_ptr/in_edges)
+        self.out_edges = np.argsort(self.src, kind='mergesort')
+        self.out_ptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.src, minlength=num_nodes), out=self.out_ptr[1:])
+        self.in_edges = np.argsort(self.dst, kind='mergesort')
+        self.in_ptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.dst, minlength=num_nodes), out=self.in_ptr[1:])
+        # Concrete costs, symbolic edges are set to 0 and masked
+        self.costs = np.zeros(num_edges, dtype=np.int64)
+        self.symbolic = np.zeros(num_edges, dtype=bool)
+        self.cost_exprs = []
+        for index, (src, dst) in enumerate(self.edges):
+            cost = graph[src][dst][weight]
+            self.cost_exprs.append(cost)
+            if is_symbolic(cost):
+                self.symbolic[index] = True
+            else:
+                self.costs[index] = cost
+        self.symbolic_ids = np.flatnonzero(self.symbolic)
+        self.symbolic_vars = [self.cost_exprs[i] for i in self.symbolic_ids]
+        # Plain lists for the python loops of the shortest path algorithms
+        self.src_list = self.src.tolist()
+        self.dst_list = self.dst.tolist()
+        self.out_list = [
+            self.out_edges[self.out_ptr[n]:self.out_ptr[n + 1]].tolist()
+            for n in range(num_nodes)]
+        self.in_list = [
+            self.in_edges[self.in_ptr[n]:self.in_ptr[n + 1]].tolist()
+            for n in range(num_nodes)]
+        # See get_nx_order
+        self._nx_order = None
+
+    @property
+    def num_nodes(self):
+        """Number of nodes"""
+        return len(self.nodes)
+
+    @property
+    def num_edges(self):
+        """Number of edges"""
+        return len(self.edges)
+
+    def get_nx_order(self):
+        """
+        Return (edge ids, out edges of each node) in the order of
+        a nx.DiGraph built from the edges, the order the synthesizers
+        draw the random weights of the edges in.
+        Computed once per view.
+        """
+        if self._nx_order is None:
+            graph = nx.DiGraph()
+            for src, dst in self.edges:
+                graph.add_edge(src, dst)
+            order = [self.edge_ids[edge] for edge in graph.edges()]
+            out_list = [[] for _ in range(self.num_nodes)]
+            for edge in order:
+                out_list[self.src_list[edge]].append(edge)
+            self._nx_order = (order, out_list)
+        return self._nx_order
+
+    def read_costs(self, model):
+        """Return a NumPy vector of all edge costs under the model"""
+        costs = self.costs.copy()
+        if len(self.symbolic_ids):
+            costs[self.symbolic_ids] = [
+                model.eval(var).as_long() for var in self.symbolic_vars]
+        return costs
+
+    def shortest_path(self, source, target, costs, out_list=None):
+        """
+        Return one shortest path (list of node names) between source and
+        target under the given costs (list indexed by edge id) or None.
+        Ties are broken as nx.dijkstra_path does, by the order the nodes
+        are reached in.
+        :param out_list: the out edges of each node in the order to visit
+                         them (default self.out_list)
+        """
+        src = self.node_ids[source]
+        dst = self.node_ids[target]
+        dist = {src: 0}
+        pred = {src: None}
+        done = set()
+        counter = itertools.count()
+        heap = [(0, next(counter), src)]
+        if out_list is None:
+            out_list = self.out_list
+        dst_list = self.dst_list
+        while heap:
+            cost, _, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            if node == dst:
+                break
+            for edge in out_list[node]:
+                nxt = dst_list[edge]
+                new_cost = cost + costs[edge]
+                if nxt not in dist or new_cost < dist[nxt]:
+                    dist[nxt] = new_cost
+                    pred[nxt] = node
+                    heapq.heappush(heap, (new_cost, next(counter), nxt))
+        if dst not in done:
+            return None
+        path = [dst]
+        while pred[path[-1]] is not None:
+            path.append(pred[path[-1]])
+        return [self.nodes[node] for node in reversed(path)]
+
+    def to_nx(self, costs):
+        """Return nx.DiGraph annotated with the given concrete costs"""
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.nodes)
+        for (src, dst), cost in zip(self.edges, costs.tolist()):
+            graph.add_edge(src, dst, cost=cost)
+        return graph
+
+
+def get_compact_graph(ospf_graph):
+    """
+    Return the OSPFGraph of an OSPF graph,
+    it's computed once and cached in the graph attributes.
+    Whoever changes the graph or its costs must drop the cached view
+    (see invalidate_compact_graph).
+    """
+    if isinstance(ospf_graph, OSPFGraph):
+        return ospf_graph
+    compact = ospf_graph.graph.get('compact')
+    if compact is None:
+        compact = OSPFGraph(ospf_graph)
+        ospf_graph.graph['compact'] = compact
+    return compact
+
+
+def invalidate_compact_graph(ospf_graph):
+    """Drop the cached OSPFGraph after the OSPF graph is changed"""
+    ospf_graph.graph.pop('compact', None)
+
+
+class PathRegistry(object):
+    """
+    Interns paths to integer ids and memoizes their cost expressions.
+    The cost of a path is built on top of the cost of its prefix, so
+    paths sharing a prefix share the sub sums.
+    """
+
+    def __init__(self, ospf_graph):
+        """
+        :param ospf_graph: nx.DiGraph with the 'cost' of each edge
+        """
+        self.ospf_graph = ospf_graph
+        # tuple(path) -> int id
+        self.path_ids = {}
+        # Index by the path id
+        self.paths = []
+        # tuple(path prefix) -> cost
+        self._costs = {}
+
+    def get_id(self, path):
+        """Return the unique id of the path"""
+        key = tuple(path)
+        path_id = self.path_ids.get(key)
+        if path_id is None:
+            path_id = len(self.paths)
+            self.path_ids[key] = path_id
+            self.paths.append(key)
+        return path_id
+
+    def get_path(self, path_id):
+        """Return the path (tuple of nodes) of the given id"""
+        return self.paths[path_id]
+
+    def get_name(self, path):
+        """Return a name for the path, safe to use in z3 variable names"""
+        return 'path_%d' % self.get_id(path)
+
+    def get_cost(self, path):
+        """Return the cost (int or z3 expression) of the path"""
+        key = tuple(path)
+        cost = self._costs.get(key)
+        if cost is not None:
+            return cost
+        # Find the longest prefix with a known cost
+        index = len(key) - 1
+        while index > 1 and key[:index] not in self._costs:
+            index -= 1
+        cost = self._costs.get(key[:index], 0)
+        for i in range(index, len(key)):
+            prefix = key[:i + 1]
+            if i > 0:
+                cost = cost + self.ospf_graph[key[i - 1]][key[i]]['cost']
+            self._costs[prefix] = cost
+        return cost
+
+    def drop_costs(self, edges):
+        """
+        Forget the memoized costs of the path prefixes that cross any
+        of the given edges, e.g., after the edges are removed or added
+        to the graph with other costs
+        :param edges: list of (src, dst)
+        """
+        edges = set(edges)
+        stale = [key for key in self._costs
+                 if edges.intersection(zip(key[0::1], key[1::1]))]
+        for key in stale:
+            del self._costs[key]
+
+    def drop_paths(self, edges):
+        """
+        Forget the ids of the interned paths that cross any of the given
+        edges, the next get_id() of such a path gives a new id (the old
+        id still maps to the path in get_path)
+        :param edges: list of (src, dst)
+        :return: set of the old ids
+        """
+        edges = set(edges)
+        stale = [key for key in self.path_ids
+                 if edges.intersection(zip(key[0::1], key[1::1]))]
+        return set([self.path_ids.pop(key) for key in stale])
+
+    def memory_usage(self):
+        """
+        Approximate number of bytes used by the registry, the interned
+        paths and the memoized cost of each path prefix
+        (the nodes and the z3 expressions are shared, not counted)
+        """
+        size = sys.getsizeof(self.path_ids) + sys.getsizeof(self.paths)
+        size += sys.getsizeof(self._costs)
+        size += sum([sys.getsizeof(path) for path in self.paths])
+        size += len(self.paths) * sys.getsizeof(sys.maxint)
+        size += sum([sys.getsizeof(prefix) for prefix in self._costs])
+        return size
+
+
+class PathHistory(object):
+    """
+    The paths generated for one requirement.
+    The paths are interned by the PathRegistry, the history only keeps
+    the hash and the registry id of each path. A hash hit is confirmed
+    by the id, so a hash collision with a path generated for another
+    requirement isn't taken as seen.
+    At most max_paths paths are kept, the least recently seen path is
+    evicted first. An evicted path can be generated again, but its
+    constraints are already tracked by the synthesizer.
+    """
+
+    def __init__(self, registry, max_paths=None):
+        """
+        :param registry: the PathRegistry of the synthesizer
+        :param max_paths: max number of paths to remember, None for no limit
+        """
+        assert max_paths is None or max_paths > 0
+        self.registry = registry
+        self.max_paths = max_paths
+        # hash(tuple(path)) -> path id in the least recently seen order
+        self._hashes = OrderedDict()
+        # Number of evicted paths
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def seen(self, path):
+        """
+        Return True if the path is generated before,
+        and mark it as the most recently seen.
+        """
+        key = tuple(path)
+        path_hash = hash(key)
+        path_id = self._hashes.get(path_hash)
+        if path_id is None or self.registry.path_ids.get(key) != path_id:
+            return False
+        del self._hashes[path_hash]
+        self._hashes[path_hash] = path_id
+        return True
+
+    def add(self, path):
+        """Remember a generated path"""
+        key = tuple(path)
+        path_hash = hash(key)
+        if path_hash in self._hashes:
+            del self._hashes[path_hash]
+        self._hashes[path_hash] = self.registry.get_id(key)
+        if self.max_paths is not None and len(self._hashes) > self.max_paths:
+            self._hashes.popitem(last=False)
+            self.evicted += 1
+
+    def drop_ids(self, path_ids):
+        """Forget the paths of the given registry ids"""
+        self._hashes = OrderedDict(
+            (path_hash, path_id) for path_hash, path_id in
+            self._hashes.iteritems() if path_id not in path_ids)
+
+    def memory_usage(self):
+        """
+        Approximate number of bytes used by the history, the hash table
+        of the OrderedDict, its key index, and a link, a hash and an id
+        per path (the paths are counted by PathRegistry.memory_usage)
+        """
+        entry = sys.getsizeof([None, None, None]) + \
+            2 * sys.getsizeof(sys.maxint)
+        return 2 * sys.getsizeof(self._hashes) + len(self._hashes) * entry
+
+
 def load_graph_constrains(solver, graph):
     """Add constrains specific to the OSPF graph"""
     for src, dst in graph.edges():
@@ -61,25 +446,23 @@ def load_graph_constrains(solver, graph):
             solver.add(cost > 0)
 
 
+def get_output_costs(model, ospf_graph):
+    """Returns the OSPFGraph and a NumPy vector of the synthesized costs"""
+    compact = get_compact_graph(ospf_graph)
+    return compact, compact.read_costs(model)
+
+
 def get_output_configs(model, ospf_graph):
     """Returns list of (src, dst, cost)"""
-    outputs = []
-    for src, dst in ospf_graph.edges():
-        cost = ospf_graph[src][dst]['cost']
-        if is_symbolic(cost):
-            cost = model.eval(cost).as_long()
-            ospf_graph[src][dst]['cost'] = cost
-        outputs.append((src, dst, cost))
-    return outputs
+    compact, costs = get_output_costs(model, ospf_graph)
+    return [(src, dst, cost)
+            for (src, dst), cost in zip(compact.edges, costs.tolist())]
 
 
 def get_output_network_graph(model, ospf_graph):
     """Return OSPF graph annotated with synthesized costs"""
-    configs = get_output_configs(model, ospf_graph)
-    out_graph = ospf_graph.copy()
-    for src, dst, cost in configs:
-        out_graph[src][dst]['cost'] = cost
-    return out_graph
+    compact, costs = get_output_costs(model, ospf_graph)
+    return compact.to_nx(costs)
 
 
 def synthesize_ospf_announce(network_graph, ospf_graph, reqs):
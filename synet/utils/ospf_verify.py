@@ -0,0 +1,329 @@
+"""
+Verify OSPF requirements against concrete link costs.
+
+All requirements that share a destination are answered from one reverse
+shortest path DAG, so a verification round costs one Dijkstra
+per destination instead of one per requirement.
+
+The shortest paths are counted by dynamic programming over the DAG and
+a path is checked edge by edge, so the (possibly exponentially many)
+equal cost paths are only enumerated up to a given limit.
+
+Link failures are applied on top of a DAG without copying the graph,
+only the distances of the nodes that lost all their shortest paths
+are recomputed.
+
+The algorithms work on the integer ids of the compact OSPFGraph,
+node names are only used at the API boundary.
+"""
+
+import heapq
+import itertools
+from collections import deque
+
+import networkx as nx
+
+from synet.utils.ospf_utils import OSPFGraph
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+INF = float('inf')
+
+
+class ShortestPathDAG(object):
+    """The shortest path DAG of all nodes toward a single destination"""
+
+    def __init__(self, graph, costs, dst, dist=None, failed=None):
+        """
+        :param graph: OSPFGraph
+        :param costs: list of concrete costs indexed by edge id
+        :param dst: the destination node
+        :param dist: precomputed distances toward dst (used by fail_edge)
+        :param failed: frozenset of failed edge ids to be ignored
+        """
+        self.graph = graph
+        self.costs = costs
+        self.dst = dst
+        self._dst = graph.node_ids[dst]
+        self.failed = failed or frozenset()
+        if dist is None:
+            assert not self.failed
+            dist = self._dijkstra()
+        # Distance of each node id to dst (INF if dst is not reachable)
+        self.dist = dist
+        self._next_hops = {}
+        # Number of shortest paths from each node id
+        self._counts = {self._dst: 1}
+
+    def _dijkstra(self):
+        """Distances of all the nodes toward dst"""
+        dist = [INF] * self.graph.num_nodes
+        dist[self._dst] = 0
+        heap = [(0, self._dst)]
+        in_list = self.graph.in_list
+        src_list = self.graph.src_list
+        costs = self.costs
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost > dist[node]:
+                continue
+            for edge in in_list[node]:
+                pred = src_list[edge]
+                new_cost = cost + costs[edge]
+                if new_cost < dist[pred]:
+                    dist[pred] = new_cost
+                    heapq.heappush(heap, (new_cost, pred))
+        return dist
+
+    def distance(self, node):
+        """The distance from node to the destination (INF if no path)"""
+        return self.dist[self.graph.node_ids[node]]
+
+    def has_path(self, src):
+        """Return True if src can reach the destination"""
+        return self.distance(src) != INF
+
+    def has_edge(self, src, dst):
+        """Return True if the edge exists and didn't fail"""
+        edge = self.graph.edge_ids.get((src, dst))
+        return edge is not None and edge not in self.failed
+
+    def path_exists(self, path):
+        """Return True if all the edges of the path exist"""
+        return all(self.has_edge(src, dst)
+                   for src, dst in zip(path[0::1], path[1::1]))
+
+    def _hops(self, node):
+        """Return the ids of the edges of node that are on a shortest path"""
+        if node not in self._next_hops:
+            hops = []
+            dist = self.dist
+            if dist[node] != INF:
+                dst_list = self.graph.dst_list
+                for edge in self.graph.out_list[node]:
+                    if edge in self.failed:
+                        continue
+                    if dist[node] == self.costs[edge] + dist[dst_list[edge]]:
+                        hops.append(edge)
+            self._next_hops[node] = hops
+        return self._next_hops[node]
+
+    def next_hops(self, node):
+        """Return the successors of node that are on a shortest path"""
+        nodes = self.graph.nodes
+        dst_list = self.graph.dst_list
+        return [nodes[dst_list[edge]]
+                for edge in self._hops(self.graph.node_ids[node])]
+
+    def _dag_edges(self, src):
+        """Return the edge ids of all the shortest paths from src"""
+        edges = []
+        dst_list = self.graph.dst_list
+        visited = set([src])
+        queue = deque([src])
+        while queue:
+            node = queue.popleft()
+            for edge in self._hops(node):
+                edges.append(edge)
+                nxt = dst_list[edge]
+                if nxt not in visited:
+                    visited.add(nxt)
+                    queue.append(nxt)
+        return edges
+
+    def dag_edges(self, src):
+        """Return the edges of all the shortest paths from src"""
+        edges = self.graph.edges
+        return [edges[edge]
+                for edge in self._dag_edges(self.graph.node_ids[src])]
+
+    def count_shortest_paths(self, src):
+        """Return the number of shortest paths from src (0 if no path)"""
+        src = self.graph.node_ids[src]
+        if self.dist[src] == INF:
+            return 0
+        if src not in self._counts:
+            dist = self.dist
+            dst_list = self.graph.dst_list
+            nodes = set([src])
+            for edge in self._dag_edges(src):
+                nodes.add(dst_list[edge])
+            # The next hops are closer to dst, count from dst outward
+            for node in sorted(nodes, key=lambda n: dist[n]):
+                if node not in self._counts:
+                    self._counts[node] = sum(
+                        self._counts[dst_list[edge]] for edge in self._hops(node))
+        return self._counts[src]
+
+    def is_shortest_path(self, path):
+        """Return True if path is one of the shortest paths to dst"""
+        if path[-1] != self.dst:
+            return False
+        node_ids = self.graph.node_ids
+        edge_ids = self.graph.edge_ids
+        dist = self.dist
+        for src, nxt in zip(path[0::1], path[1::1]):
+            edge = edge_ids.get((src, nxt))
+            if edge is None or edge in self.failed:
+                return False
+            src, nxt = node_ids[src], node_ids[nxt]
+            if dist[src] == INF or dist[src] != self.costs[edge] + dist[nxt]:
+                return False
+        return True
+
+    def failed_edges(self):
+        """Return the failed (src, dst) edges"""
+        return [self.graph.edges[edge] for edge in sorted(self.failed)]
+
+    def all_shortest_paths(self, src):
+        """Iterate over all the shortest paths from src to the destination"""
+        if not self.has_path(src):
+            return
+        nodes = self.graph.nodes
+        dst_list = self.graph.dst_list
+        stack = [[self.graph.node_ids[src]]]
+        while stack:
+            path = stack.pop()
+            node = path[-1]
+            if node == self._dst:
+                yield [nodes[n] for n in path]
+                continue
+            for edge in reversed(self._hops(node)):
+                stack.append(path + [dst_list[edge]])
+
+    def fail_edge(self, src, nxt):
+        """Return the DAG after the edge (src, nxt) fails"""
+        return self._fail_edge(self.graph.edge_ids[(src, nxt)])
+
+    def _fail_edge(self, failed_edge):
+        """
+        Return the DAG after the edge fails.
+        The graph is not changed. When src has no other shortest next hop,
+        only the nodes whose all shortest paths used the edge are
+        recomputed (dynamic shortest paths after an edge deletion).
+        """
+        failed = self.failed | frozenset([failed_edge])
+        src = self.graph.src_list[failed_edge]
+        hops = self._hops(src)
+        if failed_edge not in hops or len(hops) > 1:
+            # The distances are not affected
+            return ShortestPathDAG(
+                self.graph, self.costs, self.dst, self.dist, failed)
+        src_list = self.graph.src_list
+        dst_list = self.graph.dst_list
+        in_list = self.graph.in_list
+        costs = self.costs
+        # Find the nodes that lost all their shortest paths
+        affected = set([src])
+        queue = deque([src])
+        while queue:
+            node = queue.popleft()
+            for edge in in_list[node]:
+                pred = src_list[edge]
+                if pred in affected or edge in failed:
+                    continue
+                pred_hops = self._hops(pred)
+                if edge in pred_hops and \
+                        all(dst_list[e] in affected for e in pred_hops):
+                    affected.add(pred)
+                    queue.append(pred)
+        dist = list(self.dist)
+        for node in affected:
+            dist[node] = INF
+        # Dijkstra within the affected nodes, starting from their
+        # best edge toward the rest of the DAG
+        heap = []
+        for node in affected:
+            for edge in self.graph.out_list[node]:
+                nxt = dst_list[edge]
+                if nxt not in affected and dist[nxt] != INF and edge not in failed:
+                    heapq.heappush(heap, (costs[edge] + dist[nxt], node))
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost >= dist[node]:
+                continue
+            dist[node] = cost
+            for edge in in_list[node]:
+                pred = src_list[edge]
+                if pred in affected and edge not in failed:
+                    new_cost = cost + costs[edge]
+                    if new_cost < dist[pred]:
+                        heapq.heappush(heap, (new_cost, pred))
+        return ShortestPathDAG(self.graph, self.costs, self.dst, dist, failed)
+
+
+class OSPFVerifier(object):
+    """Verify requirements on one concrete OSPF graph"""
+
+    def __init__(self, graph, costs=None, weight='cost'):
+        """
+        :param graph: OSPFGraph or nx.DiGraph annotated with concrete costs
+        :param costs: concrete edge costs (NumPy vector or list indexed
+                      by edge id), required if graph is an OSPFGraph
+        :param weight: the name of the edge cost attribute of nx.DiGraph
+        """
+        if not isinstance(graph, OSPFGraph):
+            assert costs is None
+            graph = OSPFGraph(graph, weight)
+            costs = graph.costs
+        assert costs is not None
+        if not isinstance(costs, list):
+            costs = costs.tolist()
+        self.graph = graph
+        self.costs = costs
+        self._dags = {}
+
+    def get_dag(self, dst):
+        """Return the (cached) shortest path DAG toward dst"""
+        if dst not in self._dags:
+            self._dags[dst] = ShortestPathDAG(self.graph, self.costs, dst)
+        return self._dags[dst]
+
+    def all_shortest_paths(self, src, dst, limit=None):
+        """
+        Return a list of all the shortest paths between src and dst
+        :param limit: return at most this many paths (None for all)
+        :raise nx.NetworkXNoPath: if dst is not reachable from src
+        """
+        dag = self.get_dag(dst)
+        if not dag.has_path(src):
+            raise nx.NetworkXNoPath("No path between %s and %s" % (src, dst))
+        return list(itertools.islice(dag.all_shortest_paths(src), limit))
+
+    def count_shortest_paths(self, src, dst):
+        """Return the number of shortest paths between src and dst"""
+        return self.get_dag(dst).count_shortest_paths(src)
+
+    def is_shortest_path(self, path):
+        """Return True if path is one of the shortest paths between its ends"""
+        return self.get_dag(path[-1]).is_shortest_path(path)
+
+    def find_failure(self, src, dst, is_valid, max_failures=1):
+        """
+        Search the link failure scenarios (up to max_failures failed links)
+        for one that violates a requirement.
+        Only the edges on the current shortest path DAG from src are failed,
+        failing any other edge doesn't change the shortest paths from src.
+        :param is_valid: function(dag) -> bool, the dag reflects the failures
+        :return: the first violating ShortestPathDAG (see failed_edges())
+                 or None if all scenarios are valid
+        """
+        src_id = self.graph.node_ids[src]
+        seen = set()
+        queue = deque([self.get_dag(dst)])
+        while queue:
+            dag = queue.popleft()
+            if dag.failed in seen:
+                continue
+            seen.add(dag.failed)
+            if not is_valid(dag):
+                return dag
+            if len(dag.failed) >= max_failures:
+                continue
+            for edge in dag._dag_edges(src_id):
+                if dag.failed | frozenset([edge]) not in seen:
+                    queue.append(dag._fail_edge(edge))
+        return None
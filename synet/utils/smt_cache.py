@@ -0,0 +1,192 @@
+"""
+On-disk cache of the results of Z3 checks.
+
+The results are keyed by a hash of the asserted formula (its SMT-LIB2
+serialization with the commands sorted), the assumption literals and
+the given solver options. An entry keeps sat/unsat with the model
+constants or the unsat core names (see smt_portfolio.get_payload), so
+running the same formula again, e.g., the repeats of an experiment,
+replays the result on the solver instead of solving it.
+The least recently used entries are evicted beyond the size bounds.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+from timeit import default_timer as timer
+
+import z3
+
+from synet.utils.smt_portfolio import get_payload
+from synet.utils.smt_portfolio import replay_payload
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def formula_key(smt2, assumptions=(), options=None):
+    """
+    Hash of a serialized formula, the top level commands (declarations
+    and assertions) are sorted so the key doesn't depend on the order
+    the constraints are added in
+    :param smt2: solver.to_smt2()
+    :param assumptions: the names of the assumption literals
+    :param options: dict of the solver options that affect the result
+    """
+    commands = sorted(re.split(r'\n(?=\()', smt2.strip()))
+    digest = hashlib.sha1()
+    for command in commands:
+        digest.update('\n')
+        digest.update(command)
+    digest.update('\nassumptions:%s' % ','.join(sorted(assumptions)))
+    digest.update('\noptions:%s' % sorted((options or {}).items()))
+    return digest.hexdigest()
+
+
+class SMTCache(object):
+    """Cache the results of Z3 checks in a directory"""
+
+    def __init__(self, cache_dir, max_entries=1000, max_bytes=None):
+        """
+        :param cache_dir: the directory of the entries (created if missing),
+                          it can be shared by several processes
+        :param max_entries: max number of entries, None for no limit
+        :param max_bytes: max total size of the entries, None for no limit
+        """
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # Sum of the check times of the entries that were hit
+        self.saved_time = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, '%s.json' % key)
+
+    def lookup(self, key):
+        """Return the entry (dict of result, payload, time) or None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as entry_file:
+                entry = json.load(entry_file)
+            # Mark as recently used
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_time += entry.get('time', 0)
+        return entry
+
+    def store(self, key, result, payload, check_time=0):
+        """Store the result of a check, only sat and unsat are stored"""
+        if result not in ['sat', 'unsat']:
+            return
+        entry = {'result': result, 'payload': payload, 'time': check_time}
+        # Write then rename, so other processes never read partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as entry_file:
+            json.dump(entry, entry_file)
+        os.rename(tmp_path, self._path(key))
+        self.stores += 1
+        self.evict()
+
+    def _entries(self):
+        """List of (mtime, size, path) of the entries"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Evicted by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries beyond the size bounds"""
+        if self.max_entries is None and self.max_bytes is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        while entries:
+            over_entries = self.max_entries is not None and \
+                len(entries) > self.max_entries
+            over_bytes = self.max_bytes is not None and total > self.max_bytes
+            if not over_entries and not over_bytes:
+                break
+            _, size, path = entries.pop(0)
+            total -= size
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove all the entries"""
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get_stats(self):
+        """Dict of the hit/miss counters and the size of the cache"""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / float(lookups) if lookups else 0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'saved_time': self.saved_time,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+        }
+
+    def check(self, solver, assumptions=(), tracked=(), check=None,
+              options=None, smt2=None):
+        """
+        Check the solver, the result is replayed from the cache if the
+        same formula is checked before (solver.model() and
+        solver.unsat_core() can be used as after a direct check)
+        :param assumptions: Boolean literals to check under
+        :param tracked: the literals used with solver.assert_and_track
+        :param check: function to call on a miss (e.g., to check on a
+                      portfolio), default solver.check(*assumptions)
+        :param options: dict of the solver options that are part of the key
+        :param smt2: solver.to_smt2() if it's already computed
+        :return: z3.sat, z3.unsat, or z3.unknown
+        """
+        if smt2 is None:
+            smt2 = solver.to_smt2()
+        key = formula_key(smt2, [str(lit) for lit in assumptions], options)
+        entry = self.lookup(key)
+        lits = list(assumptions) + list(tracked)
+        if entry is not None:
+            if entry['result'] == 'unsat' and not lits:
+                # No unsat core to compute
+                return z3.unsat
+            return replay_payload(
+                solver, smt2, lits, entry['result'], entry['payload'])
+        t1 = timer()
+        if check is None:
+            ret = solver.check(*assumptions)
+        else:
+            ret = check()
+        check_time = timer() - t1
+        self.store(key, str(ret), get_payload(solver, ret), check_time)
+        return ret
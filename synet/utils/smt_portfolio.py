@@ -0,0 +1,207 @@
+"""
+Run a Z3 check on several solver configurations in parallel.
+
+Each configuration (random seed, logic, tactic) runs in its own worker
+process over the same SMT-LIB2 serialization of the solver. The first
+definitive answer (sat or unsat) wins and the other workers are killed.
+The winning model is sent back as equalities on the constants, and the
+unsat core as the names of the literals. They are replayed as assumptions
+on the original solver, so solver.model() and solver.unsat_core() work as
+if the solver was checked directly.
+"""
+
+import multiprocessing
+from Queue import Empty
+from timeit import default_timer as timer
+
+import z3
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+class PortfolioConfig(object):
+    """One solver configuration in the portfolio"""
+
+    def __init__(self, seed=0, logic=None, tactic=None, params=None):
+        """
+        :param seed: the random seed of the solver
+        :param logic: create the solver with z3.SolverFor(logic), e.g. 'QF_LIA'
+        :param tactic: create the solver from a tactic, e.g. 'qflia'
+                       (tactic solvers don't return unsat cores)
+        :param params: dict of extra solver parameters
+        """
+        assert not (logic and tactic)
+        self.seed = seed
+        self.logic = logic
+        self.tactic = tactic
+        self.params = params or {}
+
+    def create_solver(self, ctx):
+        """Create a new solver in the given context"""
+        if self.logic:
+            solver = z3.SolverFor(self.logic, ctx=ctx)
+        elif self.tactic:
+            solver = z3.Tactic(self.tactic, ctx=ctx).solver()
+        else:
+            solver = z3.Solver(ctx=ctx)
+        solver.set('random_seed', self.seed)
+        for key, value in self.params.iteritems():
+            solver.set(key, value)
+        return solver
+
+    def __repr__(self):
+        return "PortfolioConfig(seed=%s, logic=%s, tactic=%s, params=%s)" % (
+            self.seed, self.logic, self.tactic, self.params)
+
+
+def default_configs(workers, logics=(None,)):
+    """
+    Return a configuration for each worker, with a different random seed
+    and cycling over the given logics (None is the default solver)
+    """
+    return [PortfolioConfig(seed=index, logic=logics[index % len(logics)])
+            for index in range(workers)]
+
+
+def get_payload(solver, result):
+    """
+    The SMT-LIB2 equalities of the model constants for sat, the names of
+    the unsat core literals for unsat, or None after solver.check()
+    """
+    if result == z3.sat:
+        model = solver.model()
+        return ["(assert (= %s %s))" % (decl().sexpr(), model[decl].sexpr())
+                for decl in model.decls() if decl.arity() == 0]
+    elif result == z3.unsat:
+        return [str(lit) for lit in solver.unsat_core()]
+    return None
+
+
+def replay_payload(solver, smt2, lits, result, payload):
+    """
+    Replay a result computed elsewhere on the solver (see get_payload),
+    so solver.model() and solver.unsat_core() can be used
+    :param smt2: the serialization of the solver, for the declarations
+    :param lits: the literals the result was checked under
+    :param result: 'sat' or 'unsat'
+    :return: z3.sat or z3.unsat
+    """
+    if result == 'sat':
+        # Replay the model, all the constants are fixed so it's
+        # only a propagation
+        end = smt2.find('(assert')
+        decls = smt2[:end] if end >= 0 else ''
+        values = z3.parse_smt2_string(
+            decls + "\n".join(payload), ctx=solver.ctx)
+        ret = solver.check(*(list(lits) + list(values)))
+        assert ret == z3.sat, "The model is rejected by the solver"
+        return ret
+    assert result == 'unsat'
+    if payload:
+        # Only check the core, to get solver.unsat_core()
+        ret = solver.check(*[z3.Bool(name, solver.ctx) for name in payload])
+    else:
+        ret = solver.check(*lits)
+    assert ret == z3.unsat, "The unsat core is rejected by the solver"
+    return ret
+
+
+def _check_worker(index, config, smt2, assumptions, timeout, queue):
+    """
+    Check the serialized formula in a fresh context and put
+    (index, result, payload) in the queue. The payload is the SMT-LIB2
+    equalities of the model constants for sat, or the names of the unsat
+    core literals for unsat.
+    """
+    try:
+        ctx = z3.Context()
+        solver = config.create_solver(ctx)
+        if timeout:
+            solver.set('timeout', timeout)
+        solver.from_string(smt2)
+        lits = [z3.Bool(name, ctx) for name in assumptions]
+        result = solver.check(*lits)
+        queue.put((index, str(result), get_payload(solver, result)))
+    except Exception as err:
+        queue.put((index, 'unknown', str(err)))
+
+
+class SolverPortfolio(object):
+    """Check a Z3 solver with a portfolio of configurations"""
+
+    def __init__(self, configs=None, workers=None, timeout=None):
+        """
+        :param configs: list of PortfolioConfig, default one per worker
+                        with different random seeds
+        :param workers: max number of worker processes,
+                        default the number of CPUs
+        :param timeout: per worker timeout in milliseconds
+        """
+        if workers is None:
+            workers = len(configs) if configs else multiprocessing.cpu_count()
+        if configs is None:
+            configs = default_configs(workers)
+        assert configs
+        assert workers > 0
+        self.configs = configs
+        self.workers = workers
+        self.timeout = timeout
+        # The winning configuration of the last check (None if no winner)
+        self.winner = None
+        # (time, config, result) of the workers that returned
+        self.results = []
+
+    def _run(self, smt2, assumptions):
+        """Run the workers, return (config index, result, payload)"""
+        queue = multiprocessing.Queue()
+        pending = list(range(len(self.configs)))
+        running = {}
+        start = timer()
+        self.results = []
+        try:
+            while pending or running:
+                while pending and len(running) < self.workers:
+                    index = pending.pop(0)
+                    proc = multiprocessing.Process(
+                        target=_check_worker,
+                        args=(index, self.configs[index], smt2, assumptions,
+                              self.timeout, queue))
+                    proc.daemon = True
+                    proc.start()
+                    running[index] = proc
+                try:
+                    index, result, payload = queue.get(timeout=1)
+                except Empty:
+                    for index, proc in running.items():
+                        if not proc.is_alive() and proc.exitcode != 0:
+                            # Worker crashed before returning
+                            del running[index]
+                    continue
+                running.pop(index).join()
+                self.results.append((timer() - start, self.configs[index], result))
+                if result in ['sat', 'unsat']:
+                    return index, result, payload
+            return None, 'unknown', None
+        finally:
+            for proc in running.values():
+                proc.terminate()
+                proc.join()
+
+    def check(self, solver, assumptions=(), tracked=()):
+        """
+        Check the solver on all the configurations.
+        :param solver: z3.Solver, it's not changed except for the last check
+        :param assumptions: Boolean literals to check under
+        :param tracked: the literals used with solver.assert_and_track,
+                        they're only serialized as free Boolean variables
+        :return: z3.sat, z3.unsat, or z3.unknown
+        """
+        lits = list(assumptions) + list(tracked)
+        smt2 = solver.to_smt2()
+        index, result, payload = self._run(smt2, [str(lit) for lit in lits])
+        self.winner = None if index is None else self.configs[index]
+        if result in ['sat', 'unsat']:
+            return replay_payload(solver, smt2, lits, result, payload)
+        return z3.unknown
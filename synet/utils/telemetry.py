@@ -0,0 +1,108 @@
+"""
+Structured telemetry of the synthesis loops.
+
+A Telemetry object sends one flat record (dict) per event to its sinks,
+e.g. one 'cegis_iteration' record per iteration of the OSPF CEGIS loop,
+so the runs can be aggregated and plotted across seeds.
+Without sinks the records are not even built.
+"""
+
+import json
+import logging
+import resource
+import time
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+def get_memory_usage():
+    """Return the max resident set size of the process (in KB on Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ListSink(object):
+    """Keep the records in memory"""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+class JSONLinesSink(object):
+    """Append each record as a JSON line to a file"""
+
+    def __init__(self, out_file):
+        """
+        :param out_file: a file name or an open file object
+        """
+        if isinstance(out_file, basestring):
+            self.out_file = open(out_file, 'a')
+            self._owned = True
+        else:
+            self.out_file = out_file
+            self._owned = False
+
+    def emit(self, record):
+        self.out_file.write(json.dumps(record, sort_keys=True))
+        self.out_file.write('\n')
+        self.out_file.flush()
+
+    def close(self):
+        if self._owned:
+            self.out_file.close()
+
+
+class LoggingSink(object):
+    """Log each record as JSON"""
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('synet.telemetry')
+        self.level = level
+
+    def emit(self, record):
+        self.logger.log(self.level, "%s", json.dumps(record, sort_keys=True))
+
+    def close(self):
+        pass
+
+
+class Telemetry(object):
+    """Send structured records to a list of sinks"""
+
+    def __init__(self, sinks=None, **context):
+        """
+        :param sinks: list of sinks (with emit(record) and close())
+        :param context: fields added to every record, e.g., seed=1
+        """
+        self.sinks = list(sinks or [])
+        self.context = context
+
+    @property
+    def enabled(self):
+        """True if the records go anywhere"""
+        return len(self.sinks) > 0
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def emit(self, event, **fields):
+        """Send one record of the given event type to all the sinks"""
+        if not self.sinks:
+            return
+        record = dict(self.context)
+        record.update(fields)
+        record['event'] = event
+        record['timestamp'] = time.time()
+        for sink in self.sinks:
+            sink.emit(record)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -147,8 +147,7 @@ class PropagationTest2(unittest.TestCase):
                                            create_as_paths=False)
         return ctx
 
-    def test_good_gadget(self):
-        # Arrange
+    def get_good_gadget(self):
         g = get_griffin_graph()
         net = "Prefix0"
         prefix_map = {net: ip_network(u'128.0.0.0/24')}
@@ -195,8 +194,13 @@ class PropagationTest2(unittest.TestCase):
         p6 = PathReq(Protocols.BGP, dst_net='Prefix0', path=['R5', 'R4', 'R1'], strict=False)
         p7 = PathReq(Protocols.BGP, dst_net='Prefix0', path=['R5', 'R3', 'R1'], strict=False)
         r5_req = PathOrderReq(Protocols.BGP, dst_net='Prefix0', paths=[p6, p7], strict=False)
-        # Action
         reqs = [r2_req, r3_req, r4_req, r5_req]
+        return g, reqs, prefix_map
+
+    def test_good_gadget(self):
+        # Arrange
+        g, reqs, prefix_map = self.get_good_gadget()
+        # Action
         ctx = self.create_context(reqs, g)
         propagation = EBGPPropagation(reqs, g, ctx)
         unmatching_order = propagation.compute_dags()
@@ -210,6 +214,24 @@ class PropagationTest2(unittest.TestCase):
         gns3 = GNS3Topo(g, prefix_map)
         gns3.write_configs('./out-configs/good_gadget')
 
+    def test_good_gadget_rank(self):
+        # Arrange
+        g, reqs, _ = self.get_good_gadget()
+        # Action
+        ctx = self.create_context(reqs, g)
+        propagation = EBGPPropagation(reqs, g, ctx)
+        unmatching_order = propagation.compute_dags()
+        assert not unmatching_order
+        propagation.synthesize(encoding='rank')
+        solver = z3.Solver(ctx=ctx.z3_ctx)
+        ret = ctx.check(solver)
+        # Assert
+        assert ret == z3.sat, solver.unsat_core()
+        for node in propagation.ibgp_propagation.nodes():
+            box = propagation.ibgp_propagation.node[node]['box']
+            for const_name in box.selection_constraints:
+                self.assertTrue(const_name.startswith('SELECT_RANK_'))
+
     def test_naughty_gadget(self):
         # Arrange
         g = get_griffin_graph()
@@ -12,12 +12,18 @@ from nose.plugins.attrib import attr
 
 from synet.synthesis.connected import ConnectedSyn
 import synet.synthesis.ospf
+import synet.synthesis.ospf_decompose
+import synet.synthesis.ospf_distance
 import synet.synthesis.ospf_heuristic
 
 from synet.utils.common import Protocols
 from synet.utils.common import PathReq
 from synet.utils.common import ECMPPathsReq
+from synet.utils.common import KConnectedPathsReq
 from synet.utils.common import PathOrderReq
+from synet.utils.smt_context import VALUENOTSET
+from synet.utils.telemetry import ListSink
+from synet.utils.telemetry import Telemetry
 from synet.utils.topo_gen import get_fanout_topology
 
 from tekton.graph import NetworkGraph
@@ -119,6 +125,61 @@ class TestOSPF(unittest.TestCase):
         self.assertEqual(len(ospf.reqs), 1)
         self.assertEqual(len(ospf.removed_reqs), 0)
 
+    def test_4nodes_1paths_bv(self):
+        reqs = TestOSPF.get_1path_req()
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(
+            self.network_graph, gen_paths=10, encoding='bv')
+        for req in reqs:
+            ospf.add_req(req)
+        self.assertTrue(ospf.synthesize())
+        ospf.update_network_graph()
+        computed = list(nx.all_shortest_paths(
+            self.network_graph, 'R1', 'R4', 'ospf_cost'))
+        self.assertEquals(computed, [reqs[0].path])
+        for _, _, cost in ospf.get_output_configs():
+            self.assertTrue(0 < cost <= 65535)
+
+    def test_4nodes_1paths_telemetry(self):
+        reqs = TestOSPF.get_1path_req()
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        sink = ListSink()
+        ospf.telemetry = Telemetry([sink])
+        for req in reqs:
+            ospf.add_req(req)
+        self.assertTrue(ospf.synthesize())
+        iterations = [r for r in sink.records if r['event'] == 'cegis_iteration']
+        self.assertEqual(len(iterations), len(ospf.solver_times))
+        self.assertEqual(iterations[-1]['violated'], 0)
+        self.assertEqual(sink.records[-1]['event'], 'cegis_done')
+        self.assertTrue(sink.records[-1]['result'])
+
+    def test_4nodes_1paths_bounded_history(self):
+        reqs = TestOSPF.get_1path_req()
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(
+            self.network_graph, gen_paths=10, max_history=1)
+        for req in reqs:
+            ospf.add_req(req)
+        self.assertTrue(ospf.synthesize())
+        num_paths, _, num_bytes, registry_bytes = ospf.get_history_stats()
+        self.assertEqual(num_paths, 1)
+        self.assertGreater(num_bytes, 0)
+        self.assertGreater(registry_bytes, 0)
+        ospf.remove_reqs(reqs)
+        self.assertEqual(ospf.path_histories, {})
+
+    def test_4nodes_1paths_kshortest(self):
+        reqs = TestOSPF.get_1path_req()
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(
+            self.network_graph, gen_paths=2, path_gen_strategy='kshortest')
+        for req in reqs:
+            ospf.add_req(req)
+        ret = ospf.synthesize()
+        self.assertTrue(ret)
+        ospf.update_network_graph()
+        computed = list(nx.all_shortest_paths(
+            self.network_graph, 'R1', 'R4', 'ospf_cost'))
+        self.assertEquals(computed, [reqs[0].path])
+
     @attr(speed='slow')
     def test_4nodes_3paths_unstatified_heuristic(self):
         reqs = TestOSPF.get_3path_req()
@@ -128,6 +189,170 @@ class TestOSPF(unittest.TestCase):
         ret = ospf.synthesize()
         self.assertFalse(ret)
 
+    def test_4nodes_3paths_remove_unsat_heuristic(self):
+        reqs = TestOSPF.get_3path_req()
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        for req in reqs:
+            ospf.add_req(req)
+        solver = ospf.solver
+        while not ospf.synthesize():
+            ospf.remove_unsat_paths()
+        # Requirements are retracted without creating a new solver
+        self.assertIs(ospf.solver, solver)
+        self.assertEqual(len(ospf.reqs), 1)
+        self.assertEqual(len(ospf.removed_reqs), 2)
+        self.assertTrue(ospf.solver_times)
+
+    def test_4nodes_3paths_relax_heuristic(self):
+        reqs = TestOSPF.get_3path_req()
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        for req in reqs:
+            ospf.add_req(req)
+        ret = ospf.synthesize(relax=True)
+        self.assertTrue(ret)
+        # The three paths conflict pairwise, only one can be kept
+        self.assertEqual(len(ospf.reqs), 1)
+        self.assertEqual(len(ospf.removed_reqs), 2)
+        ospf.update_network_graph()
+        path = ospf.reqs[0].path
+        computed = list(nx.all_shortest_paths(
+            self.network_graph, path[0], path[-1], 'ospf_cost'))
+        self.assertEqual(computed, [path])
+
+    def test_4nodes_incremental_heuristic(self):
+        reqs = TestOSPF.get_3path_req()
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        ospf.add_reqs([reqs[1]])
+        self.assertTrue(ospf.synthesize())
+        # Replace the requirement with a conflicting one
+        ospf.remove_reqs([reqs[1]])
+        ospf.add_reqs([reqs[2]])
+        self.assertTrue(ospf.synthesize())
+        self.assertEqual(ospf.reqs, [reqs[2]])
+        # Removing a link that is not used doesn't need the solver
+        num_checks = len(ospf.solver_times)
+        self.network_graph.remove_edge('R2', 'R1')
+        ospf.apply_topology_delta(removed_edges=[('R2', 'R1')])
+        self.assertTrue(ospf.synthesize())
+        self.assertEqual(len(ospf.solver_times), num_checks)
+        ospf.update_network_graph()
+        path = reqs[2].path
+        computed = list(nx.all_shortest_paths(
+            self.network_graph, path[0], path[-1], 'ospf_cost'))
+        self.assertEqual(computed, [path])
+        with self.assertRaises(ValueError):
+            ospf.apply_topology_delta(removed_edges=[('R1', 'R3')])
+
+    def test_4nodes_shared_path_heuristic(self):
+        path = ['R1', 'R2', 'R3', 'R4']
+        req1 = PathReq(Protocols.OSPF, 'R4', path, False)
+        req2 = PathReq(Protocols.OSPF, 'R4_2', path, False)
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        ospf.add_reqs([req1, req2])
+        self.assertTrue(ospf.synthesize())
+
+        def get_less_keys(req):
+            lit_id = ospf.get_req_lit(req).get_id()
+            return set([key[2:] for key in ospf._tracked
+                        if key[0] == 'ISLESS' and key[1] == lit_id])
+        # Each requirement has its own copy of the shared constraints
+        self.assertTrue(get_less_keys(req1))
+        self.assertEqual(get_less_keys(req1), get_less_keys(req2))
+        # The constraints of req2 are still active without req1
+        ospf.remove_reqs([req1])
+        ospf.costs = None
+        self.assertTrue(ospf.synthesize())
+        ospf.update_network_graph()
+        computed = list(nx.all_shortest_paths(
+            self.network_graph, path[0], path[-1], 'ospf_cost'))
+        self.assertEqual(computed, [path])
+
+    def test_4nodes_concrete_heuristic(self):
+        for src, dst in self.network_graph.edges():
+            self.network_graph.set_edge_ospf_cost(src, dst, 10)
+        self.network_graph.set_edge_ospf_cost('R1', 'R4', 100)
+        self.network_graph.set_edge_ospf_cost('R3', 'R4', 5)
+        reqs = TestOSPF.get_3path_req()
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        ospf.add_req(reqs[2])
+        self.assertTrue(ospf.synthesize())
+        self.assertEqual(ospf.solver_times, [])
+        # No symbolic costs to fix a violated requirement
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        ospf.add_req(reqs[0])
+        self.assertFalse(ospf.synthesize())
+        self.assertEqual(ospf.solver_times, [])
+
+    def test_4nodes_partial_concrete_heuristic(self):
+        for src, dst in self.network_graph.edges():
+            self.network_graph.set_edge_ospf_cost(src, dst, 10)
+        self.network_graph.set_edge_ospf_cost('R1', 'R2', VALUENOTSET)
+        self.network_graph.set_edge_ospf_cost('R2', 'R3', VALUENOTSET)
+        req1 = PathReq(Protocols.OSPF, 'R3', ['R1', 'R2', 'R3'], False)
+        # R3 -> R4 holds for any cost of the symbolic edges
+        req2 = PathReq(Protocols.OSPF, 'R4', ['R3', 'R4'], False)
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        ospf.add_reqs([req1, req2])
+        self.assertTrue(ospf.synthesize())
+        self.assertEqual(ospf.get_encoded_reqs(), [req1])
+        ospf.update_network_graph()
+        for req in ospf.reqs:
+            path = req.path
+            computed = list(nx.all_shortest_paths(
+                self.network_graph, path[0], path[-1], 'ospf_cost'))
+            self.assertEqual(computed, [path])
+
+    def test_4nodes_concrete_delta_heuristic(self):
+        self.network_graph.remove_edge('R3', 'R4')
+        for src, dst in self.network_graph.edges():
+            self.network_graph.set_edge_ospf_cost(src, dst, 10)
+        self.network_graph.set_edge_ospf_cost('R2', 'R4', 15)
+        self.network_graph.set_edge_ospf_cost('R1', 'R2', VALUENOTSET)
+        self.network_graph.set_edge_ospf_cost('R2', 'R3', VALUENOTSET)
+        req1 = PathReq(Protocols.OSPF, 'R3', ['R1', 'R2', 'R3'], False)
+        req2 = PathReq(Protocols.OSPF, 'R4', ['R3', 'R1', 'R4'], False)
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        ospf.add_reqs([req1, req2])
+        self.assertTrue(ospf.synthesize())
+        self.assertEqual(ospf.get_encoded_reqs(), [req1])
+        # A cheap concrete edge that is shorter than the path of req2
+        self.network_graph.add_router_edge('R3', 'R4')
+        self.network_graph.set_edge_ospf_cost('R3', 'R4', 5)
+        ospf.apply_topology_delta(added_edges=[('R3', 'R4')])
+        self.assertEqual(ospf.get_encoded_reqs(), [req1, req2])
+        self.assertFalse(ospf.synthesize())
+
+    def test_4nodes_readd_edge_delta_heuristic(self):
+        for src, dst in self.network_graph.edges():
+            self.network_graph.set_edge_ospf_cost(src, dst, 10)
+        self.network_graph.set_edge_ospf_cost('R1', 'R2', VALUENOTSET)
+        self.network_graph.set_edge_ospf_cost('R2', 'R3', VALUENOTSET)
+        req1 = PathReq(Protocols.OSPF, 'R3', ['R1', 'R2', 'R3'], False)
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(self.network_graph, gen_paths=10)
+        ospf.add_reqs([req1])
+        self.assertTrue(ospf.synthesize())
+        path = ['R1', 'R3', 'R4']
+        self.assertEqual(ospf._get_path_cost(path), 20)
+        path_id = ospf.path_registry.get_id(path)
+        # The link comes back with another cost
+        self.network_graph.remove_edge('R3', 'R4')
+        ospf.apply_topology_delta(removed_edges=[('R3', 'R4')])
+        # The costs before the delta are not an output anymore
+        self.assertIsNone(ospf.costs)
+        self.network_graph.add_router_edge('R3', 'R4')
+        self.network_graph.set_edge_ospf_cost('R3', 'R4', 5)
+        ospf.apply_topology_delta(added_edges=[('R3', 'R4')])
+        self.assertEqual(ospf._get_path_cost(path), 15)
+        # The constraints over the old path are encoded again
+        self.assertNotEqual(ospf.path_registry.get_id(path), path_id)
+        self.assertFalse([key for key in ospf._tracked
+                          if key[0] == 'ISLESS' and path_id in key[2:]])
+        self.assertTrue(ospf.synthesize())
+        ospf.update_network_graph()
+        computed = list(nx.all_shortest_paths(
+            self.network_graph, 'R1', 'R3', 'ospf_cost'))
+        self.assertEqual(computed, [req1.path])
+
     def test_ecmp_full(self):
         fan_out = 4
         network_graph = self.get_triangles(fan_out)
@@ -248,6 +473,28 @@ class TestOSPF(unittest.TestCase):
         self.assertLessEqual(p2_cost, p3_cost)
         self.assertLessEqual(p3_cost, p4_cost)
 
+    def test_ordered_kshortest(self):
+        fan_out = 4
+        network_graph = self.get_triangles(fan_out)
+        source = 'source'
+        sink = 'sink'
+        paths = [[source, 'R%d' % i, sink] for i in range(1, fan_out)]
+        order_req = PathOrderReq(
+            Protocols.OSPF, 'Google',
+            [PathReq(Protocols.OSPF, 'Google', p, False) for p in paths], False)
+        ospf = synet.synthesis.ospf_heuristic.OSPFSyn(
+            network_graph, gen_paths=2, path_gen_strategy='kshortest')
+        ospf.add_req(order_req)
+        ret = ospf.synthesize()
+        self.assertTrue(ret)
+        ospf.update_network_graph()
+        costs = [
+            sum([network_graph.get_edge_ospf_cost(src, dst)
+                 for src, dst in zip(p[0::1], p[1::1])])
+            for p in paths]
+        self.assertEquals(costs, sorted(costs))
+        self.assertEquals(len(set(costs)), len(costs))
+
     def test_ordered_notvalid(self):
         fan_out = 4
         network_graph = self.get_triangles(fan_out)
@@ -267,3 +514,118 @@ class TestOSPF(unittest.TestCase):
         ospf.add_req(order_req2)
         ret = ospf.synthesize()
         self.assertFalse(ret)
+
+    def test_4nodes_1paths_distance(self):
+        reqs = TestOSPF.get_1path_req()
+        ospf = synet.synthesis.ospf_distance.OSPFSyn(self.network_graph)
+        for req in reqs:
+            ospf.add_req(req)
+        ret = ospf.synthesize()
+        self.assertTrue(ret)
+        ospf.update_network_graph()
+        computed = list(nx.all_shortest_paths(
+            self.network_graph, 'R1', 'R4', 'ospf_cost'))
+        self.assertEquals(computed, [reqs[0].path])
+
+    def test_4nodes_3paths_unstatified_distance(self):
+        reqs = TestOSPF.get_3path_req()
+        ospf = synet.synthesis.ospf_distance.OSPFSyn(self.network_graph)
+        for req in reqs:
+            ospf.add_req(req)
+        ret = ospf.synthesize()
+        self.assertFalse(ret)
+
+    def test_ecmp_distance(self):
+        fan_out = 4
+        network_graph = self.get_triangles(fan_out)
+        source = 'source'
+        sink = 'sink'
+        p1 = [source, 'R1', sink]
+        p2 = [source, 'R2', sink]
+        path1 = PathReq(Protocols.OSPF, 'Google', p1, False)
+        path2 = PathReq(Protocols.OSPF, 'Google', p2, False)
+        ecmp_req = ECMPPathsReq(Protocols.OSPF, 'Google', [path1, path2], False)
+        ospf = synet.synthesis.ospf_distance.OSPFSyn(network_graph)
+        ospf.add_req(ecmp_req)
+        ret = ospf.synthesize()
+        self.assertTrue(ret)
+        ospf.update_network_graph()
+        ecmp = [
+            tuple(p) for p in
+            nx.all_shortest_paths(network_graph, source, sink, 'ospf_cost')]
+        ecmp = set(ecmp)
+        self.assertEquals(ecmp, set([tuple(p1), tuple(p2)]))
+
+    def test_kconnected_distance(self):
+        fan_out = 4
+        network_graph = self.get_triangles(fan_out)
+        source = 'source'
+        sink = 'sink'
+        p1 = [source, 'R1', sink]
+        p2 = [source, 'R2', sink]
+        p3 = [source, 'R3', sink]
+        path1 = PathReq(Protocols.OSPF, 'Google', p1, False)
+        path2 = PathReq(Protocols.OSPF, 'Google', p2, False)
+        req = KConnectedPathsReq(Protocols.OSPF, 'Google', [path1, path2], False)
+        ospf = synet.synthesis.ospf_distance.OSPFSyn(network_graph)
+        ospf.add_req(req)
+        ret = ospf.synthesize()
+        self.assertTrue(ret)
+        ospf.update_network_graph()
+        p1_cost = sum([
+            network_graph.get_edge_ospf_cost(src, dst)
+            for src, dst in zip(p1[0::1], p1[1::1])])
+        p2_cost = sum([
+            network_graph.get_edge_ospf_cost(src, dst)
+            for src, dst in zip(p2[0::1], p2[1::1])])
+        p3_cost = sum([
+            network_graph.get_edge_ospf_cost(src, dst)
+            for src, dst in zip(p3[0::1], p3[1::1])])
+        self.assertLess(max(p1_cost, p2_cost), p3_cost)
+
+    def test_4nodes_1paths_decompose(self):
+        reqs = TestOSPF.get_1path_req()
+        planner = synet.synthesis.ospf_decompose.OSPFPlanner(
+            self.network_graph, reqs, workers=1, gen_paths=10)
+        self.assertTrue(planner.synthesize())
+        planner.update_network_graph()
+        computed = list(nx.all_shortest_paths(
+            self.network_graph, 'R1', 'R4', 'ospf_cost'))
+        self.assertEqual(computed, [reqs[0].path])
+
+    def test_4nodes_3paths_unstatified_decompose(self):
+        reqs = TestOSPF.get_3path_req()
+        planner = synet.synthesis.ospf_decompose.OSPFPlanner(
+            self.network_graph, reqs, workers=2, gen_paths=10)
+        self.assertEqual(len(planner.compute_groups()), 3)
+        # All paths share edges, so they end up in the same group
+        planner.compute_req_edges()
+        self.assertEqual(planner.compute_groups(), [[0, 1, 2]])
+        self.assertFalse(planner.synthesize())
+
+    def test_4nodes_capped_decompose(self):
+        self.network_graph.set_edge_ospf_cost('R1', 'R2', 30000)
+        self.network_graph.set_edge_ospf_cost('R2', 'R3', 30000)
+        self.network_graph.set_edge_ospf_cost('R3', 'R4', 6000)
+        req1 = PathReq(Protocols.OSPF, 'R4', ['R1', 'R2', 'R3', 'R4'], False)
+        req2 = PathReq(Protocols.OSPF, 'R1', ['R4', 'R2', 'R1'], False)
+        planner = synet.synthesis.ospf_decompose.OSPFPlanner(
+            self.network_graph, [req1, req2], workers=1, gen_paths=10,
+            candidate_paths=0)
+        sink = ListSink()
+        planner.telemetry = Telemetry([sink])
+        self.assertTrue(planner.synthesize())
+        rounds = [r for r in sink.records if r['event'] == 'planner_round']
+        # The capped cost of the unowned edge R1 -> R4 is cheaper than
+        # the path of req1, so it's refined in a second round
+        self.assertEqual(len(rounds), 2)
+        self.assertEqual(rounds[0]['violated'], 1)
+        self.assertEqual(rounds[0]['group_sizes'], [1, 1])
+        self.assertEqual(rounds[1]['violated'], 0)
+        self.assertEqual(sink.records[-1]['event'], 'planner_done')
+        self.assertEqual(planner.costs[('R3', 'R1')], 65535)
+        planner.update_network_graph()
+        for req in [req1, req2]:
+            computed = list(nx.all_shortest_paths(
+                self.network_graph, req.path[0], req.path[-1], 'ospf_cost'))
+            self.assertEqual(computed, [req.path])
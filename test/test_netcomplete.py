@@ -5,8 +5,12 @@ from synet.netcomplete import NetCompleteConfigs
 from synet.netcomplete import SketchError
 from synet.utils.common import PathReq
 from synet.utils.common import Protocols
+from synet.utils.networks import AddressRegistry
+from synet.utils.smt_context import VALUENOTSET
 from synet.utils.topo_gen import get_ibgp_linear_topo
 
+from tekton.graph import NetworkGraph
+
 __author__ = "Ahmed El-Hassany"
 __email__ = "a.hassany@gmail.com"
 
@@ -35,3 +39,36 @@ class NetCompleteTest(unittest.TestCase):
         # Assert
         self.assertRaises(SketchError, synthesizer1.synthesize)
         self.assertTrue(ret2)
+
+    def test_ospf_announce_held_reqs(self):
+        # Arrange
+        graph = NetworkGraph()
+        routers = ['R1', 'R2', 'R3', 'R4']
+        for router in routers:
+            graph.add_router(router)
+            graph.enable_ospf(router, 100)
+        for src in routers:
+            for dst in routers:
+                if src != dst:
+                    graph.add_router_edge(src, dst)
+                    graph.set_edge_ospf_cost(src, dst, 10)
+        graph.set_edge_ospf_cost('R1', 'R2', VALUENOTSET)
+        graph.set_edge_ospf_cost('R2', 'R3', VALUENOTSET)
+        graph.add_ospf_network('R3', 'prefix1', 0)
+        graph.add_ospf_network('R4', 'prefix2', 0)
+        # Needs the solver
+        req1 = PathReq(Protocols.OSPF, 'prefix1', ['R1', 'R2', 'R3'], False)
+        # Already holds for the concrete costs
+        req2 = PathReq(Protocols.OSPF, 'prefix2', ['R3', 'R4'], False)
+        configs = NetCompleteConfigs(ospf_synthesizer='distance')
+        synthesizer = NetComplete(reqs=[req1, req2],
+                                  topo=graph,
+                                  external_announcements=[],
+                                  netcompplete_config=configs)
+        # Act
+        synthesizer.synthesize_connected()
+        synthesizer.synthesize_ospf()
+        # Assert
+        for router, prefix in [('R3', 'prefix1'), ('R4', 'prefix2')]:
+            for addr in AddressRegistry.get_network_addr(prefix):
+                self.assertIn(addr, graph.get_ospf_networks(router))
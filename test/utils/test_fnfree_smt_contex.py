@@ -1,4 +1,7 @@
 
+import os
+import shutil
+import tempfile
 import unittest
 
 import z3
@@ -13,10 +16,13 @@ from synet.utils.fnfree_smt_context import EnumType
 from synet.utils.fnfree_smt_context import SolverContext
 from synet.utils.fnfree_smt_context import VALUENOTSET
 from synet.utils.fnfree_smt_context import SMTVar
+from synet.utils.fnfree_smt_context import desanitize_smt_name
 from synet.utils.fnfree_smt_context import get_as_path_key
 from synet.utils.fnfree_smt_context import is_empty
 from synet.utils.fnfree_smt_context import is_symbolic
 from synet.utils.fnfree_smt_context import read_announcements
+from synet.utils.fnfree_smt_context import sanitize_smt_name
+from synet.utils.smt_cache import SMTCache
 
 
 __author__ = "Ahmed El-Hassany"
@@ -47,6 +53,26 @@ class EnumTypeTest(unittest.TestCase):
         with self.assertRaises(Exception):
             enum_type.get_concrete_value('D')
 
+    def test_lookup_sanitized(self):
+        # Arrange
+        values = [sanitize_smt_name(v) for v in ['1.1.1.1', '10.0.0.0/8', 'A']]
+        z3_ctx = z3.Context()
+        enum_type = EnumType('TestType', values, z3_ctx=z3_ctx)
+        # Act
+        solver = z3.Solver(ctx=z3_ctx)
+        var = z3.Const('var', enum_type.sort)
+        solver.add(var == enum_type.get_symbolic_value('10.0.0.0/8'))
+        self.assertEquals(solver.check(), z3.sat)
+        # Assert
+        value = solver.model().eval(var)
+        self.assertEquals(enum_type.get_concrete_value(value), values[1])
+        self.assertEquals(desanitize_smt_name(values[1]), '10.0.0.0/8')
+        self.assertIs(enum_type.get_symbolic_value(values[0]),
+                      enum_type.get_symbolic_value('1.1.1.1'))
+        other_type = EnumType('OtherType', ['B'], z3_ctx=z3_ctx)
+        with self.assertRaises(ValueError):
+            enum_type.get_concrete_value(other_type.get_symbolic_value('B'))
+
 
 @attr(speed='fast')
 class VarTest(unittest.TestCase):
@@ -267,6 +293,91 @@ class SolverContextTest(unittest.TestCase):
         self.assertTrue(isinstance(var, SMTVar))
         self.assertTrue(var.name.startswith(prefix))
 
+    def test_register_constraints(self):
+        # Arrange
+        ctx = SolverContext(z3.Context())
+        var1 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), value=10)
+        var2 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), value=10)
+        var3 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+        # Act
+        names = ctx.register_constraints(
+            [var1.check_eq(var2), var1.check_eq(var3)], name_prefix='Imp_')
+        # Assert
+        self.assertEquals(len(names), 2)
+        self.assertTrue(all(name.startswith('Imp_') for name in names))
+        self.assertEquals(ctx.get_constraint(names[0]), True)
+        self.assertTrue(z3.is_expr(ctx.get_constraint(names[1])))
+        solver = z3.Solver(ctx=ctx.z3_ctx)
+        self.assertEquals(ctx.check(solver), z3.sat)
+        self.assertEquals(var3.get_value(), 10)
+
+    def test_vars_memory(self):
+        # Arrange
+        ctx = SolverContext(z3.Context())
+        for _ in range(3):
+            ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), name_prefix='match_')
+        var = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx),
+                                   name_prefix='setone_', value=10)
+        # Act
+        report = ctx.get_vars_memory()
+        # Assert
+        self.assertEquals(sorted(report.keys()), ['match_', 'setone_'])
+        self.assertEquals(report['match_'][0], 3)
+        self.assertEquals(report['setone_'][0], 1)
+        self.assertNotIn(var, ctx._vars.values())
+        # The z3 variable of a concrete var is created on demand
+        self.assertLess(report['setone_'][1], report['match_'][1] / 3)
+        self.assertEquals(str(var.get_var()), var.name)
+        self.assertFalse(hasattr(var, '__dict__'))
+
+    def test_concrete_vars_registry(self):
+        # Arrange
+        ctx = SolverContext(z3.Context())
+        kept_ctx = SolverContext(z3.Context(), keep_concrete_vars=True)
+        # Act
+        var1 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), value=10)
+        var2 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+        var3 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx),
+                                    name_prefix='R1', value=5)
+        kept_var = kept_ctx.create_fresh_var(
+            z3.IntSort(ctx=kept_ctx.z3_ctx), value=10)
+        # Assert
+        # Concrete vars are not registered and their names are lazy
+        self.assertEquals(ctx._vars.keys(), [var2.name])
+        self.assertEquals(ctx.get_num_vars(), 3)
+        self.assertEquals(var1._name, 0)
+        self.assertEquals(var1.name, 'Var_0')
+        # A prefix ending with a digit is separated from the counter
+        self.assertEquals(var3.name, 'R1_2')
+        self.assertEquals(kept_ctx._vars.keys(), [kept_var.name])
+        # The generated names are reserved even if not registered
+        with self.assertRaises(ValueError):
+            ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), name='Var_0')
+        # A name given before is skipped by the generated names
+        named = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), name='Var_3')
+        var4 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), value=1)
+        self.assertEquals(named.name, 'Var_3')
+        self.assertEquals(var4.name, 'Var_4')
+        # The z3 variable of an unregistered var is still substituted
+        ctx.register_constraint(var1.get_var() > 3, name='concrete')
+        folded, false_names = ctx.fold_constraints()
+        self.assertEquals((folded, false_names), ([], []))
+
+    def test_concrete_vars_eq_hash(self):
+        # Arrange
+        ctx = SolverContext(z3.Context())
+        var1 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), value=10)
+        var2 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), value=10)
+        # Act
+        vars_set = set([var1, var2])
+        # Assert
+        self.assertEquals(len(vars_set), 2)
+        self.assertTrue(var1 == var1)
+        self.assertFalse(var1 == var2)
+        # The z3 variables are not created by the comparisons
+        self.assertIsNone(var1._var)
+        self.assertEquals(ctx._concrete_z3_vars, [])
+
     def test_fresh_const_name(self):
         ctx = SolverContext(z3.Context())
         name1 = ctx.fresh_constraint_name()
@@ -357,6 +468,197 @@ class SolverContextTest(unittest.TestCase):
         ret = ctx.check(solver)
         self.assertEquals(ret, z3.sat)
 
+    def test_compare_enum_type_rank(self):
+        # Arrange
+        values = ['A', 'B', 'C']
+        sort_name = 'TestType'
+        ctx = SolverContext(z3.Context())
+        solver = z3.Solver(ctx=ctx.z3_ctx)
+        vsort = ctx.create_enum_type(sort_name, values)
+        A, B, C = [vsort.get_symbolic_value(x) for x in values]
+        GREATER, LESS, EQUAL, INCOMPLETE = ctx.compare_vars
+        # Act
+        func = ctx.create_enum_compare(sort_name, encoding='rank')
+        solver.add(func(A, A) == EQUAL)
+        solver.add(func(A, B) == GREATER)
+        solver.add(func(B, C) == GREATER)
+        # Assert
+        ret = ctx.check(solver)
+        self.assertEquals(ret, z3.sat)
+        model = solver.model()
+        self.assertTrue(z3.is_true(model.eval(func(B, A) == LESS)))
+        self.assertTrue(z3.is_true(model.eval(func(A, C) == GREATER)))
+        # One constraint per value
+        self.assertEquals(len(list(ctx._compare_constraints(func.name))), 3)
+        solver = z3.Solver(ctx=ctx.z3_ctx)
+        solver.add(func(C, A) == GREATER)
+        solver.add(func(A, B) == GREATER)
+        solver.add(func(B, C) == GREATER)
+        self.assertEquals(ctx.check(solver), z3.unsat)
+
+    def test_check_track_unsat(self):
+        # Arrange
+        ctx = SolverContext(z3.Context())
+        var = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+        ctx.register_constraint(var.var > 3, name='greater')
+        ctx.register_constraint(True, name='concrete')
+        solver = z3.Solver(ctx=ctx.z3_ctx)
+        solver.add(var.var < 10)
+        # Act
+        ret = ctx.check(solver, track=False, track_unsat=True)
+        # Assert
+        self.assertEquals(ret, z3.sat)
+        self.assertTrue(var.is_concrete)
+        self.assertTrue(3 < var.get_value() < 10)
+        # Unsat core of the registered and the solver's constraints
+        ctx = SolverContext(z3.Context())
+        var = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+        ctx.register_constraint(var.var > 3, name='greater')
+        ctx.register_constraint(var.var < 2, name='less')
+        solver = z3.Solver(ctx=ctx.z3_ctx)
+        solver.add(var.var < 10)
+        ret = ctx.check(solver, track=False, track_unsat=True)
+        self.assertEquals(ret, z3.unsat)
+        self.assertEquals(sorted([str(c) for c in solver.unsat_core()]),
+                          ['greater', 'less'])
+
+    def test_check_cache(self):
+        # Arrange
+        cache_dir = tempfile.mkdtemp()
+        cache = SMTCache(cache_dir)
+
+        def get_ctx():
+            ctx = SolverContext(z3.Context())
+            vsort = ctx.create_enum_type('TestType', ['A', 'B', 'C'])
+            var1 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+            var2 = ctx.create_fresh_var(vsort)
+            ctx.register_constraint(var1.var > 3, name='greater')
+            ctx.register_constraint(var1.var < 5, name='less')
+            ctx.register_constraint(
+                var2.var != vsort.get_symbolic_value('A'), name='not_a')
+            return ctx, var1, var2
+
+        try:
+            # Act
+            ctx, _, _ = get_ctx()
+            ret1 = ctx.check(z3.Solver(ctx=ctx.z3_ctx), cache=cache)
+            ctx, var1, var2 = get_ctx()
+            ret2 = ctx.check(z3.Solver(ctx=ctx.z3_ctx), cache=cache)
+            # Assert
+            self.assertEquals(ret1, z3.sat)
+            self.assertEquals(ret2, z3.sat)
+            self.assertEquals((cache.hits, cache.misses), (1, 1))
+            self.assertEquals(var1.get_value(), 4)
+            self.assertIn(var2.get_value(), ['B', 'C'])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_fold_constraints(self):
+        # Arrange
+        ctx = SolverContext(z3.Context())
+        vsort = ctx.create_enum_type('TestType', ['A', 'B', 'C'])
+        var1 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+        var2 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), value=5)
+        var3 = ctx.create_fresh_var(vsort, value='A')
+        ctx.register_constraint(var1.var > 3, name='symbolic')
+        # Concrete after substituting the value of var2
+        ctx.register_constraint(var2.get_var() > 3, name='int_true')
+        ctx.register_constraint(var3.var == vsort.get_symbolic_value('A'), name='enum_true')
+        ctx.register_constraint(True, name='bool_true')
+        # Act
+        folded, false_names = ctx.fold_constraints()
+        # Assert
+        self.assertEquals([name for name, _ in folded], ['symbolic'])
+        self.assertEquals(false_names, [])
+        # False constraints are an early unsat
+        ctx.register_constraint(var3.var == vsort.get_symbolic_value('B'), name='enum_false')
+        solver = z3.Solver(ctx=ctx.z3_ctx)
+        folded, false_names = ctx.fold_constraints()
+        self.assertEquals(false_names, ['enum_false'])
+        self.assertEquals(ctx.check(solver), z3.unsat)
+        self.assertEquals([str(c) for c in solver.unsat_core()], ['enum_false'])
+
+    def test_fold_false_check(self):
+        # Arrange
+        cache_dir = tempfile.mkdtemp()
+        cache = SMTCache(cache_dir)
+
+        def get_ctx():
+            ctx = SolverContext(z3.Context())
+            var1 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+            var2 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx), value=5)
+            ctx.register_constraint(var1.var > 3, name='symbolic')
+            ctx.register_constraint(var2.var < 3, name='int_false')
+            return ctx
+
+        try:
+            # Act
+            ctx = get_ctx()
+            solver1 = z3.Solver(ctx=ctx.z3_ctx)
+            out_smt = os.path.join(cache_dir, 'out.smt2')
+            ret1 = ctx.check(solver1, track=False, track_unsat=True,
+                             out_smt=out_smt, cache=cache)
+            ctx = get_ctx()
+            solver2 = z3.Solver(ctx=ctx.z3_ctx)
+            ret2 = ctx.check(solver2, track=False, track_unsat=True,
+                             cache=cache)
+            ctx = get_ctx()
+            solver3 = z3.Solver(ctx=ctx.z3_ctx)
+            ret3 = ctx.check(solver3, fold=False)
+            # Assert
+            self.assertEquals(ret1, z3.unsat)
+            self.assertEquals(ret2, z3.unsat)
+            self.assertEquals((cache.hits, cache.misses), (1, 1))
+            self.assertTrue(os.path.exists(out_smt))
+            for solver in [solver1, solver2]:
+                self.assertEquals([str(c) for c in solver.unsat_core()],
+                                  ['int_false'])
+            self.assertEquals(ret3, z3.unsat)
+            self.assertIn('int_false', [str(c) for c in solver3.unsat_core()])
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test_fold_after_set_model(self):
+        # Arrange
+        def check_again(fold):
+            ctx = SolverContext(z3.Context())
+            var1 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+            ctx.register_constraint(var1.var > 3, name='gt')
+            solver = z3.Solver(ctx=ctx.z3_ctx)
+            ret1 = ctx.check(solver, fold=fold)
+            value1 = var1.get_value()
+            # Conflicts with the value of the first model
+            ctx.register_constraint(var1.get_var() != value1, name='ne')
+            solver.reset()
+            ret2 = ctx.check(solver, fold=fold)
+            return ret1, ret2
+        # Act
+        folded = check_again(fold=True)
+        unfolded = check_again(fold=False)
+        # Assert
+        self.assertEquals(folded, (z3.sat, z3.sat))
+        self.assertEquals(folded, unfolded)
+
+    def test_free_consts_after_fold(self):
+        # Arrange
+        ctx = SolverContext(z3.Context())
+        int_sort = z3.IntSort(ctx=ctx.z3_ctx)
+        var1 = ctx.create_fresh_var(int_sort)
+        var2 = ctx.create_fresh_var(int_sort, value=10)
+        var3 = ctx.create_fresh_var(int_sort)
+        ctx.register_constraint(var1.var > var2.get_var(), name='gt')
+        ctx.register_constraint(var1.var < var3.var + 5, name='lt')
+        ctx.register_constraint(var3.var != 0, name='ne')
+        # Act
+        folded, false_names = ctx.fold_constraints()
+        free = SolverContext._get_free_consts(folded)
+        # Assert
+        self.assertEquals(false_names, [])
+        self.assertEquals(len(folded), 3)
+        # var2 is substituted by its concrete value
+        self.assertEquals(sorted(str(const) for const in free.values()),
+                          sorted([var1.name, var3.name]))
+
     def test_set_model(self):
         # Arrange
         values = ['A', 'B', 'C']
@@ -382,6 +684,59 @@ class SolverContextTest(unittest.TestCase):
         self.assertEquals(var2.get_value(), 10)
         self.assertEquals(var3.get_value(), True)
 
+    def test_set_model_lazy(self):
+        # Arrange
+        ctx = SolverContext(z3.Context())
+        var1 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+        var2 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+        solver = z3.Solver(ctx=ctx.z3_ctx)
+        solver.add(var1.var == 10)
+        solver.add(var2.var == 20)
+        self.assertEquals(solver.check(), z3.sat)
+        # Act
+        ctx.set_model(solver.model())
+        var3 = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+        # Assert
+        self.assertTrue(var1.is_concrete)
+        self.assertTrue(var2.is_concrete)
+        # Only the model of the vars created before set_model
+        self.assertFalse(var3.is_concrete)
+        self.assertEquals([var1.get_value(), var2.get_value()], [10, 20])
+        self.assertEquals(var1.var, 10)
+
+    def test_eval_vars(self):
+        def solve():
+            ctx = SolverContext(z3.Context())
+            vsort = ctx.create_enum_type('TestType', ['A', 'B', 'C'])
+            int_var = ctx.create_fresh_var(z3.IntSort(ctx=ctx.z3_ctx))
+            bool_var = ctx.create_fresh_var(z3.BoolSort(ctx=ctx.z3_ctx))
+            enum_var = ctx.create_fresh_var(vsort)
+            solver = z3.Solver(ctx=ctx.z3_ctx)
+            solver.add(int_var.var == 10)
+            solver.add(bool_var.var == False)
+            solver.add(enum_var.var == vsort.get_symbolic_value('B'))
+            self.assertEquals(solver.check(), z3.sat)
+            ctx.set_model(solver.model())
+            return ctx, [int_var, bool_var, enum_var]
+
+        # Arrange
+        ctx1, vars1 = solve()
+        ctx2, vars2 = solve()
+        # Act
+        values1 = [var.get_value() for var in vars1]
+        ctx2.eval_vars(vars2)
+        # Assert
+        # The values are set in place
+        for var in vars2:
+            self.assertTrue(var._is_concrete)
+            self.assertTrue(var._from_model)
+        self.assertEquals(values1, [10, False, 'B'])
+        self.assertEquals([var.get_value() for var in vars2], values1)
+        # All the registered vars
+        ctx3, vars3 = solve()
+        ctx3.eval_vars()
+        self.assertEquals([var.get_value() for var in vars3], values1)
+
 
 @attr(speed='fast')
 class ReadAnnouncementsTest(unittest.TestCase):
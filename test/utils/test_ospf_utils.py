@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Test the OSPF utilities
+"""
+
+import unittest
+
+import networkx as nx
+import numpy as np
+import z3
+from nose.plugins.attrib import attr
+
+from synet.utils.ospf_utils import OSPF_MAX_COST
+from synet.utils.ospf_utils import PathHistory
+from synet.utils.ospf_utils import PathRegistry
+from synet.utils.ospf_utils import create_cost_var
+from synet.utils.ospf_utils import get_compact_graph
+from synet.utils.ospf_utils import get_path_cost_bits
+from synet.utils.ospf_utils import invalidate_compact_graph
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+@attr(speed='fast')
+class TestPathRegistry(unittest.TestCase):
+    def get_graph(self):
+        graph = nx.DiGraph()
+        graph.add_edge('R_1', 'R_2', cost=z3.Int('cost_R_1_R_2'))
+        graph.add_edge('R_2', 'R_3', cost=5)
+        graph.add_edge('R_1', 'R_2_R_3', cost=z3.Int('cost_R_1_R_2_R_3'))
+        graph.add_edge('R_2_R_3', 'R_3', cost=2)
+        return graph
+
+    def test_ids(self):
+        registry = PathRegistry(self.get_graph())
+        path1 = ['R_1', 'R_2', 'R_3']
+        path2 = ['R_1', 'R_2_R_3', 'R_3']
+        self.assertEquals(registry.get_id(path1), registry.get_id(tuple(path1)))
+        self.assertNotEquals(registry.get_id(path1), registry.get_id(path2))
+        self.assertNotEquals(registry.get_name(path1), registry.get_name(path2))
+        self.assertEquals(registry.get_path(registry.get_id(path2)), tuple(path2))
+
+    def test_cost(self):
+        graph = self.get_graph()
+        registry = PathRegistry(graph)
+        path = ['R_1', 'R_2', 'R_3']
+        cost = registry.get_cost(path)
+        self.assertIs(registry.get_cost(path), cost)
+        expected = sum([graph[src][dst]['cost']
+                        for src, dst in zip(path[0::1], path[1::1])])
+        solver = z3.Solver()
+        solver.add(cost != expected)
+        self.assertEquals(solver.check(), z3.unsat)
+        # Prefixes are memoized too
+        self.assertEquals(registry.get_cost(['R_1']), 0)
+        self.assertEquals(registry.get_cost(['R_2', 'R_3']), 5)
+        self.assertEquals(registry.get_cost(['R_2_R_3', 'R_3']), 2)
+
+    def test_drop_costs(self):
+        graph = self.get_graph()
+        registry = PathRegistry(graph)
+        path1 = ['R_1', 'R_2', 'R_3']
+        path2 = ['R_1', 'R_2_R_3', 'R_3']
+        registry.get_cost(path1)
+        cost2 = registry.get_cost(path2)
+        graph['R_2']['R_3']['cost'] = 7
+        registry.drop_costs([('R_2', 'R_3')])
+        self.assertEquals(registry.get_cost(['R_2', 'R_3']), 7)
+        self.assertIs(registry.get_cost(path2), cost2)
+
+    def test_drop_paths(self):
+        registry = PathRegistry(self.get_graph())
+        path1 = ['R_1', 'R_2', 'R_3']
+        path2 = ['R_1', 'R_2_R_3', 'R_3']
+        id1 = registry.get_id(path1)
+        id2 = registry.get_id(path2)
+        self.assertEquals(registry.drop_paths([('R_2', 'R_3')]), set([id1]))
+        self.assertNotEquals(registry.get_id(path1), id1)
+        self.assertEquals(registry.get_path(id1), tuple(path1))
+        self.assertEquals(registry.get_id(path2), id2)
+
+
+@attr(speed='fast')
+class TestPathHistory(unittest.TestCase):
+    def get_registry(self):
+        graph = nx.DiGraph()
+        for src, dst in [('R1', 'R2'), ('R2', 'R4'), ('R1', 'R3'),
+                         ('R3', 'R4'), ('R2', 'R3')]:
+            graph.add_edge(src, dst, cost=z3.Int('cost_%s_%s' % (src, dst)))
+        return PathRegistry(graph)
+
+    def test_seen(self):
+        registry = self.get_registry()
+        history = PathHistory(registry)
+        path1 = ['R1', 'R2', 'R4']
+        path2 = ['R1', 'R3', 'R4']
+        self.assertFalse(history.seen(path1))
+        history.add(path1)
+        self.assertTrue(history.seen(path1))
+        self.assertTrue(history.seen(tuple(path1)))
+        # Encoded by another requirement but not generated by this one
+        registry.get_id(path2)
+        self.assertFalse(history.seen(path2))
+        self.assertEquals(len(history), 1)
+        self.assertGreater(history.memory_usage(), 0)
+        self.assertGreater(registry.memory_usage(), 0)
+
+    def test_hash_collision(self):
+        registry = self.get_registry()
+        history = PathHistory(registry)
+        other = PathHistory(registry)
+        path1 = ['R1', 'R2', 'R4']
+        path2 = ['R1', 'R3', 'R4']
+        history.add(path1)
+        other.add(path2)
+        # Collide the hash of path2 with path1 in this history
+        history._hashes[hash(tuple(path2))] = history._hashes.pop(
+            hash(tuple(path1)))
+        self.assertFalse(history.seen(path2))
+        self.assertTrue(other.seen(path2))
+
+    def test_eviction(self):
+        registry = self.get_registry()
+        history = PathHistory(registry, max_paths=2)
+        path1 = ['R1', 'R2', 'R4']
+        path2 = ['R1', 'R3', 'R4']
+        path3 = ['R1', 'R2', 'R3', 'R4']
+        history.add(path1)
+        history.add(path2)
+        # path1 becomes the most recently seen
+        self.assertTrue(history.seen(path1))
+        history.add(path3)
+        self.assertEquals(len(history), 2)
+        self.assertEquals(history.evicted, 1)
+        self.assertTrue(history.seen(path1))
+        self.assertFalse(history.seen(path2))
+        self.assertTrue(history.seen(path3))
+
+    def test_drop_ids(self):
+        registry = self.get_registry()
+        history = PathHistory(registry)
+        path1 = ['R1', 'R2', 'R4']
+        path2 = ['R1', 'R3', 'R4']
+        history.add(path1)
+        history.add(path2)
+        history.drop_ids(set([registry.get_id(path1)]))
+        self.assertEquals(len(history), 1)
+        self.assertFalse(history.seen(path1))
+        self.assertTrue(history.seen(path2))
+
+
+@attr(speed='fast')
+class TestCostEncoding(unittest.TestCase):
+    def test_bv_costs(self):
+        num_nodes = 40
+        graph = nx.DiGraph(encoding='bv', path_bits=get_path_cost_bits(num_nodes))
+        costs = [create_cost_var('cost_%d' % i, graph) for i in range(num_nodes - 1)]
+        solver = z3.Solver()
+        for cost in costs:
+            solver.add(cost > 0)
+        # The longest simple path with the maximum costs doesn't overflow
+        solver.add(sum(costs) == (num_nodes - 1) * OSPF_MAX_COST)
+        self.assertEquals(solver.check(), z3.sat)
+        model = solver.model()
+        values = [model.eval(cost).as_long() for cost in costs]
+        self.assertEquals(values, [OSPF_MAX_COST] * len(costs))
+
+    def test_int_costs(self):
+        graph = nx.DiGraph()
+        cost = create_cost_var('cost', graph)
+        self.assertEquals(cost.sort(), z3.IntSort())
+
+
+@attr(speed='fast')
+class TestCompactGraph(unittest.TestCase):
+    def get_graph(self):
+        graph = nx.DiGraph()
+        graph.add_edge('R1', 'R2', cost=z3.Int('cost_R1_R2'))
+        graph.add_edge('R2', 'R3', cost=5)
+        graph.add_edge('R1', 'R3', cost=10)
+        return graph
+
+    def test_cached(self):
+        graph = self.get_graph()
+        compact = get_compact_graph(graph)
+        self.assertIs(get_compact_graph(graph), compact)
+        self.assertEquals(compact.symbolic_ids.tolist(), [0])
+
+    def test_cost_changed(self):
+        graph = self.get_graph()
+        compact = get_compact_graph(graph)
+        graph['R1']['R3']['cost'] = 1
+        invalidate_compact_graph(graph)
+        new_compact = get_compact_graph(graph)
+        self.assertIsNot(new_compact, compact)
+        self.assertEquals(new_compact.costs[new_compact.edge_ids[('R1', 'R3')]], 1)
+        # Concrete cost to symbolic
+        graph['R2']['R3']['cost'] = z3.Int('cost_R2_R3')
+        invalidate_compact_graph(graph)
+        self.assertEquals(len(get_compact_graph(graph).symbolic_ids), 2)
+
+    def test_edge_replaced(self):
+        graph = self.get_graph()
+        compact = get_compact_graph(graph)
+        # Same number of edges
+        graph.remove_edge('R1', 'R3')
+        graph.add_edge('R3', 'R1', cost=3)
+        invalidate_compact_graph(graph)
+        new_compact = get_compact_graph(graph)
+        self.assertIsNot(new_compact, compact)
+        self.assertIn(('R3', 'R1'), new_compact.edge_ids)
+        self.assertNotIn(('R1', 'R3'), new_compact.edge_ids)
+
+    def test_nx_order(self):
+        graph = self.get_graph()
+        graph.add_edge('R3', 'R1', cost=3)
+        compact = get_compact_graph(graph)
+        order, out_list = compact.get_nx_order()
+        nx_graph = nx.DiGraph()
+        for src, dst in graph.edges():
+            nx_graph.add_edge(src, dst)
+        self.assertEquals([compact.edges[edge] for edge in order],
+                          list(nx_graph.edges()))
+        for node in nx_graph.nodes():
+            self.assertEquals(
+                [compact.nodes[compact.dst_list[edge]]
+                 for edge in out_list[compact.node_ids[node]]],
+                list(nx_graph[node]))
+        # Same path as nx.dijkstra_path, ties included
+        costs = [1] * compact.num_edges
+        self.assertEquals(
+            compact.shortest_path('R1', 'R3', costs, out_list),
+            nx.dijkstra_path(compact.to_nx(np.array(costs)), 'R1', 'R3', 'cost'))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Test the shortest path DAG based OSPF verifier
+"""
+
+import itertools
+import random
+import unittest
+
+import networkx as nx
+from nose.plugins.attrib import attr
+
+from synet.utils.ospf_verify import OSPFVerifier
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+@attr(speed='fast')
+class TestOSPFVerifier(unittest.TestCase):
+    def get_grid(self, size, max_cost, seed):
+        """Grid graph with small random costs (to get many ECMP paths)"""
+        rand = random.Random(seed)
+        graph = nx.DiGraph()
+        grid = nx.grid_2d_graph(size, size)
+        for src, dst in grid.edges():
+            graph.add_edge(src, dst, cost=rand.randint(1, max_cost))
+            graph.add_edge(dst, src, cost=rand.randint(1, max_cost))
+        return graph
+
+    def test_all_shortest_paths(self):
+        graph = self.get_grid(4, 2, 0)
+        verifier = OSPFVerifier(graph)
+        for src in graph.nodes():
+            for dst in graph.nodes():
+                if src == dst:
+                    continue
+                expected = set([tuple(p) for p in nx.all_shortest_paths(
+                    graph, src, dst, 'cost')])
+                computed = set([tuple(p) for p in verifier.all_shortest_paths(
+                    src, dst)])
+                self.assertEquals(computed, expected)
+
+    def test_count_shortest_paths(self):
+        graph = self.get_grid(4, 2, 0)
+        verifier = OSPFVerifier(graph)
+        for src in graph.nodes():
+            for dst in graph.nodes():
+                if src == dst:
+                    continue
+                expected = list(nx.all_shortest_paths(graph, src, dst, 'cost'))
+                self.assertEquals(
+                    verifier.count_shortest_paths(src, dst), len(expected))
+                for path in expected:
+                    self.assertTrue(verifier.is_shortest_path(path))
+                self.assertEquals(
+                    len(verifier.all_shortest_paths(src, dst, limit=2)),
+                    min(2, len(expected)))
+        # Longer and broken paths
+        self.assertFalse(verifier.is_shortest_path(
+            [(0, 0), (0, 1), (0, 0), (1, 0)]))
+        self.assertFalse(verifier.is_shortest_path([(0, 0), (1, 1)]))
+
+    def test_count_equal_costs(self):
+        # Exponentially many paths are counted without enumerating them
+        size = 12
+        graph = nx.DiGraph()
+        for src, dst in nx.grid_2d_graph(size, size).edges():
+            graph.add_edge(src, dst, cost=1)
+            graph.add_edge(dst, src, cost=1)
+        verifier = OSPFVerifier(graph)
+        src, dst = (0, 0), (size - 1, size - 1)
+        binomial = 1
+        for i in range(size - 1):
+            binomial = binomial * (2 * (size - 1) - i) / (i + 1)
+        self.assertEquals(verifier.count_shortest_paths(src, dst), binomial)
+        dag = verifier.get_dag(dst).fail_edge((0, 0), (0, 1))
+        self.assertEquals(dag.count_shortest_paths(src), binomial / 2)
+
+    def test_dag_shared(self):
+        graph = self.get_grid(3, 5, 1)
+        verifier = OSPFVerifier(graph)
+        dst = (2, 2)
+        self.assertIs(verifier.get_dag(dst), verifier.get_dag(dst))
+
+    def test_no_path(self):
+        graph = nx.DiGraph()
+        graph.add_edge('R1', 'R2', cost=1)
+        graph.add_edge('R3', 'R2', cost=1)
+        verifier = OSPFVerifier(graph)
+        self.assertEquals(verifier.all_shortest_paths('R1', 'R2'), [['R1', 'R2']])
+        with self.assertRaises(nx.NetworkXNoPath):
+            verifier.all_shortest_paths('R2', 'R1')
+
+    def test_fail_edge(self):
+        graph = self.get_grid(4, 3, 2)
+        verifier = OSPFVerifier(graph)
+        dst = (3, 3)
+        for src, nxt in graph.edges():
+            dag = verifier.get_dag(dst).fail_edge(src, nxt)
+            failed = graph.copy()
+            failed.remove_edge(src, nxt)
+            expected = nx.single_source_dijkstra_path_length(
+                failed.reverse(), dst, weight='cost')
+            for node in graph.nodes():
+                if node not in expected:
+                    self.assertFalse(dag.has_path(node))
+                    continue
+                self.assertEquals(dag.distance(node), expected[node])
+                if node == dst:
+                    continue
+                self.assertEquals(
+                    sorted(dag.all_shortest_paths(node)),
+                    sorted(nx.all_shortest_paths(failed, node, dst, 'cost')))
+
+    def test_find_failure(self):
+        graph = self.get_grid(3, 4, 3)
+        src, dst = (0, 0), (2, 2)
+        for limit in range(10, 15):
+            def is_valid(dag):
+                # Shortest path is never longer than limit
+                return not dag.has_path(src) or dag.distance(src) <= limit
+
+            for max_failures in [1, 2]:
+                expected = False
+                for num in range(max_failures + 1):
+                    for failed in itertools.combinations(graph.edges(), num):
+                        copy = graph.copy()
+                        copy.remove_edges_from(failed)
+                        try:
+                            cost = nx.shortest_path_length(copy, src, dst, 'cost')
+                        except nx.NetworkXNoPath:
+                            continue
+                        if cost > limit:
+                            expected = True
+                verifier = OSPFVerifier(graph)
+                failure = verifier.find_failure(src, dst, is_valid, max_failures)
+                self.assertEquals(failure is not None, expected)
+                if failure is not None:
+                    self.assertLessEqual(len(failure.failed), max_failures)
+                    self.assertFalse(is_valid(failure))
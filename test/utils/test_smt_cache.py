@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+Test caching the results of Z3 checks
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import z3
+from nose.plugins.attrib import attr
+
+from synet.utils.smt_cache import SMTCache
+from synet.utils.smt_cache import formula_key
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+@attr(speed='fast')
+class TestSMTCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_solver(self, upper):
+        ctx = z3.Context()
+        vertex, (v_a, _, _) = z3.EnumSort('Vertex', ['A', 'B', 'C'], ctx=ctx)
+        var = z3.Const('v', vertex)
+        cost = z3.Int('cost', ctx)
+        solver = z3.Solver(ctx=ctx)
+        solver.assert_and_track(var != v_a, 'not_a')
+        solver.assert_and_track(cost > 3, 'cost_lower')
+        solver.assert_and_track(cost < upper, 'cost_upper')
+        tracked = [z3.Bool(name, ctx)
+                   for name in ['not_a', 'cost_lower', 'cost_upper']]
+        return solver, var, cost, tracked
+
+    def test_sat(self):
+        cache = SMTCache(self.cache_dir)
+        solver, _, _, tracked = self.get_solver(10)
+        self.assertEquals(cache.check(solver, tracked=tracked), z3.sat)
+        self.assertEquals((cache.hits, cache.misses, cache.stores), (0, 1, 1))
+        # Same formula in a new context
+        solver, var, cost, tracked = self.get_solver(10)
+        self.assertEquals(cache.check(solver, tracked=tracked), z3.sat)
+        self.assertEquals((cache.hits, cache.misses, cache.stores), (1, 1, 1))
+        model = solver.model()
+        self.assertTrue(3 < model.eval(cost).as_long() < 10)
+        self.assertNotEquals(str(model.eval(var)), 'A')
+
+    def test_unsat(self):
+        cache = SMTCache(self.cache_dir)
+        solver, _, _, tracked = self.get_solver(2)
+        self.assertEquals(cache.check(solver, tracked=tracked), z3.unsat)
+        solver, _, _, tracked = self.get_solver(2)
+        self.assertEquals(cache.check(solver, tracked=tracked), z3.unsat)
+        self.assertEquals(cache.hits, 1)
+        core = set([str(lit) for lit in solver.unsat_core()])
+        self.assertEquals(core, set(['cost_lower', 'cost_upper']))
+
+    def test_key(self):
+        ctx = z3.Context()
+        x, y = z3.Ints('x y', ctx)
+        solver1 = z3.Solver(ctx=ctx)
+        solver1.add(x > 1)
+        solver1.add(x < y)
+        solver2 = z3.Solver(ctx=ctx)
+        solver2.add(x < y)
+        solver2.add(x > 1)
+        key1 = formula_key(solver1.to_smt2())
+        self.assertEquals(key1, formula_key(solver2.to_smt2()))
+        self.assertNotEquals(key1, formula_key(solver1.to_smt2(), ['req']))
+        self.assertNotEquals(
+            key1, formula_key(solver1.to_smt2(), options={'logic': 'QF_LIA'}))
+
+    def test_evict(self):
+        cache = SMTCache(self.cache_dir, max_entries=2)
+        for upper in [5, 6, 7]:
+            solver, _, _, tracked = self.get_solver(upper)
+            cache.check(solver, tracked=tracked)
+        stats = cache.get_stats()
+        self.assertEquals(stats['entries'], 2)
+        self.assertEquals(stats['evictions'], 1)
+        # The oldest is evicted
+        solver, _, _, tracked = self.get_solver(5)
+        cache.check(solver, tracked=tracked)
+        self.assertEquals(cache.hits, 0)
+        cache.clear()
+        self.assertEquals(cache.get_stats()['entries'], 0)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Test checking Z3 solvers on a portfolio of configurations
+"""
+
+import unittest
+
+import z3
+from nose.plugins.attrib import attr
+
+from synet.utils.smt_portfolio import PortfolioConfig
+from synet.utils.smt_portfolio import SolverPortfolio
+from synet.utils.smt_portfolio import default_configs
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+@attr(speed='fast')
+class TestSolverPortfolio(unittest.TestCase):
+    def get_solver(self):
+        ctx = z3.Context()
+        vertex, (v_a, _, _) = z3.EnumSort('Vertex', ['A', 'B', 'C'], ctx=ctx)
+        var = z3.Const('v', vertex)
+        cost = z3.Int('cost', ctx)
+        func = z3.Function('f', vertex, z3.IntSort(ctx))
+        solver = z3.Solver(ctx=ctx)
+        solver.assert_and_track(var != v_a, 'not_a')
+        solver.assert_and_track(cost > 3, 'cost_lower')
+        solver.add(func(var) == cost)
+        tracked = [z3.Bool('not_a', ctx), z3.Bool('cost_lower', ctx)]
+        return solver, var, cost, tracked
+
+    def test_sat(self):
+        solver, var, cost, tracked = self.get_solver()
+        portfolio = SolverPortfolio(workers=2)
+        req = z3.Bool('req', solver.ctx)
+        solver.add(z3.Implies(req, cost < 10))
+        self.assertEquals(portfolio.check(solver, [req], tracked), z3.sat)
+        self.assertIsNotNone(portfolio.winner)
+        model = solver.model()
+        self.assertTrue(3 < model.eval(cost).as_long() < 10)
+        self.assertNotEquals(str(model.eval(var)), 'A')
+
+    def test_unsat(self):
+        solver, _, cost, tracked = self.get_solver()
+        portfolio = SolverPortfolio(default_configs(2))
+        req = z3.Bool('req', solver.ctx)
+        solver.add(z3.Implies(req, cost < 2))
+        self.assertEquals(portfolio.check(solver, [req], tracked), z3.unsat)
+        core = set([str(lit) for lit in solver.unsat_core()])
+        self.assertEquals(core, set(['req', 'cost_lower']))
+
+    def test_configs(self):
+        solver = z3.Solver()
+        costs = [z3.Int('c%d' % i) for i in range(10)]
+        for c1, c2 in zip(costs[0::1], costs[1::1]):
+            solver.add(c1 < c2)
+        configs = default_configs(3, logics=[None, 'QF_LIA'])
+        configs.append(PortfolioConfig(seed=5, tactic='qflia'))
+        # Less workers than configurations
+        portfolio = SolverPortfolio(configs, workers=2)
+        self.assertEquals(portfolio.check(solver), z3.sat)
+        model = solver.model()
+        values = [model.eval(c).as_long() for c in costs]
+        self.assertEquals(values, sorted(set(values)))
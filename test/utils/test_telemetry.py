@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Test the structured telemetry sinks
+"""
+
+import json
+import logging
+import unittest
+from StringIO import StringIO
+
+from nose.plugins.attrib import attr
+
+from synet.utils.telemetry import JSONLinesSink
+from synet.utils.telemetry import ListSink
+from synet.utils.telemetry import LoggingSink
+from synet.utils.telemetry import Telemetry
+
+
+__author__ = "Ahmed El-Hassany"
+__email__ = "a.hassany@gmail.com"
+
+
+@attr(speed='fast')
+class TestTelemetry(unittest.TestCase):
+    def test_list(self):
+        sink = ListSink()
+        telemetry = Telemetry([sink], seed=1)
+        self.assertTrue(telemetry.enabled)
+        telemetry.emit('cegis_iteration', iteration=1, solver_time=0.5)
+        telemetry.emit('cegis_iteration', iteration=2, solver_time=0.1)
+        self.assertEquals(len(sink.records), 2)
+        record = sink.records[1]
+        self.assertEquals(record['event'], 'cegis_iteration')
+        self.assertEquals(record['iteration'], 2)
+        self.assertEquals(record['seed'], 1)
+        self.assertIn('timestamp', record)
+
+    def test_json_lines(self):
+        out = StringIO()
+        telemetry = Telemetry([JSONLinesSink(out)])
+        telemetry.emit('solve', result='sat')
+        telemetry.emit('solve', result='unsat')
+        telemetry.close()
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEquals([r['result'] for r in records], ['sat', 'unsat'])
+
+    def test_logging(self):
+        out = StringIO()
+        logger = logging.getLogger('test_telemetry')
+        logger.propagate = False
+        logger.addHandler(logging.StreamHandler(out))
+        logger.setLevel(logging.INFO)
+        telemetry = Telemetry([LoggingSink(logger)])
+        telemetry.emit('solve', result='sat')
+        self.assertEquals(json.loads(out.getvalue())['result'], 'sat')
+
+    def test_disabled(self):
+        telemetry = Telemetry()
+        self.assertFalse(telemetry.enabled)
+        telemetry.emit('solve', result='sat')